@@ -1,9 +1,19 @@
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework.routers import DefaultRouter
-from rest_framework.mixins import ListModelMixin
-from rest_framework.serializers import ModelSerializer, HyperlinkedModelSerializer
+from rest_framework.pagination import BasePaginationSerializer
+from rest_framework.serializers import Field, ModelSerializer, HyperlinkedModelSerializer, SerializerMethodField
+from rest_framework.templatetags.rest_framework import replace_query_param
+from phillyleg.analytics import get_vote_summary
+from phillyleg.cities import get_current_city
 from phillyleg.models import CouncilMember, CouncilDistrict, CouncilDistrictPlan, LegFile, LegAction
+import hashlib
+import time
+
+from . import pagination
 
 """
 This API is definitely a work in progress.  It is a read-only API through
@@ -14,61 +24,324 @@ or contact admin@councilmatic.org.
 [GitHub]: https://github.com/codeforamerica/councilmatic
 """
 
-class CouncilmaticAPIViewSet (ReadOnlyModelViewSet):
-    paginate_by = 20
+class NextCursorField (Field):
+    """
+    A link to the page after a KeysetPage.
+    """
+    def to_native(self, page):
+        if not page.has_next():
+            return None
+        request = self.context.get('request')
+        url = request and request.build_absolute_uri() or ''
+        return replace_query_param(url, pagination.CURSOR_PARAM, page.next_cursor)
+
+
+class KeysetPaginationSerializer (BasePaginationSerializer):
+    count = Field(source='paginator.count')
+    next = NextCursorField(source='*')
+
+
+class SparseFieldsMixin (object):
+    """
+    Leaves out of a serializer the fields that aren't named in the request's
+    comma-separated ``fields`` parameter, if it has one (e.g.,
+    ``?fields=url,title``).
+    """
+    fields_param = 'fields'
+
+    def get_fields(self):
+        fields = super(SparseFieldsMixin, self).get_fields()
+
+        request = self.context.get('request')
+        names = request and request.QUERY_PARAMS.get(self.fields_param)
+        if names:
+            names = set(name.strip() for name in names.split(','))
+            for name in fields.keys():
+                if name not in names:
+                    del fields[name]
+
+        return fields
+
+
+class CouncilMemberSerializer (SparseFieldsMixin, HyperlinkedModelSerializer):
+    voting_record = SerializerMethodField('get_voting_record')
+
+    class Meta:
+        model = CouncilMember
+
+    def get_voting_record(self, member):
+        """
+        The member's participation in votes, the other members of their
+        voting bloc, and their agreement with each member they've voted
+        alongside (see phillyleg.analytics).
+        """
+        # The summary is fetched once for all of the members serialized.
+        if not hasattr(self, '_vote_summary'):
+            self._vote_summary = get_vote_summary()
+        summary = self._vote_summary
+        if summary is None:
+            return None
+
+        record = summary['members'].get(member.pk)
+        if record is None:
+            return None
+
+        bloc = summary['blocs'][record['bloc']] if record['bloc'] is not None else []
+        return {
+            'votes': record['votes'],
+            'present': record['present'],
+            'participation': record['participation'],
+            'bloc': [member_id for member_id in bloc if member_id != member.pk],
+            'agreement': [{'member': member_id,
+                           'agreement': score,
+                           'contested_agreement': contested_score,
+                           'shared_votes': shared}
+                          for member_id, score, contested_score, shared
+                          in record['agreement']],
+        }
+
+
+class DistrictSerializer (SparseFieldsMixin, HyperlinkedModelSerializer):
+    class Meta:
+        model = CouncilDistrict
+
+
+class DistrictPlanSerializer (SparseFieldsMixin, HyperlinkedModelSerializer):
+    class Meta:
+        model = CouncilDistrictPlan
+
+
+class LegislationActionSerializer (ModelSerializer):
+    class Meta:
+        model = LegAction
+        fields = ('id', 'date_taken', 'description', 'motion', 'acting_body', 'notes')
+
 
-    def get_serializer_class(self):
-        class TempSerializer (HyperlinkedModelSerializer):
-            class Meta:
-                model = self.model
-        return TempSerializer
+class LegislationSerializer (SparseFieldsMixin, HyperlinkedModelSerializer):
+    actions = LegislationActionSerializer()
 
+    class Meta:
+        model = LegFile
 
-class GroupModelMixin (ListModelMixin):
+
+class ActionSerializer (SparseFieldsMixin, HyperlinkedModelSerializer):
+    class Meta:
+        model = LegAction
+
+
+class GroupModelMixin (object):
+    """
+    Lets a group of objects be listed by giving a comma-separated list of keys
+    in place of a single key (e.g., ``/api/legislation/1,2,3/``).
+    """
     pksep = ','
 
+    def get_pks(self):
+        pk = self.kwargs.get(self.lookup_field)
+        if pk and self.pksep in pk:
+            return [bit for bit in pk.split(self.pksep) if bit]
+
     def get_queryset(self):
-        queryset = super(ParticularListModelMixin, self).get_queryset()
-        pks = self.kwargs.get('pks', None)
-        
+        queryset = super(GroupModelMixin, self).get_queryset()
+        pks = self.get_pks()
+
         if pks:
-            pks = pks.split(self.pksep)
-            queryset = queryset.filter(pk__in=pks)
+            try:
+                queryset = queryset.filter(pk__in=pks)
+            except ValueError, e:
+                raise Http404(e)
 
         return queryset
 
+    def retrieve(self, request, *args, **kwargs):
+        if self.get_pks():
+            return super(GroupModelMixin, self).list(request, *args, **kwargs)
+        return super(GroupModelMixin, self).retrieve(request, *args, **kwargs)
+
+
+class CouncilmaticAPIViewSet (GroupModelMixin, ReadOnlyModelViewSet):
+    """
+    Lists are paged through with the 'after' cursor in each page's 'next'
+    link.  The 'count' of a whole table is approximate.  Several objects can
+    be fetched at once with a comma-separated list of keys in place of one
+    key, and 'fields' limits the fields returned (e.g., '?fields=url,title').
+    Responses carry an ETag and a Last-Modified time, so that unchanged lists
+    and objects can be polled for with conditional requests.
+    """
+    paginate_by = 20
+    pagination_serializer_class = KeysetPaginationSerializer
+
+    keyset_ordering = ['pk']
+    """The order to page through objects in; it should end with a unique
+       field"""
+
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    """The related objects that the serializer uses, to be fetched along with
+       each page instead of once per object"""
+
+    last_modified_fields = ['updated_datetime']
+    """The update times (of the objects and of any related objects that they
+       include) that a response is as new as"""
+
+    city_field = 'city'
+    """The lookup of the city that each object belongs to; only the objects of
+       the request's city are served"""
+
+    def get_other_modified(self):
+        """
+        The update times of anything besides the queried objects that a
+        response includes (None where unknown); by default, nothing.
+        """
+        return []
+
+    _pagination_serializer_classes = {}
+
+    def get_queryset(self):
+        queryset = super(CouncilmaticAPIViewSet, self).get_queryset()
+        queryset = queryset.filter(**{self.city_field: get_current_city()})
+        if self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        if self.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*self.prefetch_related_fields)
+        return queryset
+
+    def get_pagination_serializer(self, page):
+        # Make the pagination serializer for each object serializer once,
+        # instead of on every request.
+        object_serializer_class = self.get_serializer_class()
+        serializer_class = self._pagination_serializer_classes.get(object_serializer_class)
+        if serializer_class is None:
+            class SerializerClass (self.pagination_serializer_class):
+                class Meta:
+                    object_serializer_class = self.get_serializer_class()
+
+            serializer_class = SerializerClass
+            self._pagination_serializer_classes[object_serializer_class] = serializer_class
+
+        # A KeysetPage is iterable, so say that it's one object, not many.
+        return serializer_class(instance=page, many=False,
+                                context=self.get_serializer_context())
+
+    def paginate_queryset(self, queryset, page_size=None):
+        page_size = page_size or self.get_paginate_by()
+        if not page_size:
+            return None
+
+        paginator = pagination.KeysetPaginator(queryset, self.keyset_ordering, page_size)
+        try:
+            return paginator.page(self.request.QUERY_PARAMS.get(pagination.CURSOR_PARAM))
+        except ValueError, e:
+            raise Http404(e)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(
+            queryset, super(CouncilmaticAPIViewSet, self).list,
+            request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not self.get_pks():
+            try:
+                queryset = queryset.filter(pk=self.kwargs.get(self.lookup_field))
+            except ValueError, e:
+                raise Http404(e)
+
+        return self.conditional_response(
+            queryset, super(CouncilmaticAPIViewSet, self).retrieve,
+            request, *args, **kwargs)
+
+    def get_validators(self, queryset):
+        """
+        The Last-Modified time and ETag of a response made from the queryset.
+        Both come from one aggregate query, so checking them is much cheaper
+        than building the response.  The ETag also changes when objects are
+        removed, or when the request asks for a different representation.
+        The update times from get_other_modified count too.
+        """
+        aggregates = dict(('modified_%d' % index, Max(field))
+                          for index, field in enumerate(self.last_modified_fields))
+        aggregates['count'] = Count('pk', distinct=True)
+        values = queryset.order_by().aggregate(**aggregates)
+
+        other_modified = self.get_other_modified()
+        modified = [values['modified_%d' % index]
+                    for index in range(len(self.last_modified_fields))]
+        modified = [value for value in modified + other_modified if value is not None]
+        last_modified = int(time.mktime(max(modified).timetuple())) if modified else None
+
+        accepted = getattr(self.request, 'accepted_media_type', '')
+        etag = hashlib.md5(repr([self.request.get_full_path(), accepted,
+                                 last_modified, values['count'],
+                                 other_modified])).hexdigest()
+        return last_modified, etag
+
+    def conditional_response(self, queryset, view_func, request, *args, **kwargs):
+        """
+        Respond with 304 Not Modified if the client already has the current
+        version of the response; otherwise call view_func to make it.
+        """
+        last_modified, etag = self.get_validators(queryset)
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_none_match:
+            not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+        elif if_modified_since and last_modified is not None:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+            not_modified = if_modified_since is not None and last_modified <= if_modified_since
+        else:
+            not_modified = False
+
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            response = view_func(request, *args, **kwargs)
+
+        response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
 
 class CouncilMemberViewSet (CouncilmaticAPIViewSet):
     model = CouncilMember
+    serializer_class = CouncilMemberSerializer
+    prefetch_related_fields = ['districts']
+    last_modified_fields = ['updated_datetime', 'votes__action__updated_datetime']
+
+    def get_other_modified(self):
+        # The voting records come from the cached vote summary.
+        summary = get_vote_summary()
+        return [summary.get('built_datetime')] if summary is not None else [None]
 
 
 class DistrictViewSet (CouncilmaticAPIViewSet):
     model = CouncilDistrict
+    serializer_class = DistrictSerializer
+    select_related_fields = ['plan']
+    city_field = 'plan__city'
 
 
 class DistrictPlanViewSet (CouncilmaticAPIViewSet):
     model = CouncilDistrictPlan
+    serializer_class = DistrictPlanSerializer
 
 
 class LegislationViewSet (CouncilmaticAPIViewSet):
     model = LegFile
-    def get_serializer_class(self):
-        class ActionSerializer (ModelSerializer):
-            class Meta:
-                model = LegAction
-                fields = ('id', 'date_taken', 'description', 'motion', 'acting_body', 'notes')
-
-        class LegislationSerializer (HyperlinkedModelSerializer):
-            actions = ActionSerializer()
-
-            class Meta:
-                model = LegFile
-
-        return LegislationSerializer
+    serializer_class = LegislationSerializer
+    keyset_ordering = ['-intro_date', '-key']
+    prefetch_related_fields = ['sponsors', 'actions']
+    last_modified_fields = ['updated_datetime', 'actions__updated_datetime']
 
 
 class ActionViewSet (CouncilmaticAPIViewSet):
     model = LegAction
+    serializer_class = ActionSerializer
+    select_related_fields = ['file', 'minutes']
+    city_field = 'file__city'
 
 
 router = DefaultRouter()
@@ -0,0 +1,186 @@
+"""
+Bulk export of the legislation, with its actions, votes, sponsors and topics.
+
+The export is of one city's legislation (see phillyleg.cities).  It is
+streamed: legislation is read from the database a chunk at a
+time, in key order, and each record is written out as soon as it's ready, so
+that the whole dataset can be downloaded in one request without being held in
+memory. With ``since``, only legislation that has changed (or whose actions or
+metadata have changed) since then is exported, so that a mirror can be kept up
+to date from the time of its last download.
+
+The formats are:
+
+* ``legislation.ndjson``: one JSON object per legislative file, with its
+  actions and their votes nested in it.
+* ``legislation.csv``, ``actions.csv`` and ``votes.csv``: one flat table each,
+  joined by the legislative file's key (and the action's id).
+"""
+
+import csv
+import datetime
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views import generic as views
+
+from phillyleg.cities import get_current_city
+from phillyleg.models import LegFile, LegFileMetaData
+from utils.querysets import iter_key_chunks
+
+
+EXPORT_CHUNK_SIZE = 500
+"""The number of legislative files to read from the database at a time"""
+
+LEGISLATION_FIELDS = ('key', 'id', 'type', 'status', 'title',
+                      'controlling_body', 'intro_date', 'final_date', 'url',
+                      'version', 'contact', 'is_routine', 'updated_datetime')
+ACTION_FIELDS = ('id', 'date_taken', 'description', 'motion', 'acting_body',
+                 'notes')
+
+
+def iter_legfiles(city, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generate the city's legislative files to export, in key order, with
+    everything that their records need prefetched a chunk at a time.
+    """
+    legfiles = LegFile.objects.filter(city=city)
+    if since is not None:
+        legfiles = legfiles.filter(
+            Q(updated_datetime__gte=since) |
+            Q(actions__updated_datetime__gte=since) |
+            Q(metadata__updated_datetime__gte=since)).distinct()
+
+    for keys in iter_key_chunks(legfiles, chunk_size):
+        chunk = LegFile.objects.filter(pk__in=keys).order_by('pk')\
+            .select_related('metadata')\
+            .prefetch_related('sponsors', 'metadata__topics',
+                              'actions__votes__voter')
+        for legfile in chunk:
+            yield legfile
+
+
+def legfile_record(legfile):
+    """
+    The export record for a legislative file, as a dict.
+    """
+    record = dict((field, getattr(legfile, field)) for field in LEGISLATION_FIELDS)
+    record['sponsors'] = [sponsor.real_name for sponsor in legfile.sponsors.all()]
+
+    try:
+        record['topics'] = [topic.topic for topic in legfile.metadata.topics.all()]
+    except LegFileMetaData.DoesNotExist:
+        record['topics'] = []
+
+    record['actions'] = []
+    for action in legfile.actions.all():
+        action_record = dict((field, getattr(action, field)) for field in ACTION_FIELDS)
+        action_record['votes'] = [{'voter': vote.voter.real_name, 'value': vote.value}
+                                  for vote in action.votes.all()]
+        record['actions'].append(action_record)
+
+    return record
+
+
+class Echo (object):
+    """
+    A file-like object that gives back what's written to it, so that a csv
+    writer can be used to render one row at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return unicode(value).encode('utf-8')
+
+
+class ExportView (views.View):
+    """
+    Stream the request's city's legislation in the requested table and
+    format.  Takes an optional ``since`` date or datetime.
+    """
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv; charset=utf-8',
+    }
+
+    tables = {
+        ('legislation', 'ndjson'): 'ndjson_legislation',
+        ('legislation', 'csv'): 'csv_legislation',
+        ('actions', 'csv'): 'csv_actions',
+        ('votes', 'csv'): 'csv_votes',
+    }
+
+    def get(self, request, table, format):
+        if (table, format) not in self.tables:
+            return HttpResponseBadRequest('There is no %s export in %s format.\n' % (table, format))
+
+        since = None
+        if request.GET.get('since'):
+            since = self.parse_since(request.GET['since'])
+            if since is None:
+                return HttpResponseBadRequest(
+                    'since should be a date (YYYY-MM-DD) or a datetime (YYYY-MM-DDTHH:MM:SS).\n')
+
+        # Note the time before reading anything, so that it can be used as the
+        # next download's since without missing changes made during this one.
+        export_time = datetime.datetime.now().replace(microsecond=0)
+
+        # The city is read now, rather than as the response is streamed.
+        render = getattr(self, self.tables[(table, format)])
+        legfiles = iter_legfiles(get_current_city(), since)
+        response = StreamingHttpResponse(render(legfiles),
+                                         content_type=self.content_types[format])
+        response['Content-Disposition'] = 'attachment; filename=%s.%s' % (table, format)
+        response['X-Export-Time'] = export_time.isoformat()
+        return response
+
+    def parse_since(self, value):
+        try:
+            since = parse_datetime(value)
+            if since is None:
+                date = parse_date(value)
+                if date is not None:
+                    since = datetime.datetime.combine(date, datetime.time())
+        except ValueError:
+            return None
+        return since
+
+    def ndjson_legislation(self, legfiles):
+        encoder = DjangoJSONEncoder()
+        for legfile in legfiles:
+            yield encoder.encode(legfile_record(legfile)) + '\n'
+
+    def csv_rows(self, header, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow([csv_value(value) for value in row])
+
+    def csv_legislation(self, legfiles):
+        header = LEGISLATION_FIELDS + ('sponsors', 'topics')
+        return self.csv_rows(header, (
+            [record[field] for field in LEGISLATION_FIELDS] +
+            ['; '.join(record['sponsors']), '; '.join(record['topics'])]
+            for record in (legfile_record(legfile) for legfile in legfiles)))
+
+    def csv_actions(self, legfiles):
+        header = ('file_key',) + ACTION_FIELDS
+        return self.csv_rows(header, (
+            [legfile.key] + [getattr(action, field) for field in ACTION_FIELDS]
+            for legfile in legfiles for action in legfile.actions.all()))
+
+    def csv_votes(self, legfiles):
+        header = ('file_key', 'action_id', 'voter', 'value')
+        return self.csv_rows(header, (
+            [legfile.key, action.id, vote.voter.real_name, vote.value]
+            for legfile in legfiles
+            for action in legfile.actions.all()
+            for vote in action.votes.all()))
@@ -1,5 +1,6 @@
 import json
 import logging
+import re
 from datetime import date, time, datetime
 from collections import defaultdict
 from itertools import chain
@@ -8,17 +9,25 @@ from urllib import urlencode
 
 from councilmatic.subscriptions.feeds import ContentFeed
 from councilmatic.subscriptions.feeds import ContentFeedLibrary
+from councilmatic.subscriptions.feeds import ContentFeedPercolator
+from councilmatic.search_cache import get_or_cache_search, normalize_search_params
+from phillyleg.cities import current_city, get_current_city
 from phillyleg.models import LegFile
+from phillyleg.models import LegFileMetaData
 from phillyleg.models import LegMinutes
-from haystack.query import SearchQuerySet
+from phillyleg.search_indexes import city_search_queryset
 
 
 log = logging.getLogger(__name__)
 library = ContentFeedLibrary()
 
 class NewLegislationFeed (ContentFeed):
+    def __init__(self, city=None):
+        super(NewLegislationFeed, self).__init__()
+        self.city = city or get_current_city()
+
     def get_content(self):
-        return LegFile.objects.all().order_by('-intro_date')
+        return LegFile.objects.filter(city=self.city).order_by('-intro_date')
 
     def get_updates_since(self, datetime):
         return self.get_content().filter(intro_date__gt=datetime)
@@ -34,7 +43,7 @@ class NewLegislationFeed (ContentFeed):
         return legfiles[0].intro_date
 
     def get_params(self):
-        return {}
+        return {'city': self.city}
 
     def get_label(self):
         return 'Newly introduced legislation'
@@ -143,15 +152,24 @@ class BookmarkedContentFeed (LegislationUpdatesFeed):
 
 
 class SearchResultsFeed (ContentFeed):
-    def __init__(self, search_filter):
+    def __init__(self, search_filter, city=None):
         """
         As you'll see in main.SearchView.get_content_feed, we use the value of
         search_view.results.queryset.query.query_filter to store the search.
         I'm not certain, but I'm pretty sure this value is search backend-
         specific.  Just keep that in mind.
 
+        The search is of the given city's legislation (by default, the current
+        city's), whichever city is current when the feed is read.
+
         """
-        if isinstance(search_filter, dict):
+        self.city = city or get_current_city()
+        if hasattr(search_filter, 'lists'):
+            # A QueryDict (e.g., request.GET); keep single values as scalars
+            # so that equivalent searches serialize identically.
+            self.filter = dict((key, vals if len(vals) > 1 else vals[0])
+                               for key, vals in search_filter.lists())
+        elif isinstance(search_filter, dict):
             self.filter = search_filter
         elif search_filter is not None:
             self.filter = json.loads(search_filter)
@@ -162,48 +180,126 @@ class SearchResultsFeed (ContentFeed):
     def filter_query(self):
         return urlencode(self.filter)
 
-    def get_content(self):
-        qs = SearchQuerySet()
-        search_fields = {
-            'q': 'text',
-            'controlling_bodies': 'controlling_body',
-            'statuses': 'status',
-            'file_types': 'file_type',
-        }
-
-        for key, val in self.filter.iteritems():
-            if key in search_fields:
-                field = search_fields[key]
-            else:
-                field = key
+    search_fields = {
+        'q': 'text',
+        'controlling_bodies': 'controlling_body',
+        'statuses': 'status',
+        'file_types': 'file_type',
+    }
+    """Map of { filter key : search index field }"""
 
-            if val in ([], {}, '', (), None):
-                continue
+    index_field_order = ['text', 'sponsors', 'topics', 'file_type',
+                         'controlling_body', 'status', 'city']
+    """The fields that content can be matched on, most selective first"""
 
-            if isinstance(val, list):
-                for item in val:
-                    qs = qs.filter(**{field: item})
-            else:
-                qs = qs.filter(**{field: val})
+    def get_content(self):
+        # The search backend is picked as the queryset is made.
+        with current_city(self.city):
+            qs = city_search_queryset()
+        search_fields = self.search_fields
+
+        # Normalized, so that paging and empty values in the filter (which is
+        # often taken straight from a search's request.GET) are left out, as
+        # they are from the search's cache key.
+        for key, vals in normalize_search_params(self.filter):
+            field = search_fields.get(key, key)
+            for item in vals:
+                qs = qs.filter(**{field: item})
 
         return qs.order_by('order_date')
 
-    def get_changes_to(self, item, datetime):
+    def get_changes_to(self, item, since):
+        # Pending content (see get_index_terms) is delivered as model
+        # instances instead of search results.
+        if isinstance(item, LegFile):
+            return {'Title': item.title}, datetime.combine(item.intro_date, time())
+        elif isinstance(item, LegMinutes):
+            return {'Minutes': str(item)}, (datetime.combine(item.date_taken, time())
+                                            if item.date_taken else datetime.min)
+
         if item.model_name == 'legfile':
             return {'Title': item.object.title}, item.order_date
         elif item.model_name == 'legminutes':
             return {'Minutes': str(item.object)}, item.order_date
 
+    def get_index_terms(self):
+        """
+        The search filter (and the city), as terms that every result must
+        have.  Keywords are matched by word, so this is an approximation of
+        the search backend's own analysis.
+        """
+        terms = [('city', self.city)]
+        for key, val in self.filter.iteritems():
+            if val in ([], {}, '', (), None):
+                continue
+
+            field = self.search_fields.get(key, key)
+            if field not in self.index_field_order:
+                return None
+
+            vals = val if isinstance(val, list) else [val]
+            for item in vals:
+                if field == 'text':
+                    terms.extend((field, word) for word in self._words(item))
+                else:
+                    terms.append((field, unicode(item).lower()))
+
+        # Longer words and values tend to be rarer, so index by those.
+        terms.sort(key=lambda (field, value): (
+            self.index_field_order.index(field), -len(value)))
+        return terms
+
+    @classmethod
+    def get_terms_for(cls, item):
+        if isinstance(item, LegMinutes):
+            terms = set(('text', word) for word in cls._words(item.fulltext))
+            terms.add(('city', item.city))
+            return terms
+
+        legfile = item
+        terms = set(('text', word) for word in
+                    cls._words(u' '.join([legfile.all_text(), legfile.id or ''])))
+        terms.update([('city', legfile.city),
+                      ('status', (legfile.status or '').lower()),
+                      ('controlling_body', (legfile.controlling_body or '').lower()),
+                      ('file_type', (legfile.type or '').lower())])
+
+        for sponsor in legfile.sponsors.all().prefetch_related('aliases'):
+            terms.add(('sponsors', sponsor.real_name.lower()))
+            terms.update(('sponsors', alias.name.lower())
+                         for alias in sponsor.aliases.all())
+
+        try:
+            terms.update(('topics', topic.topic.lower())
+                         for topic in legfile.metadata.topics.all())
+        except LegFileMetaData.DoesNotExist:
+            pass
+
+        return terms
+
+    @staticmethod
+    def _words(text):
+        return set(re.findall(r'\w+', text.lower(), re.UNICODE))
+
     def get_last_updated_time(self):
-        content = self.get_content()
-        return (list(content))[-1].order_date
+        # Equivalent feeds share the answer until the index is next updated.
+        # (The cache is partitioned by the current city.)
+        with current_city(self.city):
+            return get_or_cache_search('feed_last_updated', self.filter,
+                                       self._get_last_updated_time)
+
+    def _get_last_updated_time(self):
+        # Only fetch the latest result; we don't need the rest.
+        latest = self.get_content().order_by('-order_date')[:1]
+        if latest:
+            return latest[0].order_date
 
     def get_updates_since(self, datetime):
         new_content = self.get_content().filter(order_date__gt=datetime).order_by('order_date')
         return new_content
 
     def get_params(self):
-        return {'search_filter': json.dumps(self.filter)}
+        return {'search_filter': self.filter, 'city': self.city}
 
     def get_label(self):
         label = 'New '
@@ -223,6 +319,81 @@ class SearchResultsFeed (ContentFeed):
         return label
 
 
+#
+# Mark the feed records affected by changes to legislation as stale, so that
+# the updatefeeds command only has to recalculate those.
+#
+
+from django.contrib.contenttypes.models import ContentType
+from bookmarks.models import Bookmark
+from phillyleg.models import LegAction
+
+def mark_legfile_feeds_stale(legfile_pk):
+    library.mark_stale(LegislationUpdatesFeed, pk=legfile_pk)
+
+    legfile_type = ContentType.objects.get_for_model(LegFile)
+    bookmarkers = Bookmark.objects.filter(content_type=legfile_type,
+                                          content_id=legfile_pk)
+    for user_pk in bookmarkers.values_list('user', flat=True).distinct():
+        library.mark_stale(BookmarkedContentFeed, user=user_pk)
+
+
+@receiver(post_save, sender=LegFile, dispatch_uid='legfile_feeds_stale')
+def mark_feeds_stale_for_legfile(sender, **kwargs):
+    legfile = kwargs.get('instance')
+    if kwargs.get('raw'):
+        return
+
+    # Only a new file is new legislation.  The search feeds that the file
+    # may have changed are marked once it is indexed, with its sponsors and
+    # topics; see mark_search_feeds_stale.
+    if kwargs.get('created'):
+        library.mark_stale(NewLegislationFeed, city=legfile.city)
+    mark_legfile_feeds_stale(legfile.pk)
+
+
+@receiver(post_save, sender=LegAction, dispatch_uid='legaction_feeds_stale')
+def mark_feeds_stale_for_legaction(sender, **kwargs):
+    action = kwargs.get('instance')
+    if kwargs.get('raw'):
+        return
+
+    mark_legfile_feeds_stale(action.file_id)
+
+
+@receiver(post_save, sender=Bookmark, dispatch_uid='bookmark_feeds_stale')
+def mark_feeds_stale_for_bookmark(sender, **kwargs):
+    bookmark = kwargs.get('instance')
+    if kwargs.get('raw'):
+        return
+
+    library.mark_stale(BookmarkedContentFeed, user=bookmark.user_id)
+
+
+#
+# Match newly scraped content against the indexed search feeds.
+#
+
+from phillyleg.signals import content_indexed, legfile_scraped, legminutes_scraped
+
+@receiver(legfile_scraped, dispatch_uid='percolate_scraped_legfile')
+@receiver(legminutes_scraped, dispatch_uid='percolate_scraped_legminutes')
+def percolate_scraped_content(sender, **kwargs):
+    content = kwargs.get('instance')
+    ContentFeedPercolator().percolate(SearchResultsFeed, content, library)
+
+
+# Matching content against the search feeds is too slow to do on every save
+# while scraping, and the search feeds that aren't indexed read the search
+# index anyway, so the search feeds are marked stale once their content has
+# been indexed.
+@receiver(content_indexed, dispatch_uid='search_feeds_stale')
+def mark_search_feeds_stale(sender, **kwargs):
+    percolator = ContentFeedPercolator()
+    for content in kwargs.get('instances'):
+        percolator.mark_stale(SearchResultsFeed, content, library)
+
+
 def register_feeds():
     library.register(NewLegislationFeed, 'newly introduced legislation')
     library.register(LegislationUpdatesFeed, 'updates to a piece of legislation')
@@ -6,17 +6,20 @@ import uni_form.helpers as helpers
 
 
 def legfile_choices(field):
+    from phillyleg.cities import get_current_city
     from phillyleg.models import LegFile
-    value_objs = LegFile.objects.values(field).distinct().order_by(field)
+    value_objs = LegFile.objects.filter(city=get_current_city())\
+        .values(field).distinct().order_by(field)
     values = [(value_obj[field], value_obj[field])
               for value_obj in value_objs]
     return values
 
 
 def councilmember_choices():
+    from phillyleg.cities import get_current_city
     from phillyleg.models import CouncilMember
     values = [(member.real_name, member.real_name)
-              for member in CouncilMember.objects.all().order_by('real_name')]
+              for member in CouncilMember.objects.filter(city=get_current_city()).order_by('real_name')]
     return values
 
 def topic_choices():
@@ -26,6 +29,73 @@ def topic_choices():
     return values
 
 
+SEARCH_FACETS = (
+    # (form field, search index field, LegFile field)
+    ('topics', 'topics', None),
+    ('statuses', 'status', 'status'),
+    ('controlling_bodies', 'controlling_body', 'controlling_body'),
+    ('file_types', 'file_type', 'type'),
+    ('sponsors', 'sponsors', None),
+)
+
+SEARCH_FACET_CACHE_TIMEOUT = 60 * 60
+
+
+def facet_counts(sqs):
+    """
+    Count the results of a search for each value of the facet fields.  Returns
+    a dict of { form field : [(value, count), ...] }, or None if the search
+    backend doesn't do faceting.
+    """
+    for _, index_field, _ in SEARCH_FACETS:
+        sqs = sqs.facet(index_field)
+
+    # Haystack names the counts after the fields we faceted on, rather than
+    # their (exact) facet fields.
+    fields = sqs.facet_counts().get('fields')
+    if not fields:
+        return None
+
+    return dict((form_field, fields.get(index_field, []))
+                for form_field, index_field, _ in SEARCH_FACETS)
+
+
+def search_facet_choices():
+    """
+    The choices for each facet field over all of the legislation, as a dict of
+    { form field : [(value, label), ...] }.  They are cached until the search
+    index is updated, or for an hour at most.
+    """
+    from django.core.cache import cache
+    from phillyleg.models import LegFile
+    from phillyleg.search_indexes import city_search_queryset, get_index_version
+
+    cache_key = 'search_facet_choices:%s' % get_index_version()
+    choices = cache.get(cache_key)
+    if choices is None:
+        # Topics and sponsors have (small) tables of their own.  The values of
+        # the other fields are only found on the legislation, so get those
+        # from the search backend's facets rather than scanning the table,
+        # unless the backend doesn't do faceting.
+        choices = {
+            'topics': topic_choices(),
+            'sponsors': councilmember_choices(),
+        }
+
+        counts = facet_counts(city_search_queryset().models(LegFile))
+        for form_field, _, legfile_field in SEARCH_FACETS:
+            if legfile_field is None:
+                continue
+            elif counts is not None:
+                choices[form_field] = [(value, value) for value, count
+                                       in sorted(counts[form_field]) if count]
+            else:
+                choices[form_field] = legfile_choices(legfile_field)
+
+        cache.set(cache_key, choices, SEARCH_FACET_CACHE_TIMEOUT)
+    return choices
+
+
 class SimpleSearchForm (haystack.forms.SearchForm):
     q = django.forms.CharField(label='Keywords')
 
@@ -53,31 +123,33 @@ class SimpleSearchForm (haystack.forms.SearchForm):
 
 class FullSearchForm (haystack.forms.SearchForm):
     topics = django.forms.MultipleChoiceField(
-        choices=topic_choices(),
         widget=django.forms.CheckboxSelectMultiple(),
         label="Narrow by topics &raquo;",
         required=False)
     statuses = django.forms.MultipleChoiceField(
-        choices=legfile_choices('status'),
         widget=django.forms.CheckboxSelectMultiple(),
         label="Narrow by status &raquo;",
         required=False)
     controlling_bodies = django.forms.MultipleChoiceField(
-        choices=legfile_choices('controlling_body'),
         widget=django.forms.CheckboxSelectMultiple(),
         label="Narrow by controlling body &raquo;",
         required=False)
     file_types = django.forms.MultipleChoiceField(
-        choices=legfile_choices('type'),
         widget=django.forms.CheckboxSelectMultiple(),
         label="Narrow by type of legislation &raquo;",
         required=False)
     sponsors = django.forms.MultipleChoiceField(
-        choices=councilmember_choices(),
         widget=django.forms.CheckboxSelectMultiple(),
         label="Narrow by sponsors &raquo;",
         required=False)
 
+    def __init__(self, *args, **kwargs):
+        super(FullSearchForm, self).__init__(*args, **kwargs)
+
+        facet_choices = search_facet_choices()
+        for form_field, _, _ in SEARCH_FACETS:
+            self.fields[form_field].choices = facet_choices[form_field]
+
     @property
     def helper(self):
         """We call this as a method/property so we don't make the form helper
@@ -0,0 +1,4 @@
+# Django imports the models module of every installed app when it starts up.
+# Import the feeds here so that their signal receivers are connected in every
+# process (e.g., the scrapers), and not just in those that load the views.
+from . import feeds
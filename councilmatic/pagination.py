@@ -0,0 +1,164 @@
+"""
+Keyset pagination.
+
+Rather than skipping over the objects on earlier pages (which gets slower the
+deeper the page), each page is selected by the position of the last object on
+the page before it: its values for the fields that the list is ordered by.
+The position is passed from page to page as a cursor, such as
+``?after=2012-01-03_1234``.  A cursor stays valid as objects are added, so
+crawlers can follow them without skipping or repeating objects.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_unicode
+import operator
+
+
+CURSOR_PARAM = 'after'
+"""The query parameter that pages are selected by"""
+
+
+def make_cursor(values):
+    """
+    Make a cursor for the position given by a list of field values.
+    """
+    return u'_'.join(value.isoformat() if hasattr(value, 'isoformat')
+                     else force_unicode(value) for value in values)
+
+
+def parse_cursor(cursor, fields):
+    """
+    Get back the values from a cursor, as the python values of the given model
+    fields.  Raises a ValueError if the cursor isn't valid for the fields.
+    """
+    bits = cursor.split('_')
+    if len(bits) != len(fields):
+        raise ValueError('Expected a cursor with %d values; got %r' %
+                         (len(fields), cursor))
+
+    try:
+        return [field.to_python(bit) for field, bit in zip(fields, bits)]
+    except ValidationError, e:
+        raise ValueError('Invalid cursor %r: %s' % (cursor, e))
+
+
+def page_url(request, cursor):
+    """
+    The URL of the requested list, at the page after the cursor, or at the
+    first page if the cursor is None.
+    """
+    params = request.GET.copy()
+    params.pop('page', None)
+    params.pop(CURSOR_PARAM, None)
+    if cursor is not None:
+        params[CURSOR_PARAM] = cursor
+
+    url = request.path
+    if params:
+        url += '?' + params.urlencode()
+    return url
+
+
+def approximate_count(queryset):
+    """
+    The number of objects in the queryset.  Counting every row in a large table
+    is slow on PostgreSQL, so for a queryset over a whole table, use the query
+    planner's estimate instead.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        cursor = connection.cursor()
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+
+        # Tables that have never been analyzed have no estimate.
+        if row and row[0] > 0:
+            return int(row[0])
+
+    return queryset.count()
+
+
+class KeysetPage (object):
+    """
+    A page of objects, with the cursor for the page after it.  It has enough
+    of the interface of Django's ``Page`` to be listed in templates.
+    """
+    def __init__(self, object_list, next_cursor, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator (object):
+    """
+    Pages through a queryset in the order of the given fields.  The fields
+    (e.g., ``['-intro_date', '-key']``) should end with a unique one, so that
+    every object has a distinct position.
+    """
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+
+        opts = queryset.model._meta
+        self.fields = [opts.pk if name == 'pk' else opts.get_field(name)
+                       for name in self.field_names]
+
+    @property
+    def field_names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    @property
+    def count(self):
+        if not hasattr(self, '_count'):
+            self._count = approximate_count(self.queryset)
+        return self._count
+
+    def page(self, cursor=None):
+        """
+        The page of objects after the position in the cursor, or the first
+        page if there's no cursor.  Raises a ValueError for a bad cursor.
+        """
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self.after(parse_cursor(cursor, self.fields)))
+
+        # Get one more object than fits, to see whether there's a next page.
+        objs = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(objs) > self.per_page:
+            objs = objs[:self.per_page]
+            next_cursor = self.cursor_for(objs[-1])
+
+        return KeysetPage(objs, next_cursor, self)
+
+    def cursor_for(self, obj):
+        return make_cursor([getattr(obj, field.attname) for field in self.fields])
+
+    def after(self, values):
+        """
+        A filter for the objects after the given position.  For ordering
+        ``['-a', 'b']``, an object is after (x, y) if ``a < x``, or if
+        ``a = x and b > y``.
+        """
+        conditions = []
+        for position, field in enumerate(self.ordering):
+            name = self.field_names[position]
+            lookup = '%s__%s' % (name, 'lt' if field.startswith('-') else 'gt')
+
+            kwargs = dict(zip(self.field_names[:position], values[:position]))
+            kwargs[lookup] = values[position]
+            conditions.append(Q(**kwargs))
+        return reduce(operator.or_, conditions)
@@ -0,0 +1,321 @@
+"""
+Roll-call vote analytics.
+
+The votes are kept as a matrix, with a row for each council member and a
+column for each action that was voted on, holding a small code for how the
+member voted.  Agreement scores, voting blocs and participation rates are
+computed from the whole matrix at once with NumPy, instead of vote by vote
+through the ORM.
+
+Each city has its own matrix of its own votes (see phillyleg.cities).  The
+matrix is saved to ``settings.VOTE_MATRIX_PATH`` (with the city's slug added
+to the file name, for any but the default city) and brought up to date with
+only the votes recorded since it was last saved, by the updatevotematrix
+command, which also caches the summary computed from it under the city.  Web
+requests only read their city's cached summary; they never update the matrix.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+import datetime
+import numpy
+import os
+import tempfile
+
+from phillyleg.cities import default_city, get_current_city
+from phillyleg.models import LegVote
+
+
+NOT_VOTING, YES, NO, ABSTAIN, ABSENT = range(5)
+"""The codes in the vote matrix.  NOT_VOTING means that there's no vote
+   recorded for the member on the action (e.g., they weren't on the council
+   at the time)."""
+
+VALUE_CODES = {
+    'yes': YES, 'aye': YES, 'ayes': YES, 'yea': YES, 'yeas': YES,
+    'no': NO, 'nay': NO, 'nays': NO,
+    'absent': ABSENT, 'excused': ABSENT,
+}
+
+MIN_SHARED_VOTES = 10
+"""The number of votes two members must have both cast (yes or no) for their
+   agreement score to be reported"""
+
+BLOC_AGREEMENT = 0.8
+"""The average agreement on contested votes that members of a bloc have"""
+
+VOTE_SUMMARY_CACHE_KEY = 'vote_summary'
+
+VOTE_SUMMARY_TIMEOUT = 60 * 60 * 24 * 7
+"""How long the summary stays cached.  The cron job replaces it every day; this
+   only lets it lapse if the job stops running."""
+
+
+def vote_code(value):
+    """
+    The matrix code for a vote's value as scraped (e.g., 'Ayes', 'Nay' or
+    'Excused').  Any other value (e.g., 'Abstain' or 'Present') counts as an
+    abstention.
+    """
+    return VALUE_CODES.get(value.strip().lower(), ABSTAIN)
+
+
+def agreement_scores(yes, no):
+    """
+    For boolean member x action matrices of yes and no votes, the fraction of
+    the votes that each pair of members both cast on which they voted the
+    same way, and the number of those votes.  Scores for pairs with no votes
+    in common are NaN.
+    """
+    yes = yes.astype(numpy.float32)
+    no = no.astype(numpy.float32)
+    cast = yes + no
+
+    agreed = numpy.dot(yes, yes.T) + numpy.dot(no, no.T)
+    shared = numpy.dot(cast, cast.T)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        scores = agreed / shared
+    return scores, shared.astype(numpy.int32)
+
+
+def find_blocs(scores, threshold=BLOC_AGREEMENT):
+    """
+    Group members into blocs by average-linkage clustering of their agreement
+    scores: repeatedly join the two groups whose members agree the most on
+    average, as long as that average is at least threshold.  Pairs with a NaN
+    score count as not agreeing.  Returns a list of lists of row indexes.
+    """
+    count = len(scores)
+    totals = numpy.nan_to_num(numpy.asarray(scores, dtype=numpy.float64))
+    sizes = numpy.ones(count)
+    groups = [[row] for row in range(count)]
+    alive = numpy.ones(count, dtype=bool)
+
+    while alive.sum() > 1:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            averages = totals / numpy.outer(sizes, sizes)
+        averages[~alive, :] = -1
+        averages[:, ~alive] = -1
+        numpy.fill_diagonal(averages, -1)
+
+        a, b = numpy.unravel_index(numpy.argmax(averages), averages.shape)
+        if averages[a, b] < threshold:
+            break
+
+        # Fold group b into group a.
+        totals[a, :] += totals[b, :]
+        totals[:, a] += totals[:, b]
+        sizes[a] += sizes[b]
+        groups[a].extend(groups[b])
+        alive[b] = False
+
+    return [sorted(groups[row]) for row in range(count) if alive[row]]
+
+
+def matrix_path(city=None):
+    """
+    Where the city's (by default, the current city's) matrix is saved, or
+    None if matrices aren't saved.
+    """
+    path = getattr(settings, 'VOTE_MATRIX_PATH', None)
+    city = city or get_current_city()
+    if not path or city == default_city():
+        return path
+    root, ext = os.path.splitext(path)
+    return '%s-%s%s' % (root, city, ext)
+
+
+class VoteMatrix (object):
+    """
+    The votes as an int8 array with a row for each council member and a column
+    for each action, along with the sorted member and action keys that the
+    rows and columns stand for, and the key of the last vote added.
+    """
+    def __init__(self, member_ids=(), action_ids=(), votes=None, last_vote_id=0):
+        self.member_ids = numpy.asarray(member_ids, dtype=numpy.int32)
+        self.action_ids = numpy.asarray(action_ids, dtype=numpy.int32)
+        if votes is None:
+            votes = numpy.zeros((len(self.member_ids), len(self.action_ids)), dtype=numpy.int8)
+        self.votes = votes
+        self.last_vote_id = last_vote_id
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Load the current city's saved matrix, or start an empty one if there
+        is none.
+        """
+        path = path or matrix_path()
+        if not path or not os.path.exists(path):
+            return cls()
+
+        data = numpy.load(path)
+        try:
+            return cls(data['member_ids'], data['action_ids'], data['votes'],
+                       int(data['last_vote_id']))
+        finally:
+            data.close()
+
+    def save(self, path=None):
+        """
+        Save the matrix.  It's written to a temporary file that replaces the
+        old one, so readers never see a half-written matrix.
+        """
+        path = path or matrix_path()
+        if not path:
+            return
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                numpy.savez(temp_file, member_ids=self.member_ids,
+                            action_ids=self.action_ids, votes=self.votes,
+                            last_vote_id=self.last_vote_id)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def update(self, chunk_size=10000):
+        """
+        Add the votes on the current city's legislation recorded since the
+        matrix was last updated.  Returns the number of votes added.
+        """
+        city = get_current_city()
+        vote_ids, action_ids, voter_ids, codes = [], [], [], []
+        last_vote_id = self.last_vote_id
+        while True:
+            chunk = list(LegVote.objects.filter(pk__gt=last_vote_id, action__file__city=city)
+                         .order_by('pk')
+                         .values_list('pk', 'action', 'voter', 'value')[:chunk_size])
+            if not chunk:
+                break
+
+            for vote_id, action_id, voter_id, value in chunk:
+                vote_ids.append(vote_id)
+                action_ids.append(action_id)
+                voter_ids.append(voter_id)
+                codes.append(vote_code(value))
+            last_vote_id = chunk[-1][0]
+
+        self.add_votes(vote_ids, action_ids, voter_ids, codes)
+        return len(vote_ids)
+
+    def add_votes(self, vote_ids, action_ids, voter_ids, codes):
+        """
+        Add votes, given as parallel sequences of vote keys, action keys,
+        member keys and vote codes.  Rows and columns are added for new
+        members and actions.
+        """
+        if not len(vote_ids):
+            return
+
+        action_ids = numpy.asarray(action_ids, dtype=numpy.int32)
+        voter_ids = numpy.asarray(voter_ids, dtype=numpy.int32)
+
+        member_ids = numpy.union1d(self.member_ids, voter_ids)
+        all_action_ids = numpy.union1d(self.action_ids, action_ids)
+        if len(member_ids) > len(self.member_ids) or len(all_action_ids) > len(self.action_ids):
+            votes = numpy.zeros((len(member_ids), len(all_action_ids)), dtype=numpy.int8)
+            rows = numpy.searchsorted(member_ids, self.member_ids)
+            cols = numpy.searchsorted(all_action_ids, self.action_ids)
+            votes[numpy.ix_(rows, cols)] = self.votes
+            self.member_ids, self.action_ids, self.votes = member_ids, all_action_ids, votes
+
+        rows = numpy.searchsorted(self.member_ids, voter_ids)
+        cols = numpy.searchsorted(self.action_ids, action_ids)
+        self.votes[rows, cols] = numpy.asarray(codes, dtype=numpy.int8)
+        self.last_vote_id = max(self.last_vote_id, max(vote_ids))
+
+    def summary(self):
+        """
+        The voting statistics for each member, and the blocs that they vote
+        in, as plain data for caching:
+
+        * ``members``: a dict from member key to a dict of ``votes`` (the
+          number of votes recorded for them), ``present`` (the number at which
+          they weren't absent), ``participation`` (the fraction present),
+          ``agreement`` (a list of ``(member key, score, contested score,
+          shared votes)`` for the members they've cast at least
+          MIN_SHARED_VOTES votes with, most agreeing first) and ``bloc`` (an
+          index into ``blocs``, or None).
+        * ``blocs``: a list of lists of the keys of members who usually vote
+          together on contested actions.
+        * ``actions`` and ``contested_actions``: the number of actions voted
+          on, and of those that had both yes and no votes.
+        """
+        votes = self.votes
+        yes = (votes == YES)
+        no = (votes == NO)
+        recorded = (votes != NOT_VOTING).sum(axis=1)
+        present = ((votes != NOT_VOTING) & (votes != ABSENT)).sum(axis=1)
+
+        # Most votes are unanimous, so blocs are found from the contested
+        # votes only.
+        contested = yes.any(axis=0) & no.any(axis=0)
+        scores, shared = agreement_scores(yes, no)
+        contested_scores, contested_shared = agreement_scores(yes[:, contested], no[:, contested])
+        contested_scores[contested_shared < MIN_SHARED_VOTES] = numpy.nan
+
+        blocs = [group for group in find_blocs(contested_scores) if len(group) > 1]
+        bloc_of = dict((row, index) for index, group in enumerate(blocs) for row in group)
+
+        members = {}
+        member_ids = self.member_ids.tolist()
+        for row, member_id in enumerate(member_ids):
+            others = numpy.flatnonzero(shared[row] >= MIN_SHARED_VOTES)
+            others = others[others != row]
+            agreement = [(member_ids[other], round(float(scores[row, other]), 4),
+                          None if numpy.isnan(contested_scores[row, other])
+                          else round(float(contested_scores[row, other]), 4),
+                          int(shared[row, other]))
+                         for other in others]
+            agreement.sort(key=lambda item: -item[1])
+
+            members[member_id] = {
+                'votes': int(recorded[row]),
+                'present': int(present[row]),
+                'participation': float(present[row]) / recorded[row] if recorded[row] else None,
+                'agreement': agreement,
+                'bloc': bloc_of.get(row),
+            }
+
+        return {
+            'members': members,
+            'blocs': [[member_ids[row] for row in group] for group in blocs],
+            'actions': votes.shape[1],
+            'contested_actions': int(contested.sum()),
+        }
+
+
+def update_vote_matrix(rebuild=False):
+    """
+    Bring the current city's saved vote matrix up to date (or build it again
+    from all of the city's votes) and return it.
+    """
+    matrix = VoteMatrix() if rebuild else VoteMatrix.load()
+    matrix.update()
+    matrix.save()
+    return matrix
+
+
+def cache_vote_summary(matrix):
+    """
+    Compute the summary of the votes in the matrix, and cache it for
+    get_vote_summary, along with the time it was built (as
+    ``built_datetime``).  The cache is partitioned by city, so the matrix
+    should be the current city's.
+    """
+    summary = matrix.summary()
+    summary['built_datetime'] = datetime.datetime.now()
+    cache.set(VOTE_SUMMARY_CACHE_KEY, summary, VOTE_SUMMARY_TIMEOUT)
+    return summary
+
+
+def get_vote_summary():
+    """
+    The summary of the current city's votes (see VoteMatrix.summary and
+    cache_vote_summary) last cached by the updatevotematrix command, or None
+    if there isn't one.
+    """
+    return cache.get(VOTE_SUMMARY_CACHE_KEY)
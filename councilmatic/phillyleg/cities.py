@@ -0,0 +1,213 @@
+"""
+The cities (or other jurisdictions) that a deployment hosts.
+
+``settings.CITIES`` is a dict from each city's slug to its settings.  These
+are the same as ``settings.LEGISLATION`` (SCRAPER, SCRAPER_OPTIONS,
+ADDRESS_BOUNDS, ...), plus:
+
+NAME
+  The city's name, for display (default: the slug)
+HOSTS
+  The web host names that show the city's legislation
+PRIORITY
+  Cities with higher priorities are scraped first (default: 0)
+CONCURRENCY
+  How many of the scheduler's worker slots the city's scraper takes
+  (default: 1)
+KEY_OFFSET
+  Added to the keys of the city's legislation, so that the keys of each
+  city's files fall in their own range (default: 0).  No two cities may have
+  the same offset.
+SEARCH_CONNECTION
+  The haystack connection that holds the city's search index (default:
+  'default', shared by all of the cities)
+
+Without ``settings.CITIES``, a deployment hosts one city, whose slug is
+``settings.DEFAULT_CITY`` and whose settings are ``settings.LEGISLATION``.
+
+Each thread works for one city at a time: the city of the web request it is
+serving (see CityMiddleware) or of the scraper it is running.  The current
+city partitions the caches (see make_cache_key) and picks the search index
+to read (see CityRouter).
+
+This module doesn't import the models, so that settings can refer to it.
+"""
+
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+import threading
+
+
+class City (object):
+    def __init__(self, slug, config):
+        self.slug = slug
+        self.config = config
+        self.name = config.get('NAME', slug)
+        self.hosts = [host.lower() for host in config.get('HOSTS', [])]
+        self.priority = config.get('PRIORITY', 0)
+        self.concurrency = max(1, config.get('CONCURRENCY', 1))
+        self.key_offset = config.get('KEY_OFFSET', 0)
+        self.search_connection = config.get('SEARCH_CONNECTION', 'default')
+
+    def load_scraper(self):
+        """
+        Make an instance of the city's scraper class, with its options.
+        """
+        scraper_name = self.config['SCRAPER']
+        module, attr = scraper_name.rsplit('.', 1)
+
+        try:
+            mod = import_module(module)
+        except ImportError as e:
+            raise ImproperlyConfigured('Error importing legislation scraper %s: "%s"' % (scraper_name, e))
+
+        try:
+            ScraperWrapper = getattr(mod, attr)
+        except AttributeError as e:
+            raise ImproperlyConfigured('Error importing legislation scraper %s: "%s"' % (scraper_name, e))
+
+        options = dict(self.config.get('SCRAPER_OPTIONS', {}))
+        return ScraperWrapper(**options)
+
+    def __repr__(self):
+        return '<City %s>' % self.slug
+
+
+def default_city():
+    """
+    The slug of the city of anything that doesn't say otherwise.
+    """
+    return getattr(settings, 'DEFAULT_CITY', 'default')
+
+
+def get_cities():
+    """
+    A dict of every City, by slug.
+    """
+    cities = getattr(settings, 'CITIES', None)
+    if not cities:
+        cities = {default_city(): getattr(settings, 'LEGISLATION', {})}
+    cities = dict((slug, City(slug, config)) for slug, config in cities.items())
+
+    # Cities with the same offset would store their files under the same
+    # keys, each overwriting the other's.
+    slugs_by_offset = {}
+    for city in cities.values():
+        slugs_by_offset.setdefault(city.key_offset, []).append(city.slug)
+    for offset, slugs in sorted(slugs_by_offset.items()):
+        if len(slugs) > 1:
+            raise ImproperlyConfigured('The cities %s have the same KEY_OFFSET '
+                                       '(%s); give each city its own' %
+                                       (', '.join(sorted(slugs)), offset))
+    return cities
+
+
+def get_city(slug=None):
+    """
+    The City with the given slug, or the current one.
+    """
+    slug = slug or get_current_city()
+    try:
+        return get_cities()[slug]
+    except KeyError:
+        raise ImproperlyConfigured('Unknown city %r' % (slug,))
+
+
+def city_for_host(host):
+    """
+    The City that the web host name shows, or the default city.
+    """
+    host = host.split(':')[0].lower()
+    for city in get_cities().values():
+        if host in city.hosts:
+            return city
+    return get_city(default_city())
+
+
+def cities_for_connection(using):
+    """
+    The slugs of the cities whose search indexes are in the haystack
+    connection, or None if no city has a connection of its own (so that any
+    connection may index any city, as with a single city).
+    """
+    cities = get_cities().values()
+    if all(city.search_connection == 'default' for city in cities):
+        return None
+    return sorted(city.slug for city in cities
+                  if city.search_connection == (using or 'default'))
+
+
+def search_connections():
+    """
+    The haystack connections that hold the cities' search indexes.
+    """
+    return sorted(set(city.search_connection for city in get_cities().values()))
+
+
+_local = threading.local()
+
+
+def get_current_city():
+    return getattr(_local, 'city', None) or default_city()
+
+
+def set_current_city(slug):
+    _local.city = slug
+
+
+@contextmanager
+def current_city(slug):
+    """
+    Work for the given city within the block.
+    """
+    previous = getattr(_local, 'city', None)
+    _local.city = slug
+    try:
+        yield get_city(slug)
+    finally:
+        _local.city = previous
+
+
+def make_cache_key(key, key_prefix, version):
+    """
+    A cache KEY_FUNCTION that keeps each city's cached values apart:
+
+        CACHES = {'default': {..., 'KEY_FUNCTION': 'phillyleg.cities.make_cache_key'}}
+    """
+    return ':'.join([key_prefix, str(version), get_current_city(), key])
+
+
+class CityMiddleware (object):
+    """
+    Set the city of each request (as request.city) by its host name.
+
+    With more than one city, the caches must be partitioned, or one city's
+    cached searches and pages would be shown for another's.
+    """
+    def __init__(self):
+        key_function = getattr(settings, 'CACHES', {}).get('default', {}).get('KEY_FUNCTION')
+        if len(get_cities()) > 1 and key_function not in (make_cache_key, 'phillyleg.cities.make_cache_key'):
+            raise ImproperlyConfigured('With more than one city, the default '
+                                       'cache\'s KEY_FUNCTION must be '
+                                       'phillyleg.cities.make_cache_key')
+
+    def process_request(self, request):
+        request.city = city_for_host(request.get_host())
+        set_current_city(request.city.slug)
+
+
+class CityRouter (object):
+    """
+    A haystack router that reads and writes each city's documents in its
+    SEARCH_CONNECTION:
+
+        HAYSTACK_ROUTERS = ['phillyleg.cities.CityRouter']
+    """
+    def for_read(self, **hints):
+        return get_city().search_connection
+
+    def for_write(self, **hints):
+        instance = hints.get('instance')
+        return get_city(getattr(instance, 'city', None)).search_connection
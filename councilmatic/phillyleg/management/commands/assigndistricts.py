@@ -0,0 +1,55 @@
+###############################################################################
+# Assign geocoded locations to the council districts that contain them.
+#
+# Each district's locations are found with one spatial query, which uses the
+# spatial index on MetaData_Location.geom, and any that aren't yet assigned to
+# the district are added in bulk. Locations are assigned to a district of every
+# district plan, so legislation can be listed by district with an ordinary
+# indexed join (see CouncilDistrict.local_legislation).
+###############################################################################
+
+from django.core.management.base import BaseCommand
+import optparse
+
+from phillyleg.models import CouncilDistrict, MetaData_Location
+
+
+class Command(BaseCommand):
+    help = "Assign geocoded locations to the council districts that contain them."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--rebuild',
+                action='store_true',
+                dest='rebuild',
+                default=False,
+                help='Clear every assignment first, e.g. after district shapes or locations are corrected'),
+            optparse.make_option('--batch-size',
+                dest='batch_size',
+                type='int',
+                default=1000,
+                help='The number of assignments to insert at a time'),
+            )
+
+    def handle(self, *args, **options):
+        Assignment = MetaData_Location.districts.through
+        if options['rebuild']:
+            Assignment.objects.all().delete()
+
+        total = 0
+        for district in CouncilDistrict.objects.select_related('plan').order_by('plan__date', 'id'):
+            # Points on a boundary belong to the districts on both sides.
+            location_ids = MetaData_Location.objects \
+                .filter(geom__intersects=district.shape) \
+                .exclude(districts=district) \
+                .values_list('pk', flat=True)
+
+            assignments = [Assignment(metadata_location_id=location_id,
+                                      councildistrict_id=district.pk)
+                           for location_id in location_ids]
+            Assignment.objects.bulk_create(assignments, batch_size=options['batch_size'])
+            total += len(assignments)
+
+            if assignments:
+                self.stdout.write('%s (plan of %s): %d new locations\n' %
+                                  (district, district.plan.date, len(assignments)))
+
+        self.stdout.write('Assigned %d locations\n' % total)
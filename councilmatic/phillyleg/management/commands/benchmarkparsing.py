@@ -0,0 +1,108 @@
+###############################################################################
+# Compare the speed of parsing saved legislative file pages from a Daystar
+# Insite site with BeautifulSoup and its built-in parser (finding each field's
+# element in turn, as the scraper used to) and with LegFilePage (one lxml parse
+# and one pass over the elements with ids).
+#
+# The pages default to the scraper's test pages. Each page is read into
+# memory first, so only parsing and extraction are timed.
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+from bs4 import BeautifulSoup
+import glob
+import optparse
+import os
+import time
+
+from phillyleg.management.scraper_wrappers.sources.insite_page import (
+    LegFilePage, FIELD_IDS, ATTACHMENTS_ID, HISTORY_ID, ERROR_CLASS)
+
+TEST_PAGES = os.path.join(os.path.dirname(__file__), '..', '..', 'tests',
+                          'testlegfiles', '*.html')
+
+
+def parse_with_soup(html):
+    """
+    Read the same parts of the page as LegFilePage, with a BeautifulSoup tree
+    and a search for each part.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    if soup.find('p', ERROR_CLASS) is not None:
+        return
+
+    fields = {}
+    for span_id, field in FIELD_IDS.items():
+        span = soup.find('span', {'id': span_id})
+        fields[field] = span.text if span is not None else ''
+
+    attach_div = soup.find('div', {'id': ATTACHMENTS_ID})
+    attachments = [(link.text, link.get('href', ''))
+                   for link in attach_div.findAll('a')] if attach_div else []
+
+    history = []
+    action_div = soup.find('div', {'id': HISTORY_ID})
+    for row in (action_div.findAll('tr') if action_div else []):
+        cells = []
+        for cell in row.findAll('td'):
+            link = cell.find('a')
+            cells.append((cell.text, link.text if link else cell.text,
+                          link.get('href', '') if link else ''))
+        history.append(cells)
+
+    return fields, attachments, history
+
+
+PARSERS = [
+    ('BeautifulSoup', parse_with_soup),
+    ('LegFilePage', LegFilePage),
+]
+
+
+class Command(BaseCommand):
+    args = '[page.html ...]'
+    help = "Compare the speed of parsing saved legislative file pages."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--repeat',
+                dest='repeat',
+                type='int',
+                default=20,
+                help='The number of times to parse each page; the median time is reported'),
+            )
+
+    def handle(self, *paths, **options):
+        paths = paths or sorted(glob.glob(TEST_PAGES))
+        if not paths:
+            raise CommandError('No pages to parse')
+
+        pages = []
+        for path in paths:
+            with open(path) as page_file:
+                pages.append((os.path.basename(path), page_file.read()))
+
+        row = '%-28s' + ' %14s' * len(PARSERS) + ' %8s\n'
+        self.stdout.write('\nMedian of %d runs\n\n' % options['repeat'])
+        self.stdout.write(row % tuple([''] + [name for name, _ in PARSERS] + ['speedup']))
+
+        totals = [0.0] * len(PARSERS)
+        for name, html in pages:
+            times = [self.time_parse(parse, html, options['repeat'])
+                     for _, parse in PARSERS]
+            for i, seconds in enumerate(times):
+                totals[i] += seconds
+            self.stdout.write(row % tuple([name + ' (ms)'] +
+                              ['%.2f' % (seconds * 1000) for seconds in times] +
+                              ['%.1fx' % (times[0] / times[-1])]))
+
+        self.stdout.write(row % tuple(['all pages (ms)'] +
+                          ['%.2f' % (seconds * 1000) for seconds in totals] +
+                          ['%.1fx' % (totals[0] / totals[-1])]))
+
+    def time_parse(self, parse, html, repeat):
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            parse(html)
+            times.append(time.time() - start)
+        times.sort()
+        return times[len(times) // 2]
@@ -0,0 +1,239 @@
+###############################################################################
+# Compare search backends on a synthetic corpus of legislation.
+#
+# Each engine gets a temporary haystack connection with its index in a
+# scratch directory. The same generated documents are posted to each one, in
+# the batches that bulkindex uses, and then a set of typical searches is timed
+# against each. Nothing is read from or written to the configured indexes.
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+from haystack.query import SearchQuerySet
+import datetime
+import haystack
+import optparse
+import random
+import shutil
+import tempfile
+import time
+
+from phillyleg.management.commands.bulkindex import post_documents, commit_documents
+from phillyleg.models import LegFile
+
+ENGINES = {
+    'sqlite': 'utils.sqlite_backend.SQLiteEngine',
+    'whoosh': 'haystack.backends.whoosh_backend.WhooshEngine',
+}
+
+STATUSES = ['Adopted', 'Introduced', 'In Committee', 'Passed', 'Signed',
+            'Withdrawn', 'Failed', 'Vetoed']
+BODIES = ['CITY COUNCIL', 'Committee on Rules', 'Committee on Finance',
+          'Committee on Public Safety', 'Committee on Streets and Services',
+          'Committee of the Whole', 'Committee on Housing']
+FILE_TYPES = ['Bill', 'Resolution', 'Communication', 'Appointment', 'Motion']
+TOPICS = ['Zoning', 'Taxes', 'Housing', 'Budget', 'Transportation',
+          'Public Safety', 'Parks', 'Honors', 'Appointments', 'Utilities']
+SYLLABLES = ['ab', 'ca', 'de', 'fi', 'go', 'hu', 'ja', 'ke', 'li', 'mo',
+             'nu', 'pa', 'qui', 'ro', 'su', 'ti', 'va', 'we', 'xo', 'zy']
+
+
+class SyntheticCorpus (object):
+    """
+    Generates search documents shaped like the ones that LegislationIndex
+    prepares.  Words are drawn from a made-up vocabulary with a long-tailed
+    distribution, so that the vocabulary's first words are common and its
+    later words are rare, as in real text.
+    """
+    VOCABULARY_SIZE = 20000
+    WORDS_PER_DOCUMENT = 150
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.vocabulary = self.make_vocabulary()
+        self.sponsors = ['Councilmember %s' % self.word(rank)
+                         for rank in range(100, 117)]
+
+    def make_vocabulary(self):
+        words = set()
+        while len(words) < self.VOCABULARY_SIZE:
+            words.add(''.join(self.random.choice(SYLLABLES)
+                              for _ in range(self.random.randint(2, 4))))
+        return sorted(words, key=lambda word: (len(word), word))
+
+    def word(self, rank):
+        return self.vocabulary[rank]
+
+    def random_word(self):
+        rank = int(self.random.paretovariate(0.8)) - 1
+        return self.vocabulary[min(rank, self.VOCABULARY_SIZE - 1)]
+
+    def documents(self, count):
+        first_date = datetime.date(2000, 1, 1)
+        for key in xrange(1, count + 1):
+            rand = self.random
+            title = ' '.join(self.random_word() for _ in range(12))
+            text = ' '.join(self.random_word()
+                            for _ in range(self.WORDS_PER_DOCUMENT))
+            intro_date = first_date + datetime.timedelta(days=key * 4500 // count)
+            final_date = intro_date + datetime.timedelta(days=rand.randint(0, 90)) \
+                         if rand.random() < 0.7 else None
+            sponsors = rand.sample(self.sponsors, rand.randint(0, 3))
+            topics = rand.sample(TOPICS, rand.randint(0, 2))
+            status = rand.choice(STATUSES)
+            controlling_body = rand.choice(BODIES)
+            file_type = rand.choice(FILE_TYPES)
+
+            doc = {
+                'id': 'phillyleg.legfile.%s' % key,
+                'django_ct': 'phillyleg.legfile',
+                'django_id': str(key),
+                'text': u'%s\n%s\n%s' % (title, u' '.join(sponsors), text),
+                'file_id': '%06d' % key,
+                'topics': topics,
+                'topics_exact': topics,
+                'status': status,
+                'status_exact': status,
+                'controlling_body': controlling_body,
+                'controlling_body_exact': controlling_body,
+                'file_type': file_type,
+                'file_type_exact': file_type,
+                'key': key,
+                'sponsors': sponsors,
+                'sponsors_exact': sponsors,
+                'order_date': intro_date,
+                'title': title,
+                'intro_date': intro_date,
+                'location_count': rand.randint(0, 3),
+            }
+
+            # Like full_prepare, leave out null fields.
+            if final_date is not None:
+                doc['final_date'] = final_date
+
+            yield doc
+
+
+class Command(BaseCommand):
+    help = "Compare the speed of search backends on a synthetic corpus of legislation."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--documents',
+                dest='documents',
+                type='int',
+                default=100000,
+                help='The number of legislative files to generate (default: 100000)'),
+            optparse.make_option('--engines',
+                dest='engines',
+                default='sqlite,whoosh',
+                help='A comma-separated list of the engines to compare (default: sqlite,whoosh)'),
+            optparse.make_option('--batch-size',
+                dest='batch_size',
+                type='int',
+                default=1000,
+                help='The number of documents to post at a time'),
+            optparse.make_option('--repeat',
+                dest='repeat',
+                type='int',
+                default=5,
+                help='The number of times to run each search; the median time is reported'),
+            )
+
+    COMMIT_EVERY = 10
+    """The number of batches to post between commits, as in bulkindex"""
+
+    def handle(self, *args, **options):
+        engine_names = [name.strip() for name in options['engines'].split(',')]
+        for name in engine_names:
+            if name not in ENGINES:
+                raise CommandError('Unknown engine %r; choose from %s' %
+                                   (name, ', '.join(sorted(ENGINES))))
+
+        self.documents = options['documents']
+        self.batch_size = options['batch_size']
+        self.repeat = options['repeat']
+
+        # The searches use words of known frequency from the corpus.
+        corpus = SyntheticCorpus()
+        common, uncommon, rare = corpus.word(3), corpus.word(60), corpus.word(2000)
+        self.searches = [
+            ('common keyword', lambda sqs: list(sqs.auto_query(common)[:20])),
+            ('uncommon keyword', lambda sqs: list(sqs.auto_query(uncommon)[:20])),
+            ('rare keyword', lambda sqs: list(sqs.auto_query(rare)[:20])),
+            ('two keywords', lambda sqs: list(sqs.auto_query('%s %s' % (common, uncommon))[:20])),
+            ('keyword, newest first', lambda sqs: list(sqs.auto_query(uncommon).order_by('-order_date')[:20])),
+            ('keyword and status', lambda sqs: list(sqs.auto_query(uncommon).filter(status_exact='Adopted').order_by('-order_date')[:20])),
+            ('status and type', lambda sqs: list(sqs.filter(status_exact='Passed', file_type_exact='Bill').order_by('-order_date')[:20])),
+            ('date range', lambda sqs: list(sqs.filter(order_date__gte=datetime.date(2005, 1, 1), order_date__lt=datetime.date(2006, 1, 1)).order_by('order_date')[:20])),
+            ('deep page', lambda sqs: list(sqs.order_by('-order_date')[self.documents // 2:self.documents // 2 + 20])),
+            ('count all', lambda sqs: sqs.count()),
+            ('keyword facets', lambda sqs: sqs.auto_query(uncommon).facet('status').facet('file_type').facet_counts()),
+        ]
+
+        results = []
+        for name in engine_names:
+            results.append((name, self.benchmark(name)))
+
+        self.report(results)
+
+    def benchmark(self, name):
+        """
+        Index the corpus with the named engine and time each search.  Returns
+        the indexing time and a list of search times, in seconds.
+        """
+        path = tempfile.mkdtemp(prefix='benchmarksearch-%s-' % name)
+        alias = 'benchmark_%s' % name
+        haystack.connections.connections_info[alias] = {
+            'ENGINE': ENGINES[name],
+            'PATH': path + '/index.sqlite3' if name == 'sqlite' else path,
+        }
+
+        try:
+            backend = haystack.connections[alias].get_backend()
+            backend.clear()
+
+            self.stdout.write('%s: indexing %d documents...\n' % (name, self.documents))
+            start = time.time()
+            batch = []
+            batch_num = 0
+            for doc in SyntheticCorpus().documents(self.documents):
+                batch.append(doc)
+                if len(batch) == self.batch_size:
+                    post_documents(backend, batch)
+                    batch_num += 1
+                    batch = []
+                    if batch_num % self.COMMIT_EVERY == 0:
+                        commit_documents(backend)
+            post_documents(backend, batch)
+            commit_documents(backend)
+            index_time = time.time() - start
+
+            search_times = []
+            for label, search in self.searches:
+                times = []
+                for _ in range(self.repeat):
+                    sqs = SearchQuerySet().using(alias).models(LegFile)
+                    start = time.time()
+                    search(sqs)
+                    times.append(time.time() - start)
+                times.sort()
+                search_times.append(times[len(times) // 2])
+
+            return index_time, search_times
+
+        finally:
+            del haystack.connections.connections_info[alias]
+            haystack.connections._connections.pop(alias, None)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def report(self, results):
+        names = [name for name, _ in results]
+        row = '%-28s' + ' %12s' * len(names) + '\n'
+
+        self.stdout.write('\n%d documents, median of %d runs\n\n' %
+                          (self.documents, self.repeat))
+        self.stdout.write(row % tuple([''] + names))
+        self.stdout.write(row % tuple(['indexing (s)'] +
+                          ['%.1f' % index_time for _, (index_time, _) in results]))
+        for i, (label, _) in enumerate(self.searches):
+            self.stdout.write(row % tuple([label + ' (ms)'] +
+                              ['%.1f' % (search_times[i] * 1000)
+                               for _, (_, search_times) in results]))
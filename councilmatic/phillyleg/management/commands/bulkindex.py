@@ -0,0 +1,194 @@
+###############################################################################
+# Rebuild the legislation and minutes search indexes in bulk.
+#
+# Objects are read in key order, a chunk at a time, with everything that their
+# search documents need prefetched. The documents are prepared in a pool of
+# worker processes, and posted to the search backend in large batches that are
+# committed every few batches. The last key committed for each index is saved
+# in a progress file, so an interrupted run can be resumed with --resume.
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from itertools import imap
+from multiprocessing import Pool, cpu_count
+import haystack
+import json
+import logging
+import optparse
+import os
+import time
+
+from phillyleg.search_indexes import LegislationIndex, MinutesIndex, bump_index_version
+from utils.querysets import iter_key_chunks
+
+log = logging.getLogger(__name__)
+
+INDEXES = {
+    'legfile': LegislationIndex,
+    'legminutes': MinutesIndex,
+}
+
+
+def prepare_documents(task):
+    """
+    Load the objects with the given keys and prepare their search documents.
+    Returns the last key in the chunk along with the documents.
+    """
+    index_name, using, keys = task
+    index = INDEXES[index_name]()
+    objs = index.prefetched_queryset(using).filter(pk__in=keys)
+    return keys[-1], [index.full_prepare(obj) for obj in objs]
+
+
+def post_documents(backend, docs):
+    """
+    Send the prepared documents to the search backend without committing.
+    """
+    if not docs:
+        return
+
+    # Solr
+    if hasattr(backend, 'conn'):
+        backend.conn.add(docs, commit=False)
+
+    # SQLite (utils.sqlite_backend)
+    elif hasattr(backend, 'add_documents'):
+        backend.add_documents(docs)
+
+    # Whoosh
+    else:
+        from whoosh.writing import AsyncWriter
+
+        if not backend.setup_complete:
+            backend.setup()
+
+        backend.index = backend.index.refresh()
+        writer = AsyncWriter(backend.index)
+        for doc in docs:
+            doc.pop('boost', None)
+            writer.update_document(**dict(
+                (key, backend._from_python(value)) for key, value in doc.items()))
+        writer.commit()
+
+
+def commit_documents(backend):
+    if hasattr(backend, 'conn'):
+        backend.conn.commit()
+
+
+class Command(BaseCommand):
+    help = "Rebuild the legislation and minutes search indexes in bulk."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--models',
+                dest='models',
+                default=','.join(sorted(INDEXES)),
+                help='A comma-separated list of the indexes to rebuild (default: %s)' % ','.join(sorted(INDEXES))),
+            optparse.make_option('--batch-size',
+                dest='batch_size',
+                type='int',
+                default=1000,
+                help='The number of objects to prepare and post at a time'),
+            optparse.make_option('--workers',
+                dest='workers',
+                type='int',
+                default=cpu_count(),
+                help='The number of processes preparing documents; 0 prepares them in this process'),
+            optparse.make_option('--using',
+                dest='using',
+                default='default',
+                help='The haystack connection to index into'),
+            optparse.make_option('--progress-file',
+                dest='progress_file',
+                default='bulkindex-progress.json',
+                help='Where to record the last key indexed for each model'),
+            optparse.make_option('--resume',
+                action='store_true',
+                dest='resume',
+                default=False,
+                help='Continue after the last keys recorded in the progress file'),
+            )
+
+    COMMIT_EVERY = 10
+    """The number of batches to post between commits"""
+
+    def handle(self, *args, **options):
+        index_names = [name.strip() for name in options['models'].split(',')]
+        for name in index_names:
+            if name not in INDEXES:
+                raise CommandError('Unknown index %r; choose from %s' %
+                                   (name, ', '.join(sorted(INDEXES))))
+
+        self.using = options['using']
+        self.batch_size = options['batch_size']
+        self.progress_file = options['progress_file']
+        self.progress = self.load_progress() if options['resume'] else {}
+
+        backend = haystack.connections[self.using].get_backend()
+
+        pool = None
+        if options['workers'] > 0:
+            # The workers will be forked with a copy of this process's
+            # database connections, which can't be shared; close them first.
+            for conn in connections.all():
+                conn.close()
+            pool = Pool(options['workers'])
+
+        try:
+            for name in index_names:
+                self.index_model(name, backend, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def index_model(self, name, backend, pool):
+        index = INDEXES[name]()
+        after = self.progress.get(name)
+        tasks = ((name, self.using, keys) for keys in
+                 iter_key_chunks(index.index_queryset(self.using),
+                                 self.batch_size, after))
+
+        prepared = pool.imap(prepare_documents, tasks) if pool else \
+                   imap(prepare_documents, tasks)
+
+        count = 0
+        start = time.time()
+        for batch_num, (last_key, docs) in enumerate(prepared, 1):
+            post_documents(backend, docs)
+            count += len(docs)
+
+            # Only record progress for documents that have been committed.
+            if batch_num % self.COMMIT_EVERY == 0:
+                commit_documents(backend)
+                self.progress[name] = last_key
+                self.save_progress()
+
+            elapsed = time.time() - start
+            log.info('%s: indexed %d documents through key %s (%.1f/s)' %
+                     (name, count, last_key, count / elapsed if elapsed else 0))
+
+        commit_documents(backend)
+        bump_index_version(self.using)
+
+        # This model is finished, so there's nothing to resume.
+        self.progress.pop(name, None)
+        self.save_progress()
+
+        elapsed = time.time() - start
+        self.stdout.write('%s: indexed %d documents in %.1fs (%.1f/s)\n' %
+                          (name, count, elapsed, count / elapsed if elapsed else 0))
+
+    def load_progress(self):
+        try:
+            with open(self.progress_file) as progress_file:
+                return json.load(progress_file)
+        except IOError:
+            return {}
+
+    def save_progress(self):
+        if self.progress:
+            with open(self.progress_file, 'w') as progress_file:
+                json.dump(self.progress, progress_file)
+        elif os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
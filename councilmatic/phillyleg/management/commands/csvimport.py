@@ -1,30 +1,396 @@
-import sys
+###############################################################################
+# Load legislative files, actions or attachments in bulk from CSV files (plain
+# or gzipped), e.g. for a historical backfill.
+#
+# Each file's header names its columns, by field name (e.g., "file") or by
+# database column (e.g., "file_id"), as in the files that dumptables writes;
+# other columns are ignored.  A "sponsors" column of comma-separated names is
+# also read for legislative files.  Rows are read and checked a batch at a
+# time: values are converted to their fields' types, and rows with bad or
+# missing values, or that refer to files that don't exist, are reported and
+# skipped, as are rows that are already in the database (by key, or by a
+# unique set of columns).  Each batch is loaded in one transaction, with COPY
+# on PostgreSQL and bulk_create otherwise.
+#
+# Loading skips LegFile.save, so imported files have no metadata (words,
+# locations, mentions and topics) yet.  The extractmetadata command fills it
+# in afterwards.
+###############################################################################
+
 from django.core.management.base import BaseCommand, CommandError
-import smtplib, poplib
-import django
-from email.mime.text import MIMEText
-from phillyleg.models import Subscription, Keyword, LegFile
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import AutoField, BooleanField, CharField, DateField, \
+    DateTimeField, ForeignKey
 import csv
+import datetime
+import gzip
+import optparse
+from StringIO import StringIO
+
+from phillyleg.models import (LegFile, LegAction, LegFileAttachment,
+    CouncilMember, CouncilMemberAlias)
+from utils.querysets import Progress
+
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y']
+DATETIME_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                    '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'] + DATE_FORMATS
+TRUE_VALUES = set(['1', 't', 'true', 'y', 'yes'])
+FALSE_VALUES = set(['0', 'f', 'false', 'n', 'no'])
+
+
+class InvalidRow (Exception):
+    pass
+
+
+def parse_datetime(value, formats):
+    for format in formats:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError('expected one of the formats %s' % ', '.join(formats))
+
+
+def coerce(field, value):
+    """
+    Convert a CSV value to the field's type.  Raises ValueError (or a
+    ValidationError) if it can't be.
+    """
+    value = value.decode('utf-8').strip()
+    if value == '':
+        if field.null:
+            return None
+        elif field.has_default():
+            return field.get_default()
+        elif isinstance(field, CharField) or field.get_internal_type() == 'TextField':
+            return u''
+        raise ValueError('a value is required')
+
+    if isinstance(field, DateTimeField):
+        return parse_datetime(value, DATETIME_FORMATS)
+    elif isinstance(field, DateField):
+        return parse_datetime(value, DATE_FORMATS).date()
+    elif isinstance(field, BooleanField):
+        if value.lower() in TRUE_VALUES:
+            return True
+        elif value.lower() in FALSE_VALUES:
+            return False
+        raise ValueError('expected true or false')
+    elif isinstance(field, ForeignKey):
+        return field.rel.get_related_field().to_python(value)
+    elif isinstance(field, CharField) and len(value) > field.max_length:
+        raise ValueError('longer than %d characters' % field.max_length)
+    return field.to_python(value)
+
+
+def copy_value(value):
+    """
+    A value as a field for PostgreSQL's CSV COPY format, in which an unquoted
+    empty field is NULL.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    return '"%s"' % value.encode('utf-8').replace('"', '""')
+
+
+class ImportTable (object):
+    """
+    A model that rows can be imported into.  The importable fields are all of
+    its fields but the automatic timestamps.
+    """
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.fields = [field for field in model._meta.local_fields
+                       if not getattr(field, 'auto_now', False)
+                       and not getattr(field, 'auto_now_add', False)]
+
+    def columns(self, header):
+        """
+        The fields named by the CSV header, as a list of (column index,
+        field) pairs, along with the names that don't match a field.
+        """
+        by_name = {}
+        for field in self.fields:
+            by_name[field.name] = field
+            by_name[field.attname] = field
+
+        matched, unmatched = [], []
+        for index, name in enumerate(header):
+            name = name.strip()
+            if name in by_name:
+                matched.append((index, by_name[name]))
+            else:
+                unmatched.append(name)
+
+        # Text fields can be left blank, and automatic keys to the database.
+        matched_fields = set(field for index, field in matched)
+        missing = [field.name for field in self.fields
+                   if field not in matched_fields
+                   and not field.null and not field.has_default()
+                   and not isinstance(field, (AutoField, CharField))
+                   and field.get_internal_type() != 'TextField']
+        if missing:
+            raise CommandError('The %s file has no column for %s' %
+                               (self.name, ', '.join(missing)))
+        return matched, unmatched
+
+    def unique_sets(self, fields):
+        """
+        The sets of fields (by attname) that identify a row, among the given
+        fields: the primary key, and each unique_together set.
+        """
+        names = set(field.name for field in fields)
+        attnames = dict((field.name, field.attname) for field in self.fields)
+
+        sets = []
+        if self.model._meta.pk.name in names:
+            sets.append((self.model._meta.pk.attname,))
+        for unique_together in self.model._meta.unique_together:
+            if all(name in names for name in unique_together):
+                sets.append(tuple(attnames[name] for name in unique_together))
+        return sets
+
+
+TABLES = [
+    ImportTable('legfiles', LegFile),
+    ImportTable('actions', LegAction),
+    ImportTable('attachments', LegFileAttachment),
+]
+
 
 class Command(BaseCommand):
-    help = "python manage.py csvimport CSVFILE"
-    def handle(self,  *args, **options):
-        csvpath = args[0]
-        reader = csv.reader(open(csvpath, 'r'))
-        reader.next()
-        for row in reader:
-            d = {
-                'status': row[0],
-                'title': row[1],
-                'url': row[2],
-                'sponsors': row[3],
-                'controlling_body': row[4],
-                'contact': row[5],
-                'version': row[6],
-                'key': row[7],
-                'final_date': row[8],
-                'intro_date': row[9],
-                'type': row[10],
-            }
-        
-            LegFile.objects.get_or_create(**d)
+    help = "Load legislative files, actions or attachments in bulk from CSV files."
+    args = 'CSVFILE [CSVFILE ...]'
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--table',
+                dest='table',
+                default='legfiles',
+                help='What the rows are: %s (default: legfiles)' %
+                     ', '.join(table.name for table in TABLES)),
+            optparse.make_option('--batch-size',
+                dest='batch_size',
+                type='int',
+                default=5000,
+                help='The number of rows to check and load at a time'),
+            optparse.make_option('--no-copy',
+                action='store_false',
+                dest='copy',
+                default=True,
+                help='Load with bulk_create even on PostgreSQL'),
+            )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Give the CSV file(s) to import')
+
+        tables_by_name = dict((table.name, table) for table in TABLES)
+        if options['table'] not in tables_by_name:
+            raise CommandError('Unknown table %r; choose from %s' %
+                               (options['table'], ', '.join(table.name for table in TABLES)))
+        self.table = tables_by_name[options['table']]
+        self.batch_size = options['batch_size']
+        self.use_copy = options['copy'] and connection.vendor == 'postgresql'
+
+        for path in args:
+            self.import_file(path)
+
+        if self.use_copy:
+            self.reset_sequences()
+
+    def import_file(self, path):
+        csv_file = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+        try:
+            reader = csv.reader(csv_file)
+            try:
+                header = reader.next()
+            except StopIteration:
+                raise CommandError('%s is empty' % path)
+
+            columns, unmatched = self.table.columns(header)
+            sponsor_index = None
+            if self.table.model is LegFile and 'sponsors' in unmatched:
+                sponsor_index = [name.strip() for name in header].index('sponsors')
+                unmatched.remove('sponsors')
+            if unmatched:
+                self.stdout.write('%s: ignoring the columns %s\n' % (path, ', '.join(unmatched)))
+
+            progress = Progress(path, self.stdout)
+            self.loaded = self.skipped = self.invalid = 0
+
+            batch = []
+            for row in reader:
+                batch.append((reader.line_num, row))
+                if len(batch) >= self.batch_size:
+                    self.load_batch(batch, columns, sponsor_index)
+                    progress.add(len(batch))
+                    batch = []
+            if batch:
+                self.load_batch(batch, columns, sponsor_index)
+                progress.add(len(batch))
+        finally:
+            csv_file.close()
+
+        self.stdout.write('%s: loaded %d rows; skipped %d already loaded and %d invalid\n' %
+                          (path, self.loaded, self.skipped, self.invalid))
+
+    def check_row(self, line_num, row, columns):
+        """
+        The dict of the row's values by field attname.  Raises InvalidRow if
+        any value is bad.
+        """
+        values = {}
+        for index, field in columns:
+            try:
+                values[field.attname] = coerce(field, row[index] if index < len(row) else '')
+            except Exception, e:
+                message = '; '.join(e.messages) if hasattr(e, 'messages') else unicode(e)
+                raise InvalidRow('line %d, %s: %s' % (line_num, field.name, message))
+        return values
+
+    @transaction.commit_on_success
+    def load_batch(self, batch, columns, sponsor_index):
+        model = self.table.model
+        fields = [field for index, field in columns]
+
+        rows = []
+        sponsors_by_line = {}
+        for line_num, row in batch:
+            try:
+                values = self.check_row(line_num, row, columns)
+            except InvalidRow, e:
+                self.stderr.write('%s\n' % e)
+                self.invalid += 1
+                continue
+            rows.append((line_num, values))
+            if sponsor_index is not None and sponsor_index < len(row):
+                sponsors_by_line[line_num] = [name.strip() for name in
+                                              row[sponsor_index].decode('utf-8').split(',')
+                                              if name.strip()]
+
+        rows = self.drop_missing_references(rows, fields)
+        rows = self.drop_loaded(rows, fields)
+
+        objs = [model(**values) for line_num, values in rows]
+        if self.use_copy:
+            self.copy_objects(objs, fields)
+        else:
+            model.objects.bulk_create(objs)
+
+        if sponsors_by_line:
+            self.add_sponsors(dict((values['key'], sponsors_by_line[line_num])
+                                   for line_num, values in rows
+                                   if sponsors_by_line.get(line_num)))
+        self.loaded += len(objs)
+
+    def drop_missing_references(self, rows, fields):
+        """
+        Drop (and report) the rows that refer to objects that don't exist.
+        """
+        for field in fields:
+            if not isinstance(field, ForeignKey):
+                continue
+
+            referenced = set(values[field.attname] for line_num, values in rows
+                             if values[field.attname] is not None)
+            existing = set(field.rel.to.objects.filter(pk__in=referenced)
+                           .values_list('pk', flat=True)) if referenced else set()
+
+            kept = []
+            for line_num, values in rows:
+                value = values[field.attname]
+                if value is not None and value not in existing:
+                    self.stderr.write('line %d, %s: %s %r does not exist\n' %
+                                      (line_num, field.name, field.rel.to.__name__, value))
+                    self.invalid += 1
+                else:
+                    kept.append((line_num, values))
+            rows = kept
+        return rows
+
+    def drop_loaded(self, rows, fields):
+        """
+        Drop the rows that are already in the database, or earlier in the
+        file, by any of the sets of fields that identify a row.
+        """
+        for unique_set in self.table.unique_sets(fields):
+            keys = [tuple(values[attname] for attname in unique_set) for line_num, values in rows]
+            if len(unique_set) == 1:
+                existing = set((key,) for key in self.table.model.objects
+                               .filter(**{unique_set[0] + '__in': [key[0] for key in keys]})
+                               .values_list(unique_set[0], flat=True))
+            else:
+                # Narrow by the first field, then match the whole set.
+                existing = set(self.table.model.objects
+                               .filter(**{unique_set[0] + '__in': set(key[0] for key in keys)})
+                               .values_list(*unique_set))
+
+            kept = []
+            for key, (line_num, values) in zip(keys, rows):
+                if key in existing:
+                    self.skipped += 1
+                else:
+                    existing.add(key)
+                    kept.append((line_num, values))
+            rows = kept
+        return rows
+
+    def copy_objects(self, objs, fields):
+        """
+        Load the objects with PostgreSQL's COPY, filling in their automatic
+        timestamps first.
+        """
+        if not objs:
+            return
+
+        model = self.table.model
+        copy_fields = [field for field in model._meta.local_fields
+                       if field in fields or getattr(field, 'auto_now', False)
+                       or getattr(field, 'auto_now_add', False)]
+
+        data = StringIO()
+        for obj in objs:
+            data.write(','.join(copy_value(field.pre_save(obj, True)) for field in copy_fields))
+            data.write('\n')
+        data.seek(0)
+
+        cursor = connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH CSV' % (
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(field.column) for field in copy_fields)),
+            data)
+
+    def add_sponsors(self, sponsor_names):
+        """
+        Add the sponsors, given as lists of names by file key, finding council
+        members by their aliases and creating any that don't exist yet.
+        """
+        member_ids = dict(CouncilMemberAlias.objects.values_list('name', 'member'))
+        through = LegFile.sponsors.through
+
+        links = set()
+        for key, names in sponsor_names.items():
+            for name in names:
+                if name not in member_ids:
+                    member = CouncilMember.objects.create(real_name=name)
+                    CouncilMemberAlias.objects.create(member=member, name=name)
+                    member_ids[name] = member.pk
+                links.add((key, member_ids[name]))
+
+        through.objects.bulk_create([through(legfile_id=key, councilmember_id=member_id)
+                                     for key, member_id in sorted(links)])
+
+    def reset_sequences(self):
+        """
+        Move the key sequence past the keys loaded with COPY, so that later
+        rows don't reuse them.
+        """
+        cursor = connection.cursor()
+        for sql in connection.ops.sequence_reset_sql(no_style(), [self.table.model]):
+            cursor.execute(sql)
+        transaction.commit_unless_managed()
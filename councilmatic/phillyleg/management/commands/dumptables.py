@@ -0,0 +1,235 @@
+###############################################################################
+# Write the legislative tables out to compressed files for offline use.
+#
+# A snapshot has every row of every table; a delta has the rows of one day
+# that were created or changed (by updated_datetime) in it. Each table is
+# written to its own gzipped CSV file, one chunk of rows at a time, read in key
+# order. A manifest.json describes the dump's tables, columns and row counts.
+# Each dump is written to a temporary directory and moved into place when it's
+# complete, so readers never see a partial dump.
+#
+# The members, district plans and legislative files have a city column (see
+# phillyleg.cities); with --city, only the rows of one city's legislation and
+# council are dumped.
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+import csv
+import datetime
+import gzip
+import json
+import optparse
+import os
+import shutil
+import tempfile
+
+from phillyleg.cities import get_cities
+from phillyleg.models import (CouncilMember, CouncilMemberTenure,
+    CouncilDistrictPlan, CouncilDistrict, LegFile, LegAction, LegVote,
+    LegFileMetaData, MetaData_Topic)
+from utils.querysets import iter_chunked
+
+TIMESTAMPS = ['created_datetime', 'updated_datetime']
+
+
+class DumpTable (object):
+    """
+    A table to dump: the model that its rows come from, the fields to dump,
+    the lookup of the updated_datetime that decides whether a row belongs
+    in a delta (None to put every row in every delta), and the lookup of the
+    city that a row belongs to (None for rows shared by every city).
+    """
+    def __init__(self, name, model, fields, updated='updated_datetime', city='city'):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.updated = updated
+        self.city = city
+
+    @property
+    def columns(self):
+        return [self.model._meta.get_field(name).attname for name in self.fields]
+
+    def queryset(self, since=None, until=None, city=None):
+        rows = self.model.objects.all()
+        if since is not None and self.updated is not None:
+            rows = rows.filter(**{self.updated + '__gte': since,
+                                  self.updated + '__lt': until})
+        if city is not None and self.city is not None:
+            rows = rows.filter(**{self.city: city})
+        return rows
+
+    def iter_rows(self, queryset, chunk_size):
+        return iter_chunked(queryset, chunk_size, fields=self.fields)
+
+
+TABLES = [
+    DumpTable('members', CouncilMember,
+              ['id', 'city', 'real_name', 'title', 'headshot'] + TIMESTAMPS),
+    DumpTable('member_tenures', CouncilMemberTenure,
+              ['id', 'councilmember', 'district', 'at_large', 'president',
+               'begin', 'end'] + TIMESTAMPS,
+              city='councilmember__city'),
+    DumpTable('district_plans', CouncilDistrictPlan,
+              ['id', 'city', 'date'] + TIMESTAMPS),
+    DumpTable('districts', CouncilDistrict,
+              ['key', 'id', 'plan', 'shape'] + TIMESTAMPS,
+              city='plan__city'),
+    DumpTable('legfiles', LegFile,
+              ['key', 'id', 'city', 'type', 'status', 'title', 'controlling_body',
+               'intro_date', 'final_date', 'url', 'version', 'contact',
+               'is_routine'] + TIMESTAMPS),
+    DumpTable('legfile_sponsors', LegFile.sponsors.through,
+              ['id', 'legfile', 'councilmember'],
+              updated='legfile__updated_datetime', city='legfile__city'),
+    DumpTable('actions', LegAction,
+              ['id', 'file', 'date_taken', 'description', 'motion',
+               'acting_body', 'notes', 'minutes'] + TIMESTAMPS,
+              city='file__city'),
+    DumpTable('votes', LegVote,
+              ['id', 'action', 'voter', 'value'],
+              updated='action__updated_datetime', city='action__file__city'),
+    DumpTable('metadata', LegFileMetaData,
+              ['id', 'legfile'] + TIMESTAMPS,
+              city='legfile__city'),
+    DumpTable('metadata_topics', LegFileMetaData.topics.through,
+              ['id', 'legfilemetadata', 'metadata_topic'],
+              updated='legfilemetadata__updated_datetime',
+              city='legfilemetadata__legfile__city'),
+    DumpTable('topics', MetaData_Topic,
+              ['id', 'topic'], updated=None, city=None),
+]
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    elif hasattr(value, 'wkt'):
+        return value.wkt
+    return unicode(value).encode('utf-8')
+
+
+class Command(BaseCommand):
+    help = "Write a snapshot, or a day's changes, of the legislative tables to compressed CSV files."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--delta',
+                action='store_true',
+                dest='delta',
+                default=False,
+                help='Only dump the rows changed on one day (see --date), instead of a full snapshot'),
+            optparse.make_option('--date',
+                dest='date',
+                default=None,
+                help='The day (YYYY-MM-DD) to dump the changes of (default: yesterday)'),
+            optparse.make_option('--directory',
+                dest='directory',
+                default='dumps',
+                help='The directory to write dumps into (default: dumps)'),
+            optparse.make_option('--tables',
+                dest='tables',
+                default=','.join(table.name for table in TABLES),
+                help='A comma-separated list of the tables to dump (default: all)'),
+            optparse.make_option('--chunk-size',
+                dest='chunk_size',
+                type='int',
+                default=5000,
+                help='The number of rows to read from the database at a time'),
+            optparse.make_option('--city',
+                dest='city',
+                default=None,
+                help='The slug of the city to dump the rows of (default: every city)'),
+            )
+
+    def handle(self, *args, **options):
+        tables_by_name = dict((table.name, table) for table in TABLES)
+        table_names = [name.strip() for name in options['tables'].split(',')]
+        for name in table_names:
+            if name not in tables_by_name:
+                raise CommandError('Unknown table %r; choose from %s' %
+                                   (name, ', '.join(table.name for table in TABLES)))
+        tables = [tables_by_name[name] for name in table_names]
+
+        self.chunk_size = options['chunk_size']
+
+        city = options['city']
+        if city and city not in get_cities():
+            raise CommandError('Unknown city %r' % city)
+
+        if options['delta']:
+            if options['date']:
+                try:
+                    day = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+                except ValueError:
+                    raise CommandError('--date should be a date (YYYY-MM-DD)')
+            else:
+                day = datetime.date.today() - datetime.timedelta(days=1)
+            since = datetime.datetime.combine(day, datetime.time())
+            until = since + datetime.timedelta(days=1)
+            dump_name = 'delta-%s' % day.isoformat()
+        else:
+            since = until = None
+            dump_name = 'snapshot-%s' % datetime.date.today().isoformat()
+        if city:
+            dump_name = '%s-%s' % (city, dump_name)
+
+        if not os.path.isdir(options['directory']):
+            os.makedirs(options['directory'])
+        dump_path = os.path.join(options['directory'], dump_name)
+
+        # Note the time before reading anything; changes made during the dump
+        # may or may not be in it.
+        manifest = {
+            'dump': dump_name,
+            'started': datetime.datetime.now().replace(microsecond=0).isoformat(),
+            'since': since and since.isoformat(),
+            'until': until and until.isoformat(),
+            'city': city,
+            'tables': {},
+        }
+
+        temp_path = tempfile.mkdtemp(prefix='.%s-' % dump_name, dir=options['directory'])
+        try:
+            for table in tables:
+                filename = '%s.csv.gz' % table.name
+                count = self.dump_table(table, os.path.join(temp_path, filename),
+                                        since, until, city)
+                manifest['tables'][table.name] = {
+                    'file': filename,
+                    'columns': table.columns,
+                    'rows': count,
+                }
+                self.stdout.write('%s: %d rows\n' % (table.name, count))
+
+            with open(os.path.join(temp_path, 'manifest.json'), 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+            # Replace an earlier dump of the same name, e.g. from a rerun.
+            if os.path.exists(dump_path):
+                shutil.rmtree(dump_path)
+            os.rename(temp_path, dump_path)
+        except:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+
+        self.stdout.write('Wrote %s\n' % dump_path)
+
+    def dump_table(self, table, path, since, until, city=None):
+        """
+        Write the table's rows (changed between since and until, and of the
+        city, if given) to a gzipped CSV file at path.  Returns the number of
+        rows written.
+        """
+        count = 0
+        with open(path, 'wb') as raw_file:
+            dump_file = gzip.GzipFile(fileobj=raw_file, mode='wb')
+            try:
+                writer = csv.writer(dump_file)
+                writer.writerow(table.columns)
+                for row in table.iter_rows(table.queryset(since, until, city), self.chunk_size):
+                    writer.writerow([csv_value(value) for value in row])
+                    count += 1
+            finally:
+                dump_file.close()
+        return count
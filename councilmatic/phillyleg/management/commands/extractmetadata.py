@@ -0,0 +1,43 @@
+###############################################################################
+# Fill in the metadata (words, locations, mentions and topics) of the
+# legislative files that have none, such as those loaded by csvimport.
+#
+# Files without metadata are, in effect, a queue: each one is saved with its
+# metadata in one transaction, so an interrupted run (e.g., by the geocoder's
+# request limit) leaves the rest to be picked up by the next one.
+###############################################################################
+
+from django.core.management.base import BaseCommand
+import optparse
+
+from phillyleg.models import LegFile
+from utils import TooManyGeocodeRequests
+from utils.querysets import iter_chunked, Progress
+
+
+class Command(BaseCommand):
+    help = "Extract the metadata of legislative files that have none."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--skip-locations',
+                action='store_true',
+                dest='skip_locations',
+                default=False,
+                help="Don't look for (and geocode) the addresses in the files"),
+            optparse.make_option('--chunk-size',
+                dest='chunk_size',
+                type='int',
+                default=500,
+                help='The number of files to read at a time'),
+            )
+
+    def handle(self, *args, **options):
+        legfiles = LegFile.objects.filter(metadata__isnull=True)
+        progress = Progress('Files', self.stdout, total=legfiles.count())
+
+        try:
+            for legfile in iter_chunked(legfiles, options['chunk_size'], progress=progress):
+                legfile.save(update_locations=not options['skip_locations'])
+        except TooManyGeocodeRequests:
+            self.stdout.write('Stopped at the geocoder request limit\n')
+
+        progress.done()
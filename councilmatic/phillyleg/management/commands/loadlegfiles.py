@@ -42,15 +42,9 @@ class Command(BaseCommand):
         ds = CouncilmaticDataStoreWrapper()
         source = ScraperWikiSourceWrapper()
 
-        # Get the latest filings
+        # Get the latest filings, reading them from the source in batches.
         curr_key = ds.get_latest_key()
+        legis_files = source.iter_legis_files(curr_key, force_download)
 
-        while True:
-            curr_key, source_obj = source.check_for_new_content(curr_key, force_download)
-
-            if source_obj is None:
-                break
-
-            record, attachments, actions, minutes = \
-                source.scrape_legis_file(curr_key, source_obj)
+        for record, attachments, actions, minutes in legis_files:
             ds.save_legis_file(record, attachments, actions, minutes)
@@ -0,0 +1,159 @@
+###############################################################################
+# Index the legislation and minutes that have changed since they were last
+# indexed.
+#
+# Objects are queued by the QueuedSignalProcessor as they are saved.  An
+# object is only indexed once it has gone unchanged for a while, so that the
+# several saves that go into scraping it are indexed together, with its
+# metadata complete.  Each batch of objects is committed to the search backend
+# at once.
+#
+# With cities that have search connections of their own (see
+# phillyleg.cities), each batch is indexed into every city's connection, and
+# each connection takes the objects of its cities.
+#
+# Once a batch is indexed, the content_indexed signal is sent with its
+# objects, so that the search feeds they may have changed are marked stale.
+###############################################################################
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+import datetime
+import haystack
+import logging
+import optparse
+
+from phillyleg.cities import search_connections
+from phillyleg.management.commands.bulkindex import INDEXES, commit_documents
+from phillyleg.models import IndexQueueEntry
+from phillyleg.search_indexes import bump_index_version
+from phillyleg.signals import content_indexed
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Index the legislation and minutes that have changed since they were last indexed."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--window',
+                dest='window',
+                type='int',
+                default=60,
+                help='The number of seconds an object must go unchanged before it is indexed'),
+            optparse.make_option('--batch-size',
+                dest='batch_size',
+                type='int',
+                default=500,
+                help='The number of objects to index and commit at a time'),
+            optparse.make_option('--using',
+                dest='using',
+                default=None,
+                help='The haystack connection to index into (default: every city\'s connection)'),
+            )
+
+    def handle(self, *args, **options):
+        window = datetime.timedelta(seconds=options['window'])
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('The batch size must be positive')
+
+        aliases = [options['using']] if options['using'] else search_connections()
+        backends = [(using, haystack.connections[using].get_backend())
+                    for using in aliases]
+
+        indexed = removed = 0
+        skipped = set()
+        while True:
+            # Skip over entries that were held back for incomplete metadata,
+            # so that they don't block the rest of the queue.
+            entries = list(IndexQueueEntry.objects.ready(window)
+                           .exclude(pk__in=skipped)[:batch_size])
+            if not entries:
+                break
+
+            held = set()
+            indexed_objs = {}
+            for using, backend in backends:
+                batch_indexed, batch_removed, batch_held = \
+                    self.index_batch(using, backend, entries)
+                commit_documents(backend)
+
+                indexed += len(batch_indexed)
+                removed += batch_removed
+                held.update(batch_held)
+                indexed_objs.update(((type(obj), obj.pk), obj)
+                                    for obj in batch_indexed)
+
+            # Entries for objects that changed again while we were indexing
+            # them have been bumped past the window; leave those queued.
+            done = [entry.pk for entry in entries if entry.pk not in held]
+            IndexQueueEntry.objects.ready(window).filter(pk__in=done).delete()
+
+            skipped.update(held)
+            if indexed_objs:
+                content_indexed.send(sender=IndexQueueEntry,
+                                     instances=indexed_objs.values())
+
+        if indexed or removed:
+            for using in aliases:
+                bump_index_version(using)
+
+        self.stdout.write('Indexed %d objects and removed %d; %d are waiting '
+                          'on metadata\n' % (indexed, removed, len(skipped)))
+
+    def index_batch(self, using, backend, entries):
+        """
+        Index the objects for the given queue entries into the connection.
+        Returns the list of objects indexed, the number removed, and the set
+        of entries that aren't ready to be indexed yet.
+        """
+        indexed = []
+        removed = 0
+        held = set()
+
+        entries_by_model = {}
+        for entry in entries:
+            entries_by_model.setdefault(entry.model_name, []).append(entry)
+
+        for model_name, model_entries in entries_by_model.items():
+            if model_name not in INDEXES:
+                log.warning('Dropping queued objects of unknown type %r' % model_name)
+                continue
+
+            index = INDEXES[model_name]()
+            keys = [entry.object_key for entry in model_entries]
+            objs = dict((obj.pk, obj) for obj in
+                        index.prefetched_queryset(using).filter(pk__in=keys))
+
+            ready_objs = []
+            for entry in model_entries:
+                obj = objs.get(entry.object_key)
+
+                # Objects that have been deleted, or that no longer belong in
+                # the index, are taken out of it.
+                if obj is None:
+                    model = index.get_model()
+                    backend.remove('%s.%s.%s' % (model._meta.app_label,
+                                                 model_name, entry.object_key),
+                                   commit=False)
+                    removed += 1
+
+                elif not self.has_metadata(obj):
+                    held.add(entry.pk)
+
+                else:
+                    ready_objs.append(obj)
+
+            if ready_objs:
+                backend.update(index, ready_objs, commit=False)
+                indexed.extend(ready_objs)
+
+        log.info('Indexed %d queued objects, removed %d' % (len(indexed), removed))
+        return indexed, removed, held
+
+    def has_metadata(self, obj):
+        try:
+            obj.metadata
+        except ObjectDoesNotExist:
+            return False
+        return True
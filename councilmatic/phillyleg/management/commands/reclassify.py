@@ -1,19 +1,170 @@
-from django.core.management.base import BaseCommand, CommandError
-from phillyleg.models import LegFile, LegFileMetaData, MetaData_Topic
+###############################################################################
+# Classify every legislative file's title again with settings.TOPIC_CLASSIFIER
+# (e.g., after its rules change) and save the topic assignments that changed.
+#
+# Files are read in key order, a chunk at a time, and their titles are
+# classified in a pool of worker processes.  Each chunk's assignments are
+# compared with the saved ones, and only the differences are deleted and
+# inserted, in bulk.  Files whose topics changed are queued to be indexed
+# again.  With --dry-run, nothing is saved; the command reports how many files
+# would gain and lose each topic instead (and, with --verbosity=2, each file's
+# changes).
+###############################################################################
+
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from itertools import imap
+from multiprocessing import Pool, cpu_count
+import optparse
+import time
+
+from phillyleg.models import (LegFile, LegFileMetaData, MetaData_Topic,
+    IndexQueueEntry)
+from phillyleg.topics import classify_titles
+from utils.querysets import iter_chunks, Progress
+
+TopicAssignment = LegFileMetaData.topics.through
+
+
+def classify_chunk(legfiles):
+    """
+    Classify the titles of a chunk of (key, title) pairs.  Returns the keys
+    along with the list of topics of each.
+    """
+    keys = [key for key, title in legfiles]
+    return keys, classify_titles(title for key, title in legfiles)
 
 
 class Command(BaseCommand):
-    help = "python manage.py reclassify"
-    def handle(self,  *args, **options):
-        legs = LegFile.objects.all()
-        for i, leg in enumerate(legs) :
-            if i % 100 == 0 :
-                print i
-            metadata = LegFileMetaData.objects.get_or_create(legfile=leg)[0]
-            metadata.topics.clear()
-
-            for topic in leg.topics():
-                t = MetaData_Topic.objects.get_or_create(topic=topic)[0]
-                metadata.topics.add(t)
-
-            metadata.save()
+    help = "Classify the topics of all of the legislation again."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--chunk-size',
+                dest='chunk_size',
+                type='int',
+                default=5000,
+                help='The number of files to classify at a time'),
+            optparse.make_option('--workers',
+                dest='workers',
+                type='int',
+                default=cpu_count(),
+                help='The number of processes classifying titles; 0 classifies them in this process'),
+            optparse.make_option('--dry-run',
+                action='store_true',
+                dest='dry_run',
+                default=False,
+                help="Report the changes to the files' topics without saving them"),
+            )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = int(options['verbosity'])
+        self.topic_ids = dict(MetaData_Topic.objects.values_list('topic', 'pk'))
+        self.added = defaultdict(int)
+        self.removed = defaultdict(int)
+
+        chunks = iter_chunks(LegFile.objects.all(), options['chunk_size'],
+                             fields=('pk', 'title'))
+
+        pool = None
+        if options['workers'] > 0:
+            # The workers will be forked with a copy of this process's
+            # database connections, which can't be shared; close them first.
+            # The workers only classify titles; all of the reading and
+            # writing happens in this process.
+            for conn in connections.all():
+                conn.close()
+            pool = Pool(options['workers'])
+
+        changed = 0
+        progress = Progress('Files classified', total=LegFile.objects.count())
+        try:
+            classified = pool.imap(classify_chunk, chunks) if pool else \
+                         imap(classify_chunk, chunks)
+            for keys, topics in classified:
+                changed += self.save_changes(keys, topics)
+                progress.add(len(keys))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        progress.done()
+        for topic in sorted(set(self.added) | set(self.removed)):
+            self.stdout.write('%s: +%d -%d\n' % (topic, self.added[topic], self.removed[topic]))
+        self.stdout.write('%s %d of %d files in %.1fs\n' %
+                          ('Would change' if self.dry_run else 'Changed',
+                           changed, progress.count, time.time() - progress.start))
+
+    def topic_id(self, topic):
+        if topic not in self.topic_ids:
+            self.topic_ids[topic] = MetaData_Topic.objects.get_or_create(topic=topic)[0].pk
+        return self.topic_ids[topic]
+
+    def metadata_ids(self, keys):
+        """
+        The key of each file's metadata, by file key.  Metadata is created for
+        any files that have none (except in a dry run).
+        """
+        metadata_ids = dict(LegFileMetaData.objects.filter(legfile__in=keys)
+                            .values_list('legfile', 'pk'))
+        missing = [key for key in keys if key not in metadata_ids]
+        if missing and not self.dry_run:
+            LegFileMetaData.objects.bulk_create(
+                [LegFileMetaData(legfile_id=key) for key in missing])
+            metadata_ids.update(LegFileMetaData.objects.filter(legfile__in=missing)
+                                .values_list('legfile', 'pk'))
+        return metadata_ids
+
+    @transaction.commit_on_success
+    def save_changes(self, keys, topics):
+        """
+        Save the changes to the topics of the files with the given keys, and
+        tally them.  Returns the number of files that changed.
+        """
+        metadata_ids = self.metadata_ids(keys)
+        keys_by_metadata_id = dict((pk, key) for key, pk in metadata_ids.items())
+
+        wanted = set((key, topic) for key, file_topics in zip(keys, topics)
+                     for topic in file_topics)
+
+        saved = {}
+        assignments = TopicAssignment.objects \
+            .filter(legfilemetadata__in=metadata_ids.values()) \
+            .values_list('pk', 'legfilemetadata', 'metadata_topic__topic')
+        for pk, metadata_id, topic in assignments:
+            saved[(keys_by_metadata_id[metadata_id], topic)] = pk
+
+        removed = sorted(pair for pair in saved if pair not in wanted)
+        added = sorted(pair for pair in wanted if pair not in saved)
+        for key, topic in removed:
+            self.removed[topic] += 1
+        for key, topic in added:
+            self.added[topic] += 1
+
+        changed_keys = sorted(set(key for key, topic in removed + added))
+        if self.verbosity >= 2:
+            changes = defaultdict(list)
+            for key, topic in removed:
+                changes[key].append('-' + topic)
+            for key, topic in added:
+                changes[key].append('+' + topic)
+            for key in changed_keys:
+                self.stdout.write('%s: %s\n' % (key, ' '.join(changes[key])))
+
+        if self.dry_run:
+            return len(changed_keys)
+
+        if removed:
+            TopicAssignment.objects.filter(pk__in=[saved[pair] for pair in removed]).delete()
+        if added:
+            TopicAssignment.objects.bulk_create(
+                [TopicAssignment(legfilemetadata_id=metadata_ids[key],
+                                 metadata_topic_id=self.topic_id(topic))
+                 for key, topic in added])
+
+        # The topics are in the search index.
+        for key in changed_keys:
+            IndexQueueEntry.objects.enqueue(LegFile(key=key))
+
+        return len(changed_keys)
@@ -0,0 +1,94 @@
+###############################################################################
+# Render the low-zoom map tiles of the districts and of the locations
+# mentioned in legislation into the tile cache (see phillyleg.tiles).
+#
+# Low-zoom tiles cover the most ground, so they're the slowest to render on
+# request. Rendering them ahead of time (every night, from the cron job) means
+# that the first visitor to a map never waits on them.
+#
+# Each city's tiles are rendered from its own districts and legislation (see
+# phillyleg.cities).
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+import optparse
+import time
+
+from phillyleg.cities import current_city, get_cities
+from phillyleg.tiles import (LAYERS, PRECOMPUTED_MAX_ZOOM, current_plan,
+    layer_extent, render_tile, save_tile, tile_path, tiles_covering)
+
+
+class Command(BaseCommand):
+    help = "Render the low-zoom map tiles into the tile cache."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--min-zoom',
+                dest='min_zoom',
+                type='int',
+                default=0,
+                help='The lowest zoom level to render (default: 0)'),
+            optparse.make_option('--max-zoom',
+                dest='max_zoom',
+                type='int',
+                default=PRECOMPUTED_MAX_ZOOM,
+                help='The highest zoom level to render (default: %d)' % PRECOMPUTED_MAX_ZOOM),
+            optparse.make_option('--layers',
+                dest='layers',
+                default=','.join(LAYERS),
+                help='A comma-separated list of the layers to render (default: %s)' % ','.join(LAYERS)),
+            optparse.make_option('--city',
+                dest='city',
+                default=None,
+                help='The slug of the city to render (default: every city)'),
+            )
+
+    def handle(self, *args, **options):
+        layers = [name.strip() for name in options['layers'].split(',')]
+        for name in layers:
+            if name not in LAYERS:
+                raise CommandError('Unknown layer %r; choose from %s' %
+                                   (name, ', '.join(LAYERS)))
+
+        if options['max_zoom'] > PRECOMPUTED_MAX_ZOOM:
+            raise CommandError('Tiles above zoom level %d aren\'t saved in the '
+                               'tile cache' % PRECOMPUTED_MAX_ZOOM)
+
+        cities = get_cities()
+        if options['city'] and options['city'] not in cities:
+            raise CommandError('Unknown city %r' % options['city'])
+
+        if tile_path('locations', 0, 0, 0) is None:
+            raise CommandError('Set TILE_CACHE_DIR to render tiles into.')
+
+        no_plan = []
+        for slug in ([options['city']] if options['city'] else sorted(cities)):
+            with current_city(slug):
+                plan = current_plan()
+                if plan is None:
+                    no_plan.append(slug)
+                    continue
+                self.render_city(slug, plan, layers, options['min_zoom'], options['max_zoom'])
+
+        if no_plan:
+            raise CommandError('There is no district plan in effect for %s.' % ', '.join(no_plan))
+
+    def render_city(self, slug, plan, layers, min_zoom, max_zoom):
+        # Render the tiles over each layer's features: the current districts
+        # and all of the city's locations.  (The tiles outside them are
+        # served empty without being saved.)
+        extents = dict((layer, layer_extent(layer, plan, refresh=True))
+                       for layer in layers)
+
+        for z in range(min_zoom, max_zoom + 1):
+            start = time.time()
+            count = 0
+            for layer in layers:
+                if extents[layer] is None:
+                    continue
+                for x, y in tiles_covering(extents[layer], z):
+                    save_tile(tile_path(layer, z, x, y, plan),
+                              render_tile(layer, z, x, y, plan))
+                    count += 1
+
+            self.stdout.write('%s zoom %d: %d tiles in %.1fs\n' %
+                              (slug, z, count, time.time() - start))
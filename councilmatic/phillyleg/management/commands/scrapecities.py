@@ -0,0 +1,66 @@
+###############################################################################
+# Collect the latest legislative filings of every city that the deployment
+# hosts (see phillyleg.cities).
+#
+# Each city's scrape is a job, and --update adds a second job per city that
+# refreshes its existing files.  The jobs share a pool of worker threads: they
+# start in order of their cities' PRIORITY, and each city runs at most
+# CONCURRENCY of its jobs at once.  Requests to each host are throttled across
+# all of the jobs (see scraper_wrappers.throttle).
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+import logging
+import optparse
+
+from phillyleg.cities import get_cities
+from phillyleg.management.commands.updatelegfiles import update_city
+from phillyleg.management.scraper_wrappers.scheduler import ScraperScheduler
+from phillyleg.management.scraper_wrappers.throttle import log_stats
+
+
+class Command(BaseCommand):
+    args = '[city ...]'
+    help = "Load new legislative file data for every city, or for the given cities."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--update',
+                action='store_true',
+                dest='update_files',
+                default=False,
+                help='Update existing files as well'),
+            optparse.make_option('--workers',
+                dest='workers',
+                type='int',
+                default=2,
+                help='The number of scraper jobs to run at once, across all of the cities'),
+            )
+
+    def handle(self, *slugs, **options):
+        log = logging.getLogger()
+        log.setLevel(logging.INFO)
+
+        if options['workers'] < 1:
+            raise CommandError('There must be at least one worker')
+
+        cities = get_cities()
+        unknown = set(slugs) - set(cities)
+        if unknown:
+            raise CommandError('Unknown cities: %s' % ', '.join(sorted(unknown)))
+
+        scheduler = ScraperScheduler(options['workers'])
+        for slug in sorted(slugs or cities):
+            scheduler.add(cities[slug], 'new files', update_city, slug)
+        if options['update_files']:
+            for slug in sorted(slugs or cities):
+                scheduler.add(cities[slug], 'updated files', update_city, slug,
+                              new_files=False, update_files=True)
+
+        try:
+            scheduler.run()
+        finally:
+            # Report the request rates that the scrapers achieved.
+            log_stats()
+
+        if scheduler.failed:
+            raise CommandError('Failed: %s' % ', '.join(
+                '%s for %s' % (job.name, job.city.slug) for job in scheduler.failed))
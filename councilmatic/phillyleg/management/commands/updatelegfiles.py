@@ -6,17 +6,17 @@
 #will send out daily email for users - first will read all keywords
 #create text files, then email text files to all each user subscribed.
 
-from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.core.exceptions import ImproperlyConfigured
-from django.utils.importlib import import_module
 import django
 import logging
 import optparse
 import sys
 
+from phillyleg.cities import current_city, default_city
 from phillyleg.management.scraper_wrappers import CouncilmaticDataStoreWrapper
 from phillyleg.management.scraper_wrappers import PhillyLegistarSiteWrapper
+from phillyleg.management.scraper_wrappers.throttle import log_stats
 from utils import TooManyGeocodeRequests
 
 def import_leg_files(start_key, source, ds, save_key=False):
@@ -39,22 +39,51 @@ def import_leg_files(start_key, source, ds, save_key=False):
             ds.save_continuation_key(curr_key)
 
 
-def load_scraper():
-    scraper_name = settings.LEGISLATION['SCRAPER']
-    module, attr = scraper_name.rsplit('.', 1)
+def update_city(city, new_files=True, update_files=False):
+    """
+    Scrape the new and/or the existing legislation of the city.  This is run
+    under the city (see phillyleg.cities), so that its legislation is stored,
+    geocoded and cached as the city's.
+    """
+    with current_city(city) as city:
+        # Create a datastore wrapper object
+        ds = CouncilmaticDataStoreWrapper(city.slug)
+        source = city.load_scraper()
+
+        # Seed the PDF cache with already-downloaded content.
+        #
+        # Downloading and parsing PDF content really slows down the scraping
+        # process.  If we had to redownload all of them every time we scraped,
+        # it would take a really long time to refresh all of the old stuff.  So
+        # that PDFs that have already been downloaded won't be again, seed the
+        # source cache with that data.
+        #
+        # Hopefully this won't be too much of a burden on memory :).
+        source.init_pdf_cache(ds.pdf_mapping)
 
-    try:
-        mod = import_module(module)
-    except ImportError as e:
-        raise ImproperlyConfigured('Error importing legislation scraper %s: "%s"' % (scraper_name, e))
+        if new_files:
+            get_new_files(source, ds)
+        if update_files:
+            get_updated_files(source, ds)
 
-    try:
-        ScraperWrapper = getattr(mod, attr)
-    except AttributeError as e:
-        raise ImproperlyConfigured('Error importing legislation scraper %s: "%s"' % (scraper_name, e))
 
-    options = settings.LEGISLATION['SCRAPER_OPTIONS']
-    return ScraperWrapper(**options)
+def get_updated_files(source, ds):
+    # Continue updating the entire datastore
+    cont_key = ds.get_continuation_key()
+    import_leg_files(cont_key, source, ds, save_key=True)
+
+    # If we've made it here, then we have all the latest filings, and we have gone
+    # through and updated the entire datastore.  Now, reset the continuation key to
+    # get ready for the next go-around.
+#    ds.save_continuation_key(72)
+    cont_key = ds.get_continuation_key()
+    ds.save_continuation_key(cont_key - 1000) # This should be a configurable value
+
+
+def get_new_files(source, ds):
+    # Get the latest filings
+    curr_key = ds.get_latest_key()
+    import_leg_files(curr_key, source, ds)
 
 
 class Command(BaseCommand):
@@ -65,6 +94,10 @@ class Command(BaseCommand):
                 dest='update_files',
                 default=False,
                 help='Update existing files as well'),
+            optparse.make_option('--city',
+                dest='city',
+                default=None,
+                help='The slug of the city to scrape (default: settings.DEFAULT_CITY); see scrapecities to scrape every city'),
             )
 
 
@@ -72,49 +105,11 @@ class Command(BaseCommand):
         log = logging.getLogger()
         log.setLevel(logging.INFO)
 
-        # Create a datastore wrapper object
-        ds = self.ds = CouncilmaticDataStoreWrapper()
-        source = self.source = load_scraper()
-
-        # Seed the PDF cache with already-downloaded content.
-        #
-        # Downloading and parsing PDF content really slows down the scraping
-        # process.  If we had to redownload all of them every time we scraped,
-        # it would take a really long time to refresh all of the old stuff.  So
-        # that PDFs that have already been downloaded won't be again, seed the
-        # source cache with that data.
-        #
-        # Hopefully this won't be too much of a burden on memory :).
-        source.init_pdf_cache(ds.pdf_mapping)
-
-        update_files = options['update_files']
-
         try:
-            self._get_new_files()
-            if update_files:
-                self._get_updated_files()
+            update_city(options['city'] or default_city(),
+                        update_files=options['update_files'])
         except TooManyGeocodeRequests:
             sys.exit(0)
-
-    def _get_updated_files(self):
-        ds = self.ds
-        source = self.source
-
-        # Continue updating the entire datastore
-        cont_key = ds.get_continuation_key()
-        import_leg_files(cont_key, source, ds, save_key=True)
-
-        # If we've made it here, then we have all the latest filings, and we have gone
-        # through and updated the entire datastore.  Now, reset the continuation key to
-        # get ready for the next go-around.
-#        ds.save_continuation_key(72)
-        cont_key = ds.get_continuation_key()
-        ds.save_continuation_key(cont_key - 1000) # This should be a configurable value
-
-    def _get_new_files(self):
-        ds = self.ds
-        source = self.source
-
-        # Get the latest filings
-        curr_key = ds.get_latest_key()
-        import_leg_files(curr_key, source, ds)
+        finally:
+            # Report the request rates that the scraper achieved.
+            log_stats()
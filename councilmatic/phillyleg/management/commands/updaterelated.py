@@ -0,0 +1,49 @@
+###############################################################################
+# Save the most related files of each legislative file that has changed since
+# the last run, and of the files they're now among the most related to (see
+# phillyleg.related).  Each city's files are only related to one another.
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+import optparse
+import time
+
+from phillyleg.cities import get_cities
+from phillyleg.related import update_related, TOP_RELATED
+
+
+class Command(BaseCommand):
+    help = "Bring the saved related legislation up to date."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--rebuild',
+                action='store_true',
+                dest='rebuild',
+                default=False,
+                help='Save the related files of every file again, not just the changed ones'),
+            optparse.make_option('--top',
+                dest='top',
+                type='int',
+                default=TOP_RELATED,
+                help='The number of related files to save for each file (default: %d)' % TOP_RELATED),
+            optparse.make_option('--chunk-size',
+                dest='chunk_size',
+                type='int',
+                default=1000,
+                help='The number of files to read, or save the related files of, at a time'),
+            optparse.make_option('--city',
+                dest='city',
+                default=None,
+                help='The slug of the city to update (default: every city)'),
+            )
+
+    def handle(self, *args, **options):
+        cities = get_cities()
+        if options['city'] and options['city'] not in cities:
+            raise CommandError('Unknown city %r' % options['city'])
+
+        for slug in ([options['city']] if options['city'] else sorted(cities)):
+            start = time.time()
+            count = update_related(slug, rebuild=options['rebuild'], count=options['top'],
+                                   chunk_size=options['chunk_size'])
+            self.stdout.write('Updated the related files of %d files of %s in %.1fs\n' %
+                              (count, slug, time.time() - start))
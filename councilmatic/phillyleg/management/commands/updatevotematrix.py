@@ -0,0 +1,43 @@
+###############################################################################
+# Add the votes recorded since the last run to the saved vote matrix, and
+# cache the voting summary computed from it (see phillyleg.analytics).  Each
+# city has its own matrix and summary.
+###############################################################################
+
+from django.core.management.base import BaseCommand, CommandError
+import optparse
+import time
+
+from phillyleg.analytics import update_vote_matrix, cache_vote_summary
+from phillyleg.cities import current_city, get_cities
+
+
+class Command(BaseCommand):
+    help = "Bring the vote matrix up to date and cache the voting summary."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--rebuild',
+                action='store_true',
+                dest='rebuild',
+                default=False,
+                help='Build the matrix again from every vote, e.g. after council members are merged'),
+            optparse.make_option('--city',
+                dest='city',
+                default=None,
+                help='The slug of the city to update (default: every city)'),
+            )
+
+    def handle(self, *args, **options):
+        cities = get_cities()
+        if options['city'] and options['city'] not in cities:
+            raise CommandError('Unknown city %r' % options['city'])
+
+        for slug in ([options['city']] if options['city'] else sorted(cities)):
+            with current_city(slug):
+                start = time.time()
+                matrix = update_vote_matrix(rebuild=options['rebuild'])
+                summary = cache_vote_summary(matrix)
+
+            self.stdout.write('%s: %d members x %d actions (%d contested), %d blocs, in %.1fs\n' %
+                              (slug, len(matrix.member_ids), len(matrix.action_ids),
+                               summary['contested_actions'], len(summary['blocs']),
+                               time.time() - start))
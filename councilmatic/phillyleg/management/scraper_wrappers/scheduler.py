@@ -0,0 +1,112 @@
+"""
+Scheduling of the scraper jobs of several cities on a shared pool of workers.
+
+Each job belongs to a city (see phillyleg.cities).  Jobs start in order of
+their cities' PRIORITY, highest first, as workers come free; a city runs at
+most CONCURRENCY of its jobs at once, and while it's at its limit, the jobs
+of the cities after it go ahead.  A job that fails is logged, and doesn't
+stop the others.
+"""
+
+from collections import defaultdict
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ScraperJob (object):
+    def __init__(self, city, name, func, *args, **kwargs):
+        self.city = city
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return self.func(*self.args, **self.kwargs)
+
+    def __repr__(self):
+        return '<ScraperJob %s %s>' % (self.city.slug, self.name)
+
+
+class ScraperScheduler (object):
+    """
+    Runs the jobs that are added to it on worker threads.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.pending = []
+        self.running = defaultdict(int)
+
+        self.started = []
+        self.failed = []
+        self.durations = {}
+
+    def add(self, city, name, func, *args, **kwargs):
+        """
+        Queue a job to call func with the arguments.  Jobs of the same
+        priority start in the order they're added.
+        """
+        job = ScraperJob(city, name, func, *args, **kwargs)
+        with self.condition:
+            self.pending.append(job)
+            self.pending.sort(key=lambda job: -job.city.priority)
+        return job
+
+    def next_job(self):
+        """
+        Take the first pending job whose city has room for it, waiting for a
+        job to finish if none has.  None when there are no jobs left.
+        """
+        with self.condition:
+            while self.pending:
+                for job in self.pending:
+                    if self.running[job.city.slug] < job.city.concurrency:
+                        self.pending.remove(job)
+                        self.running[job.city.slug] += 1
+                        self.started.append(job)
+                        return job
+                self.condition.wait()
+            return None
+
+    def finish(self, job):
+        with self.condition:
+            self.running[job.city.slug] -= 1
+            self.condition.notify_all()
+
+    def work(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+
+            log.info('Starting %s for %s' % (job.name, job.city.name))
+            start = time.time()
+            try:
+                job.run()
+            except Exception:
+                log.exception('%s for %s failed' % (job.name, job.city.name))
+                self.failed.append(job)
+            finally:
+                self.durations[job] = time.time() - start
+                log.info('Finished %s for %s in %.1fs' % (job.name, job.city.name, self.durations[job]))
+                self.finish(job)
+
+    def run(self):
+        """
+        Run all of the jobs, and return once they're done.
+        """
+        threads = [threading.Thread(target=self.work)
+                   for _ in range(min(self.workers, len(self.pending)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # Join with a timeout, so that the main thread stays interruptible.
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
@@ -1,5 +1,4 @@
 import datetime
-import time
 import httplib
 import logging
 import re
@@ -8,6 +7,8 @@ import utils
 import urlparse
 from collections import defaultdict
 
+from phillyleg.management.scraper_wrappers.throttle import get_throttle
+
 from legistar.scraper import LegistarScraper
 from legistar.config import Config, DEFAULT_CONFIG
 
@@ -39,8 +40,28 @@ class HostedLegistarSiteWrapper (object):
         self.controlling_body_label = options.pop('controlling_body_label', 'Current Controlling Legislative Body')
         self.version_label = options.pop('version_label', 'Version')
 
+        # Every request to the host goes through its shared throttle; options
+        # for it (see HostThrottle) can be given as a 'throttle' dict.
+        self.throttle = get_throttle(options.get('hostname', ''),
+                                     **options.pop('throttle', {}))
+
         self.scraper = LegistarScraper(options)
-        self.legislation_summaries =  self.scraper.searchLegislation('', created_before='2012-10-5')
+        self.summaries_read = 0
+        self.legislation_summaries = self.search_summaries()
+
+    max_summary_retries = 5
+    """The number of times in a row that the search is started again after
+       the host fails, before the failure is raised"""
+
+    def search_summaries(self):
+        return self.scraper.searchLegislation('', created_before='2012-10-5')
+
+    def resume_summaries(self, skip):
+        '''Search again, skipping the first skip summary rows (those that were
+           already read).'''
+        for index, summary in enumerate(self.search_summaries()):
+            if index >= skip:
+                yield summary
 
     def scrape_legis_file(self, key, summary):
         '''Extract a record from the given document (soup). The key is for the
@@ -48,26 +69,14 @@ class HostedLegistarSiteWrapper (object):
 
         while True :
             try:
-                legislation_attrs, legislation_history = self.scraper.expandLegislationSummary(summary)
+                legislation_attrs, legislation_history = \
+                    self.throttle.call(self.scraper.expandLegislationSummary, summary)
                 break
-            except urllib2.URLError as e:
-                log.warning(e)
-                log.warning('skipping to next leg record')
-            except AttributeError as e :
+            except (urllib2.URLError, AttributeError) as e:
                 log.warning(e)
                 log.warning('skipping to next leg record')
-            while True :
-                try:
-                    summary = self.legislation_summaries.next()
-                    break
-                except urllib2.URLError as e:
-                    log.warning(e)
-                    log.warning('sleeping for five minutes')
-                    time.sleep('360')
-
+            summary = self.next_summary()
 
-
-            
         parsed_url = urlparse.urlparse(summary['URL'])
         key = urlparse.parse_qs(parsed_url.query)['ID'][0]
         
@@ -122,7 +131,8 @@ class HostedLegistarSiteWrapper (object):
         actions = []
         for act in legislation_history :
             try:
-                act_details, act_votes = self.scraper.expandHistorySummary(act)
+                act_details, act_votes = \
+                    self.throttle.call(self.scraper.expandHistorySummary, act)
             except (KeyError, AttributeError) as e:
                 print e
                 print summary
@@ -170,6 +180,28 @@ class HostedLegistarSiteWrapper (object):
             return ''
 
 
+    def next_summary(self):
+        '''Get the next legislation summary row.  A search that has failed is
+           over, so when the host fails, the search is started again after
+           the rows already read.  The throttle backs off, and pauses when the
+           host keeps failing, so the retries don't hammer it; after
+           max_summary_retries failures in a row, the error is raised.'''
+        failures = 0
+        while True :
+            try:
+                summary = self.throttle.call(self.legislation_summaries.next)
+                break
+            except urllib2.URLError as e:
+                failures += 1
+                if failures > self.max_summary_retries:
+                    raise
+                log.warning(e)
+                log.warning('searching again after leg record %d' % self.summaries_read)
+                self.legislation_summaries = self.resume_summaries(self.summaries_read)
+
+        self.summaries_read += 1
+        return summary
+
     def check_for_new_content(self, last_key):
         '''Grab the next legislation summary row. Doesn't use the last_key
            parameter; just starts at the beginning for each instance of the
@@ -177,7 +209,7 @@ class HostedLegistarSiteWrapper (object):
         '''
         try:
             print 'next leg record'
-            next_summary = self.legislation_summaries.next()
+            next_summary = self.next_summary()
             return 0, next_summary
         except StopIteration:
             return None, None
@@ -0,0 +1,102 @@
+"""
+Parsing of the legislative file pages of a Daystar Insite site.
+
+A page is parsed once, with lxml, and everything that the scraper reads from
+it is picked out in a single pass over the elements that have ids: the text
+of each of the file's field spans, the attachment links, and the cells of the
+history table.
+"""
+
+from bs4 import UnicodeDammit
+import lxml.html
+
+
+FIELD_IDS = {
+    'lblFileNumberValue': 'id',
+    'lblFileTypeValue': 'type',
+    'lblFileStatusValue': 'status',
+    'lblTitleValue': 'title',
+    'lblControllingBodyValue': 'controlling_body',
+    'lblIntroDateValue': 'intro_date',
+    'lblFinalActionValue': 'final_date',
+    'lblVersionValue': 'version',
+    'lblContactValue': 'contact',
+    'lblSponsorsValue': 'sponsors',
+}
+"""The field of the file that the text of each span holds, by span id"""
+
+ATTACHMENTS_ID = 'divAttachmentsValue'
+HISTORY_ID = 'divScroll'
+ERROR_CLASS = 'errorText'
+
+# Elements with ids, and the paragraph that only error pages have.
+TARGETS_XPATH = '//*[@id] | //p[@class="%s"]' % ERROR_CLASS
+
+
+def parse_html(html):
+    """
+    Parse a page (a string, or a response or file) with lxml.  The pages
+    don't declare their encoding, and lxml would read them as Latin-1, so the
+    encoding is taken from the response's Content-Type, or else guessed.
+    """
+    encodings = []
+    if hasattr(html, 'info'):
+        charset = html.info().getparam('charset')
+        if charset:
+            encodings.append(charset)
+    if hasattr(html, 'read'):
+        html = html.read()
+
+    if isinstance(html, unicode):
+        return lxml.html.fromstring(html)
+    encoding = UnicodeDammit(html, encodings, is_html=True).original_encoding
+    return lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding=encoding))
+
+
+def read_cell(cell):
+    """
+    The (text, link text, href) of a table cell.  The link text and href are
+    those of the cell's first link; a cell without a link has its own text as
+    the link text, and an empty href.
+    """
+    text = cell.text_content()
+    for link in cell.iter('a'):
+        return text, link.text_content(), link.get('href', '')
+    return text, text, ''
+
+
+class LegFilePage (object):
+    """
+    The parts of a legislative file page that the scraper reads:
+
+    fields
+      The text of each of the file's fields (see FIELD_IDS), by field name
+    attachments
+      The (description, url) of each attachment link
+    history
+      The rows of the history table, each a list of the (text, link text,
+      href) of its cells (see read_cell)
+    is_error_page
+      Whether the page is the site's error page (e.g., for a missing file)
+    """
+
+    def __init__(self, html):
+        root = parse_html(html)
+
+        self.fields = {}
+        self.attachments = []
+        self.history = []
+        self.is_error_page = False
+
+        for element in root.xpath(TARGETS_XPATH):
+            element_id = element.get('id')
+            if element_id in FIELD_IDS:
+                self.fields[FIELD_IDS[element_id]] = element.text_content()
+            elif element_id == ATTACHMENTS_ID:
+                self.attachments = [(link.text_content(), link.get('href', ''))
+                                    for link in element.iter('a')]
+            elif element_id == HISTORY_ID:
+                self.history = [[read_cell(cell) for cell in row.iter('td')]
+                                for row in element.iter('tr')]
+            elif element.tag == 'p' and element.get('class') == ERROR_CLASS:
+                self.is_error_page = True
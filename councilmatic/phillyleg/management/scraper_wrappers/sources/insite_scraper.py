@@ -6,6 +6,10 @@ import urllib2
 import utils
 from bs4 import BeautifulSoup
 
+from insite_page import LegFilePage
+
+from phillyleg.management.scraper_wrappers.throttle import get_throttle
+
 log = logging.getLogger(__name__)
 
 STARTING_KEY = 72 # The highest key was 11001 as of 5 Apr 2011
@@ -17,66 +21,42 @@ class PhillyLegistarSiteWrapper (object):
     of interaction is scrape_legis_file.
     """
 
-    def __init__(self, root_url):
+    def __init__(self, root_url, throttle=None):
         self.root_url = root_url
 
+        # Every request to the site goes through its shared throttle; options
+        # for it (see HostThrottle) can be given as a throttle dict.
+        self.throttle = get_throttle(root_url, **(throttle or {}))
+
     def get_legfile_url(self, key):
         return self.root_url + 'detailreport/?key=' + str(key)
 
     def urlopen(self, *args, **kwargs):
-        return urllib2.urlopen(*args, **kwargs)
-
-    def scrape_legis_file(self, key, soup):
-        '''Extract a record from the given document (soup). The key is for the
-           sake of record-keeping.  It is the key passed to the site URL.'''
-
-        span = soup.find('span', {'id':'lblFileNumberValue'})
-        lid = span.text
-
-        span = soup.find('span', {'id':'lblFileTypeValue'})
-        ltype = span.text
-
-        span = soup.find('span', {'id':'lblFileStatusValue'})
-        lstatus = span.text
-
-        span = soup.find('span', {'id':'lblTitleValue'})
-        ltitle = span.text
-
-        span = soup.find('span', {'id':'lblControllingBodyValue'})
-        lbody = span.text
-
-        span = soup.find('span', {'id':'lblIntroDateValue'})
-        lintro = span.text
-
-        span = soup.find('span', {'id':'lblFinalActionValue'})
-        lfinal = span.text
+        return self.throttle.call(urllib2.urlopen, *args, **kwargs)
 
-        span = soup.find('span', {'id':'lblVersionValue'})
-        lversion = span.text
-
-        span = soup.find('span', {'id':'lblContactValue'})
-        lcontact = span.text
-
-        span = soup.find('span', {'id':'lblSponsorsValue'})
-        lsponsors = span.text
+    def scrape_legis_file(self, key, page):
+        '''Extract a record from the given page (a LegFilePage). The key is
+           for the sake of record-keeping.  It is the key passed to the site
+           URL.'''
 
+        fields = page.fields
         record = {
             'key' : key,
-            'id' : lid,
+            'id' : fields.get('id', ''),
             'url' : self.get_legfile_url(key),
-            'type' : ltype.strip(),
-            'status' : lstatus.strip(),
-            'title' : ltitle.strip(),
-            'controlling_body' : lbody,
-            'intro_date' : self.convert_date(lintro),
-            'final_date' : self.convert_date(lfinal),
-            'version' : lversion,
-            'contact' : lcontact.strip(),
-            'sponsors' : lsponsors
+            'type' : fields.get('type', '').strip(),
+            'status' : fields.get('status', '').strip(),
+            'title' : fields.get('title', '').strip(),
+            'controlling_body' : fields.get('controlling_body', ''),
+            'intro_date' : self.convert_date(fields.get('intro_date')),
+            'final_date' : self.convert_date(fields.get('final_date')),
+            'version' : fields.get('version', ''),
+            'contact' : fields.get('contact', '').strip(),
+            'sponsors' : fields.get('sponsors', '')
         }
 
-        attachments = self.scrape_legis_attachments(key, soup)
-        actions = self.scrape_legis_actions(key, soup)
+        attachments = self.scrape_legis_attachments(key, page)
+        actions = self.scrape_legis_actions(key, page)
         minutes = self.collect_minutes(actions)
 
         log.info('Scraped legfile with key %r' % (key,))
@@ -123,18 +103,15 @@ class PhillyLegistarSiteWrapper (object):
 
         return minutes.values()
 
-    def scrape_legis_attachments(self, key, soup):
+    def scrape_legis_attachments(self, key, page):
         """
-        Given a beautiful soup representation of legislative file, return the
-        list of attachments.
+        Given a LegFilePage of a legislative file, return the list of
+        attachments.
         """
 
         attachments = []
 
-        attach_div = soup.find('div', {'id' : 'divAttachmentsValue'})
-        for cell in attach_div.findAll('a'):
-            url = cell['href']
-
+        for description, url in page.attachments:
             if url.endswith('.pdf'):
                 fulltext = self.extract_pdf_text(url)
             else:
@@ -142,7 +119,7 @@ class PhillyLegistarSiteWrapper (object):
 
             attachment = {
                 'key' : key,
-                'description' : cell.text,
+                'description' : description,
                 'url' : url,
                 'fulltext' : fulltext,
             }
@@ -150,51 +127,32 @@ class PhillyLegistarSiteWrapper (object):
 
         return attachments
 
-    def scrape_legis_actions(self, key, soup):
+    def scrape_legis_actions(self, key, page):
         """
-        Given a beautiful soup representation of a legislative file,
-        return the actions taken on the file.
+        Given a LegFilePage of a legislative file, return the actions taken
+        on the file.  Each cell is a (text, link text, href); see
+        LegFilePage.
         """
 
-        def get_action_cell_text(cell):
-            cell_a = cell.find('a')
-            if cell_a:
-                return cell_a.text
-            else:
-                return cell.text
-
-        def get_action_cell_resource(cell):
-            cell_a = cell.find('a')
-            if cell_a:
-                return cell_a['href']
-            else:
-                return ''
-
-        notes = []
         actions = []
 
-        action_div = soup.find('div', {'id': 'divScroll'})
-        action_rows = action_div.findAll('tr')
-
-        for action_row in action_rows:
-            cells = action_row.findAll('td')
-
+        for cells in page.history:
             if len(cells) == 2:
                 # Sometimes, there are notes interspersed in the history table.
                 # Luckily (?) their rows have only two cells instead of four, so
                 # we can easily tell that they're there.
                 if actions:
                     action = actions[-1]
-                    action['notes'] = cells[1].text.strip()
+                    action['notes'] = cells[1][0].strip()
                 continue
 
             action = {
                 'key' : key,
-                'date_taken' : self.convert_date(get_action_cell_text(cells[0])),
-                'acting_body' : get_action_cell_text(cells[1]).strip(),
-                'description' : get_action_cell_text(cells[2]).strip(),
-                'motion' : get_action_cell_text(cells[3]).strip(),
-                'minutes_url' : get_action_cell_resource(cells[0]).strip(),
+                'date_taken' : self.convert_date(cells[0][1]),
+                'acting_body' : cells[1][1].strip(),
+                'description' : cells[2][1].strip(),
+                'motion' : cells[3][1].strip(),
+                'minutes_url' : cells[0][2].strip(),
                 'notes' : '',
             }
             actions.append(action)
@@ -203,9 +161,13 @@ class PhillyLegistarSiteWrapper (object):
 
     __pdf_cache = None
     def init_pdf_cache(self, seed=None):
-        if seed is None:
-            seed = {}
-        self.__pdf_cache = self.__pdf_cache or seed
+        # Check for an empty cache by its length, not its truth; a seed may
+        # be a lazy mapping that has nothing loaded yet.
+        if seed is not None:
+            if self.__pdf_cache is None or not len(self.__pdf_cache):
+                self.__pdf_cache = seed
+        elif self.__pdf_cache is None:
+            self.__pdf_cache = {}
 
     def extract_pdf_text(self, pdf_data, tries_left=5):
         """
@@ -269,12 +231,9 @@ class PhillyLegistarSiteWrapper (object):
             return ''
 
 
-    def is_error_page(self, soup):
-        '''Check the given soup to see if it represents an error page.'''
-        error_p = soup.find('p', 'errorText')
-
-        if error_p is None: return False
-        else: return True
+    def is_error_page(self, page):
+        '''Check the given page to see if it represents an error page.'''
+        return page.is_error_page
 
     def check_for_new_content(self, last_key):
         '''Look through the next 100 keys to see if there are any more files.
@@ -311,9 +270,9 @@ class PhillyLegistarSiteWrapper (object):
                     if not more_tries:
                         log.error('Ran out of tries for new content')
                         raise
-            soup = BeautifulSoup(html)
+            page = LegFilePage(html)
 
-            if not self.is_error_page(soup):
-                return curr_key, soup
+            if not self.is_error_page(page):
+                return curr_key, page
 
         return curr_key, None
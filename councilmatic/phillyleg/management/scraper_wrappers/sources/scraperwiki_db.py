@@ -1,166 +1,300 @@
 import datetime
+import email.utils
+import logging
 import os
+import shutil
 import sqlite3
+import tempfile
 import urllib2
 
-class ScraperWikiSourceWrapper (object):
-    """
-    A wrapper around the Scraperwiki sqlite3 database. This is a good source for
-    historical data, but not so much real time as it takes so long to update the
-    files. It is responsible for fetching and reading the data that has been
-    scraped into the ScraperWiki data store.
-    """
+log = logging.getLogger(__name__)
 
-    __cursor = None
-    """The sqlite3 database cursor"""
 
-    db_file_name = 'swdata.sqlite3'
-    """The local file name of the datastore."""
+def make_datetime(dt_str):
+    if not dt_str:
+        return None
+    if '-' in dt_str:
+        try:
+            return datetime.datetime.strptime(dt_str, '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            return datetime.datetime.strptime(dt_str, '%Y-%m-%d')
+    elif '/' in dt_str:
+        return datetime.datetime.strptime(dt_str, '%m/%d/%Y')
 
-    def urlopen(self, *args, **kwargs):
-        """A facade over urlopen; mainly used for stubbing in tests"""
-        return urllib2.urlopen(*args, **kwargs)
 
-    def scrape_legis_file(self, key, cursor):
-        """Extract a record from the given document (soup). The key is for the
-           sake of record-keeping.  It is the key passed to the site URL."""
+class LegFileReader (object):
+    """
+    Reads legislative files, along with their attachments, actions and
+    minutes, out of a ScraperWiki-style sqlite3 database (with swdata,
+    attachments, actions and minutes tables, all keyed by the file key).
+
+    Files are read in key order, chunk_size at a time.  Each chunk takes one
+    query per table, selecting the rows for the chunk's range of keys in key
+    order, so the rows of every table can be grouped with their files in a
+    single pass, however many files there are.
+    """
 
+    def __init__(self, connection, chunk_size=500):
+        self.connection = connection
+        self.chunk_size = chunk_size
+
+    def iter_legis_files(self, after_key=None):
+        """
+        Generate a (record, attachments, actions, minutes) tuple for each file
+        with a key greater than after_key, in key order.
+        """
+        cursor = self.connection.cursor()
+        while True:
+            if after_key is None:
+                cursor.execute('''select
+                    key,id,type,url,status,title,controlling_body,intro_date,
+                    final_date,version,contact,sponsors
+                    from swdata order by key limit ?''', (self.chunk_size,))
+            else:
+                cursor.execute('''select
+                    key,id,type,url,status,title,controlling_body,intro_date,
+                    final_date,version,contact,sponsors
+                    from swdata where key > ? order by key limit ?''',
+                    (after_key, self.chunk_size))
+
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for legis_file in self.read_legis_files(rows):
+                yield legis_file
+            after_key = rows[-1][0]
+
+    def read_legis_file(self, key):
+        """
+        The (record, attachments, actions, minutes) of the file with the given
+        key, or None if there is no such file.
+        """
+        cursor = self.connection.cursor()
         cursor.execute('''select
-            id,type,url,status,title,controlling_body,intro_date,final_date,
-            version,contact,sponsors from swdata where key=?''', (key,))
-
-        row = cursor.fetchone()
-        print row
-        lid, ltype, lurl, lstatus, ltitle, lbody, lintro, lfinal, \
+            key,id,type,url,status,title,controlling_body,intro_date,
+            final_date,version,contact,sponsors
+            from swdata where key=?''', (key,))
+
+        rows = cursor.fetchall()
+        return self.read_legis_files(rows)[0] if rows else None
+
+    def read_legis_files(self, rows):
+        """
+        The (record, attachments, actions, minutes) of each of the key-ordered
+        swdata rows.
+        """
+        first_key, last_key = rows[0][0], rows[-1][0]
+        attachments = self.read_attachments(first_key, last_key)
+        actions = self.read_actions(first_key, last_key)
+        minutes = self.read_minutes(first_key, last_key)
+
+        legis_files = []
+        for row in rows:
+            record = self.make_record(row)
+            key = record['key']
+            legis_files.append((record, attachments.get(key, []),
+                                actions.get(key, []), minutes.get(key, [])))
+        return legis_files
+
+    def make_record(self, row):
+        lkey, lid, ltype, lurl, lstatus, ltitle, lbody, lintro, lfinal, \
         lversion, lcontact, lsponsors = row
 
-        record = {
-            'key' : key,
+        return {
+            'key' : int(lkey),
             'id' : lid,
             'url' : lurl,
             'type' : ltype,
             'status' : lstatus,
             'title' : ltitle,
             'controlling_body' : lbody,
-            'intro_date' : self.make_datetime(lintro),
-            'final_date' : self.make_datetime(lfinal),
+            'intro_date' : make_datetime(lintro),
+            'final_date' : make_datetime(lfinal),
             'version' : lversion,
             'contact' : lcontact,
             'sponsors' : lsponsors
         }
 
-        attachments = self.scrape_legis_attachments(key, cursor)
-        actions = self.scrape_legis_actions(key, cursor)
-        minutes = self.collect_minutes(actions, cursor)
+    def read_attachments(self, first_key, last_key):
+        """
+        The attachments of the files with keys in the range, by file key.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute('''select key,description,url
+            from attachments where key between ? and ?
+            order by key''', (first_key, last_key))
 
-        print record, attachments, actions, minutes
-        return record, attachments, actions, minutes
+        attachments = {}
+        for row in cursor:
+            key = int(row[0])
+            attachment = {
+                'key' : key,
+                'description' : row[1],
+                'url' : row[2],
+            }
+            attachments.setdefault(key, []).append(attachment)
 
-    def collect_minutes(self, actions, cursor):
+        return attachments
 
-        action_keys = tuple([action['key'] for action in actions])
-        placeholders = ['?']*len(action_keys)
+    def read_actions(self, first_key, last_key):
+        """
+        The actions on the files with keys in the range, by file key.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute('''select
+            key,date_taken,acting_body,description,motion,minutes_url,notes
+            from actions where key between ? and ?
+            order by key''', (first_key, last_key))
 
-        cursor.execute('''select minutes.url,minutes.fulltext,minutes.date_taken
-            from minutes inner join actions
-            where minutes.url = actions.minutes_url
-              and actions.key in (%s)''' % ','.join(placeholders), action_keys)
+        actions = {}
+        for row in cursor:
+            key = int(row[0])
+            action = {
+                'key' : key,
+                'date_taken' : make_datetime(row[1]),
+                'acting_body' : row[2],
+                'description' : row[3],
+                'motion' : row[4],
+                'minutes_url' : row[5],
+                'notes' : row[6],
+            }
+            actions.setdefault(key, []).append(action)
 
-        minuteses = []
+        return actions
 
+    def read_minutes(self, first_key, last_key):
+        """
+        The minutes that the actions on the files with keys in the range refer
+        to, by file key.  Minutes that several actions on a file refer to are
+        only listed once for the file.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute('''select distinct
+            actions.key,minutes.url,minutes.fulltext,minutes.date_taken
+            from actions inner join minutes on minutes.url = actions.minutes_url
+            where actions.key between ? and ?
+            order by actions.key''', (first_key, last_key))
+
+        minuteses = {}
         for row in cursor:
             minutes = {
-                'url' : row[0],
-                'fulltext' : row[1],
-                'date_taken' : self.make_datetime(row[2][:10]).date(),
+                'url' : row[1],
+                'fulltext' : row[2],
+                'date_taken' : make_datetime(row[3][:10]).date(),
             }
-            minuteses.append(minutes)
+            minuteses.setdefault(int(row[0]), []).append(minutes)
 
         return minuteses
 
-    def make_datetime(self, dt_str):
-        if '-' in dt_str:
-            try:
-                return datetime.datetime.strptime(dt_str, '%Y-%m-%dT%H:%M:%S')
-            except ValueError:
-                return datetime.datetime.strptime(dt_str, '%Y-%m-%d')
-        elif '/' in dt_str:
-            return datetime.datetime.strptime(dt_str, '%m/%d/%Y')
 
-    def scrape_legis_attachments(self, key, cursor):
+class ScraperWikiSourceWrapper (object):
+    """
+    A wrapper around the Scraperwiki sqlite3 database. This is a good source for
+    historical data, but not so much real time as it takes so long to update the
+    files. It is responsible for fetching and reading the data that has been
+    scraped into the ScraperWiki data store.
 
-        cursor.execute('''select description,url
-            from attachments where key=?''', (key,))
+    The database is only downloaded again when the copy on ScraperWiki has been
+    modified since the local copy was.
+    """
 
-        attachments = []
+    __cursor = None
+    """The sqlite3 database cursor"""
 
-        for row in cursor:
-            attachment = {
-                'key' : key,
-                'description' : row[0],
-                'url' : row[1],
-            }
-            attachments.append(attachment)
+    db_file_name = 'swdata.sqlite3'
+    """The local file name of the datastore."""
 
-        return attachments
+    db_url = 'http://scraperwiki.com/scrapers/export_sqlite/philadelphia_legislative_files/'
+    """The URL of the ScraperWiki datastore export"""
 
-    def scrape_legis_actions(self, key, cursor):
+    chunk_size = 500
+    """The number of files to read from the datastore at a time"""
 
-        cursor.execute('''select
-            date_taken,acting_body,description,motion,minutes_url,notes
-            from actions where key=?''', (key,))
+    def urlopen(self, *args, **kwargs):
+        """A facade over urlopen; mainly used for stubbing in tests"""
+        return urllib2.urlopen(*args, **kwargs)
 
-        actions = []
+    def scrape_legis_file(self, key, cursor):
+        """Extract a record from the given document (soup). The key is for the
+           sake of record-keeping.  It is the key passed to the site URL."""
 
-        for action_row in cursor:
-            action = {
-                'key' : key,
-                'date_taken' : self.make_datetime(action_row[0]),
-                'acting_body' : action_row[1],
-                'description' : action_row[2],
-                'motion' : action_row[3],
-                'minutes_url' : action_row[4],
-                'notes' : action_row[5],
-            }
-            actions.append(action)
+        return LegFileReader(cursor.connection).read_legis_file(key)
 
-        return actions
+    def iter_legis_files(self, last_key, force_download=False):
+        """
+        Generate the (record, attachments, actions, minutes) of each file
+        after the last key, in key order, reading them a chunk at a time.
+        """
+        self.__open_db(force_download)
+        reader = LegFileReader(self.__cursor.connection, self.chunk_size)
+        return reader.iter_legis_files(last_key)
 
-    def __download_db(self):
-        print "Downloading the database (~40M -- this may take a while)..."
-        db_file = self.urlopen('http://scraperwiki.com/scrapers/export_sqlite/philadelphia_legislative_files/')
-        db = db_file.read()
-        outfile = open(self.db_file_name, 'w')
-        outfile.write(db)
-        outfile.close()
-
-    def __check_db_exists(self):
-        if os.path.exists(self.db_file_name):
-            print "Local copy of database already exists."
-            return True
-        else:
-            print "No local copy of database exists."
-            return False
+    def make_datetime(self, dt_str):
+        return make_datetime(dt_str)
+
+    def __update_db(self, force_download=False):
+        """
+        Download the database if the copy on ScraperWiki has been modified
+        since the local copy was (or if there is no local copy, or the
+        download is forced).  The
+        download goes to a temporary file first, so an interrupted download
+        doesn't replace the local copy.
+        """
+        request = urllib2.Request(self.db_url)
+        if not force_download and os.path.exists(self.db_file_name):
+            local_mtime = os.path.getmtime(self.db_file_name)
+            request.add_header('If-Modified-Since',
+                               email.utils.formatdate(local_mtime, usegmt=True))
+
+        try:
+            db_file = self.urlopen(request)
+        except urllib2.HTTPError as e:
+            if e.code == 304:
+                log.info('Local copy of database is up to date.')
+                return
+            raise
+
+        log.info('Downloading the database (~40M -- this may take a while)...')
+        db_dir = os.path.dirname(os.path.abspath(self.db_file_name))
+        outfile = tempfile.NamedTemporaryFile(dir=db_dir, delete=False)
+        try:
+            shutil.copyfileobj(db_file, outfile)
+            outfile.close()
+            os.rename(outfile.name, self.db_file_name)
+        except Exception:
+            outfile.close()
+            os.remove(outfile.name)
+            raise
+
+        # Date the local copy as of the remote one, so that the next check
+        # asks whether the remote copy has changed since.
+        last_modified = db_file.info().getheader('Last-Modified')
+        parsed = email.utils.parsedate_tz(last_modified) if last_modified else None
+        if parsed is not None:
+            remote_mtime = email.utils.mktime_tz(parsed)
+            os.utime(self.db_file_name, (remote_mtime, remote_mtime))
+
+    def __open_db(self, force_download=False):
+        if not self.__cursor:
+            self.__update_db(force_download)
+            self.__connect_to_db()
 
     def __connect_to_db(self):
         conn = sqlite3.connect(self.db_file_name)
         self.__cursor = conn.cursor()
 
     def check_for_new_content(self, last_key, force_download=False):
-        """Look through the next 10 keys to see if there are any more files.
-           10 is arbitrary, but I feel like it's large enough to be safe."""
-
-        if not self.__cursor:
-            if force_download or not self.__check_db_exists():
-                self.__download_db()
-            self.__connect_to_db()
+        """Find the key of the next file after the last key, if there is one."""
 
+        self.__open_db(force_download)
         cursor = self.__cursor
 
         cursor.execute('''select key
             from swdata
             where key > ?
-            order by key''', (last_key,))
+            order by key
+            limit 1''', (last_key,))
 
         row = cursor.fetchone()
         if row:
@@ -1,9 +1,13 @@
 import datetime
 import phillyleg
+from django.core.exceptions import ImproperlyConfigured
 from django.db import transaction
 from django.db.utils import IntegrityError
 
+from phillyleg.cities import get_city
 from phillyleg.models import *
+from phillyleg.signals import legfile_scraped, legminutes_scraped
+from utils.querysets import iter_chunked
 
 identity = lambda x: x
 
@@ -17,6 +21,31 @@ def unique(iterable, key=None):
             yield elem
 
 
+class StoredPdfText (dict):
+    """
+    The text of the PDFs already in the database, by URL.  Only the URLs are
+    read up front; each text is read when it's asked for.  Anything set on the
+    mapping is kept in memory, as in a plain dict.
+    """
+    def __init__(self, urls):
+        super(StoredPdfText, self).__init__()
+        self.stored_urls = set(urls)
+
+    def __contains__(self, url):
+        return dict.__contains__(self, url) or url in self.stored_urls
+
+    def __getitem__(self, url):
+        if dict.__contains__(self, url):
+            return dict.__getitem__(self, url)
+
+        if url in self.stored_urls:
+            for model in (LegFileAttachment, LegMinutes):
+                texts = list(model.objects.filter(url=url).values_list('fulltext', flat=True)[:1])
+                if texts:
+                    return texts[0]
+        raise KeyError(url)
+
+
 class CouncilmaticDataStoreWrapper (object):
     """
     This is the interface over an arbitrary database where the information is
@@ -25,30 +54,35 @@ class CouncilmaticDataStoreWrapper (object):
     app, I want local access to the data.  But I love ScraperWiki as a central
     place where you can find data about anything you want, so it's important to
     have the data available on SW as well.
+
+    Each store holds the data of one city (by default, the current one; see
+    phillyleg.cities).  The keys that it takes and gives are the keys of the
+    city's source; in the database, they are shifted by the city's KEY_OFFSET.
     """
     STARTING_KEY = 72
 
+    def __init__(self, city=None):
+        self.city = get_city(city)
+
     def get_latest_key(self):
         '''Check the datastore for the key of the most recent filing.'''
 
-        records = LegFile.objects.order_by('-key')
+        records = LegFile.objects.filter(city=self.city.slug).order_by('-key')
         try:
-            return records[0].key
+            return records[0].key - self.city.key_offset
         except IndexError:
             return self.STARTING_KEY
 
     def get_continuation_key(self):
-        records = LegKeys.objects.all()
+        records = LegKeys.objects.filter(city=self.city.slug).order_by('pk')
         try:
             return records[0].continuation_key
         except IndexError:
             return self.STARTING_KEY
 
     def save_continuation_key(self, key):
-        try:
-            keys = LegKeys.objects.get(pk=1)
-        except LegKeys.DoesNotExist:
-            keys = LegKeys(pk=1)
+        keys = LegKeys.objects.filter(city=self.city.slug).order_by('pk')[:1]
+        keys = keys[0] if keys else LegKeys(city=self.city.slug)
 
         keys.continuation_key = key
         keys.save()
@@ -88,10 +122,19 @@ class CouncilmaticDataStoreWrapper (object):
         topic_names = file_record.pop('topics', [])
 
         # Create the record
+        file_record['key'] = int(file_record['key']) + self.city.key_offset
         try:
             legfile = LegFile.objects.get(key=file_record['key'])
         except LegFile.DoesNotExist:
-            legfile = LegFile(key=file_record['key'])
+            legfile = LegFile(key=file_record['key'], city=self.city.slug)
+
+        # A file of another city with the same key means that the cities'
+        # key ranges overlap; don't take it over.
+        if legfile.city != self.city.slug:
+            raise ImproperlyConfigured(
+                'Key %s of %s is already the key of a file of %s; the cities\' '
+                'KEY_OFFSETs must keep their keys apart' %
+                (file_record['key'], self.city.slug, legfile.city))
 
         legfile.update(file_record, commit=False)
 
@@ -114,9 +157,9 @@ class CouncilmaticDataStoreWrapper (object):
                 continue
 
             try:
-                sponsor = CouncilMember.objects.get(aliases__name=sponsor_name)
+                sponsor = CouncilMember.objects.get(city=self.city.slug, aliases__name=sponsor_name)
             except CouncilMember.DoesNotExist:
-                sponsor = CouncilMember.objects.create(real_name=sponsor_name)
+                sponsor = CouncilMember.objects.create(real_name=sponsor_name, city=self.city.slug)
                 alias = CouncilMemberAlias.objects.create(member=sponsor, name=sponsor_name)
 
             # Add the legislation to the sponsor and save, instead of the other
@@ -144,7 +187,10 @@ class CouncilmaticDataStoreWrapper (object):
 
         # Create minutes
         for minutes_record in minutes_records:
-            self._save_or_ignore(LegMinutes, minutes_record)
+            minutes_record['city'] = self.city.slug
+            minutes = self._save_or_ignore(LegMinutes, minutes_record)
+            if minutes is not None:
+                legminutes_scraped.send(sender=LegMinutes, instance=minutes)
 
         # Create actions attached to the record
         for action_record in action_records:
@@ -161,10 +207,12 @@ class CouncilmaticDataStoreWrapper (object):
             for vote_record in votes:
                 vote_record['action'] = action
                 voter_name = vote_record['voter']
-                voter, created = CouncilMember.objects.get_or_create(name=voter_name)
+                voter, created = CouncilMember.objects.get_or_create(name=voter_name, city=self.city.slug)
                 vote_record['voter'] = voter
                 vote = self._save_or_ignore(LegVote, vote_record)
-                
+
+        legfile_scraped.send(sender=LegFile, instance=legfile)
+
     def is_duplicate_action(self, action_record):
         """
         Check whether the given action_record data already exists in the
@@ -185,17 +233,13 @@ class CouncilmaticDataStoreWrapper (object):
     def pdf_mapping(self):
         """
         Build a mapping of the URLs and PDF test that already exist in the
-        database.
+        database.  The URLs are read a chunk at a time, and the text only
+        when it's needed (see StoredPdfText).
         """
-        mapping = {}
-
-        for attachment in LegFileAttachment.objects.all():
-            mapping[attachment.url] = attachment.fulltext
-
-        for minutes in LegMinutes.objects.all():
-            mapping[minutes.url] = minutes.fulltext
-
-        return mapping
+        urls = set()
+        for model in (LegFileAttachment, LegMinutes):
+            urls.update(iter_chunked(model.objects.all(), 5000, fields=('url',), flat=True))
+        return StoredPdfText(urls)
 
     def __convert_or_delete_date(self, file_record, date_key):
         if file_record[date_key]:
@@ -209,10 +253,10 @@ class CouncilmaticDataStoreWrapper (object):
 
     __legfile_cache = {}
     def __replace_key_with_legfile(self, record):
-        key = record['key']
+        key = int(record['key']) + self.city.key_offset
 
         if key not in self.__legfile_cache:
-            legfile = LegFile.objects.get(key=key)
+            legfile = LegFile.objects.get(key=key, city=self.city.slug)
             self.__legfile_cache[key] = legfile
         else:
             legfile = self.__legfile_cache[key]
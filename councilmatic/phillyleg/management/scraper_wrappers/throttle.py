@@ -0,0 +1,201 @@
+"""
+Request throttling for the scraper sources.
+
+Every request that a scraper makes to a host goes through that host's
+HostThrottle, which is shared by all of the scrapers (and threads) in the
+process:
+
+* A token bucket limits the rate of requests.  The rate adapts: it creeps up
+  while requests succeed quickly, and is cut whenever a request fails or is
+  slow, so scraping runs about as fast as the host allows.
+* A circuit breaker pauses all requests to the host after several failures
+  in a row, for twice as long each time the host keeps failing.
+
+Each throttle counts its requests, failures and latency; log_stats reports
+the rates that were actually achieved.
+"""
+
+import httplib
+import logging
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+log = logging.getLogger(__name__)
+
+
+def is_host_failure(error):
+    """
+    Whether the error means the host is failing or overloaded (as opposed to,
+    e.g., a page not being found).
+    """
+    if isinstance(error, urllib2.HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (urllib2.URLError, httplib.HTTPException, socket.error))
+
+
+class HostThrottle (object):
+    """
+    The rate limit and circuit breaker for one host.  rate is the starting
+    number of requests per second; it stays between min_rate and max_rate.
+    Up to burst requests can be made at once after a lull.  Each quick success
+    adds increase to the rate, and each failure or response slower than
+    slow_latency seconds multiplies it by backoff.  After max_failures failures
+    in a row, requests are paused for pause seconds, doubling up to max_pause
+    while the host keeps failing.
+    """
+
+    clock = staticmethod(time.time)
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, host, rate=2.0, min_rate=0.1, max_rate=10.0, burst=5,
+                 slow_latency=5.0, increase=0.1, backoff=0.5,
+                 max_failures=5, pause=60, max_pause=1800):
+        self.host = host
+        self.rate = min(max_rate, max(min_rate, rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.slow_latency = slow_latency
+        self.increase = increase
+        self.backoff = backoff
+        self.max_failures = max_failures
+        self.pause = self.pause_length = pause
+        self.max_pause = max_pause
+
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.updated = self.clock()
+        self.open_until = 0
+        self.consecutive_failures = 0
+
+        self.requests = 0
+        self.failures = 0
+        self.pauses = 0
+        self.total_latency = 0.0
+        self.first_request = self.last_request = None
+
+    def reserve(self):
+        """
+        Take a token from the bucket, and return how many seconds to wait
+        before making the request.  Tokens can be owed, so callers that
+        reserve at the same time wait their turns.
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            ready = now if self.tokens >= 0 else now - self.tokens / self.rate
+            return max(ready, self.open_until) - now
+
+    def acquire(self):
+        """
+        Wait until a request to the host may be made.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+    def record(self, latency, failed=False):
+        """
+        Count a request that took latency seconds, and adapt the rate (and
+        the circuit) to how it went.
+        """
+        with self.lock:
+            now = self.clock()
+            self.requests += 1
+            self.total_latency += latency
+            # When the first and the latest requests started
+            if self.first_request is None:
+                self.first_request = now - latency
+            self.last_request = now - latency
+
+            if not failed:
+                self.consecutive_failures = 0
+                self.pause_length = self.pause
+                if latency > self.slow_latency:
+                    self.rate = max(self.min_rate, self.rate * self.backoff)
+                else:
+                    self.rate = min(self.max_rate, self.rate + self.increase)
+                return
+
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+
+            # Once the circuit is open, the first request after the pause is
+            # a trial: if it fails too, the circuit opens again for longer.
+            # The bucket is left with only the trial's token at the end of
+            # the pause, so the requests that wait out the pause follow the
+            # trial at the rate, rather than all at once.
+            if self.consecutive_failures >= self.max_failures:
+                self.open_until = now + self.pause_length
+                self.tokens = 1
+                self.updated = self.open_until
+                self.pauses += 1
+                log.warning('Pausing requests to %s for %ds after %d failures in a row'
+                            % (self.host, self.pause_length, self.consecutive_failures))
+                self.pause_length = min(self.max_pause, self.pause_length * 2)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func (which makes a request to the host) when the throttle lets
+        it, and record how it went.  Exceptions are re-raised; those that mean
+        the host is failing count as failures.
+        """
+        self.acquire()
+        started = self.clock()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(self.clock() - started, failed=is_host_failure(e))
+            raise
+        self.record(self.clock() - started)
+        return result
+
+    def stats(self):
+        with self.lock:
+            # The rate of the requests between the first one's start and
+            # the latest one's
+            elapsed = (self.last_request - self.first_request) if self.requests else 0
+            return {
+                'host': self.host,
+                'requests': self.requests,
+                'failures': self.failures,
+                'pauses': self.pauses,
+                'achieved_rate': (self.requests - 1) / elapsed if elapsed else 0.0,
+                'allowed_rate': self.rate,
+                'mean_latency': self.total_latency / self.requests if self.requests else 0.0,
+            }
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(url, **options):
+    """
+    The shared throttle for the host of the URL (or the host name).  The
+    options (see HostThrottle) apply when the host's throttle is first made.
+    """
+    host = (urlparse.urlparse(url).netloc or url).lower()
+    with _throttles_lock:
+        if host not in _throttles:
+            _throttles[host] = HostThrottle(host, **options)
+        return _throttles[host]
+
+
+def log_stats():
+    """
+    Log the requests made to each host, and the rate achieved.
+    """
+    for host in sorted(_throttles):
+        stats = _throttles[host].stats()
+        if stats['requests']:
+            log.info('%(host)s: %(requests)d requests at %(achieved_rate).2f/s '
+                     '(now allowed %(allowed_rate).2f/s), %(failures)d failed, '
+                     '%(mean_latency).2fs mean latency, paused %(pauses)d times' % stats)
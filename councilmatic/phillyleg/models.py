@@ -4,14 +4,16 @@ import re
 import utils
 import logging
 from django.conf import settings
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.contrib.gis.db import models
 from django.contrib.gis import geos
 #from django.db import models
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext as _
+from phillyleg.cities import default_city, get_city
 from phillyleg.management.scraper_wrappers import PhillyLegistarSiteWrapper
+from phillyleg.topics import classify_titles
 from utils.models import TimestampedModelMixin
 
 log = logging.getLogger(__name__)
@@ -22,6 +24,59 @@ log = logging.getLogger(__name__)
 
 class LegKeys(models.Model):
     continuation_key = models.IntegerField()
+    city = models.CharField(max_length=64, db_index=True, default=default_city)
+
+
+class IndexQueueManager (models.Manager):
+    def enqueue(self, obj):
+        """
+        Queue the object to be (re)indexed.  If it is already queued, just
+        note that it has changed again, so that all of its changes get
+        indexed together.
+        """
+        model_name = obj._meta.object_name.lower()
+        now = datetime.datetime.now()
+
+        entries = self.filter(model_name=model_name, object_key=obj.pk)
+        if entries.update(queued_datetime=now):
+            return
+
+        try:
+            sid = transaction.savepoint()
+            self.create(model_name=model_name, object_key=obj.pk,
+                        queued_datetime=now)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # Someone else queued the object in the meantime.
+            transaction.savepoint_rollback(sid)
+            entries.update(queued_datetime=now)
+
+    def ready(self, window):
+        """
+        The entries for objects that haven't changed in the last ``window``
+        (a ``timedelta``), oldest first.
+        """
+        cutoff = datetime.datetime.now() - window
+        return self.filter(queued_datetime__lte=cutoff)\
+            .order_by('queued_datetime')
+
+
+class IndexQueueEntry (models.Model):
+    """A legislative file or set of minutes that has changed since it was
+       last indexed for search"""
+
+    model_name = models.CharField(max_length=64)
+    object_key = models.IntegerField()
+    queued_datetime = models.DateTimeField(db_index=True)
+    """The last time the object changed"""
+
+    objects = IndexQueueManager()
+
+    class Meta:
+        unique_together = (('model_name', 'object_key'),)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.model_name, self.object_key)
 
 
 #
@@ -44,6 +99,7 @@ class CouncilMember(TimestampedModelMixin, models.Model):
         default='phillyleg/noun_project_416.png',
         help_text=_('Path to the image of the councilmember, relative to the static folder'))
     districts = models.ManyToManyField('CouncilDistrict', through='CouncilMemberTenure', related_name='representatives')
+    city = models.CharField(max_length=64, db_index=True, default=default_city)
 
     NOT_YET_SET = object()
     __tenure = NOT_YET_SET
@@ -98,6 +154,7 @@ class CouncilMemberTenure(TimestampedModelMixin, models.Model):
 
 class CouncilDistrictPlan(TimestampedModelMixin, models.Model):
     date = models.DateField()
+    city = models.CharField(max_length=64, db_index=True, default=default_city)
 
 
 class CouncilDistrict(TimestampedModelMixin, models.Model):
@@ -117,6 +174,20 @@ class CouncilDistrict(TimestampedModelMixin, models.Model):
         if tenures:
             return tenures[-1].councilmember
 
+    def local_legislation(self):
+        """
+        Gets the legislation that mentions a (valid) location in the district,
+        newest first.  This is a join through the locations' district
+        assignments, so it only finds locations that the assigndistricts
+        command has placed.
+
+        """
+        return LegFile.objects \
+            .filter(metadata__locations__districts=self,
+                    metadata__locations__valid=True) \
+            .distinct() \
+            .order_by('-intro_date', '-key')
+
     def __unicode__(self):
         return u'District {d}'.format(d=self.id)
 
@@ -138,9 +209,17 @@ class LegFile(TimestampedModelMixin, models.Model):
     version = models.CharField(max_length=100)
     is_routine = models.BooleanField(default=True, blank=True)
 
+    # The slug of the city whose legislation this is (see phillyleg.cities).
+    # Keys stay unique across cities through each city's KEY_OFFSET.
+    city = models.CharField(max_length=64, db_index=True, default=default_city)
+
     class Meta:
         ordering = ['-key']
 
+        # For paging through legislation by date (see
+        # councilmatic.pagination).
+        index_together = [['intro_date', 'key']]
+
     def __unicode__(self):
         return "%s %s: %s%s" % (self.type, self.id, self.title[:100],
             '...' if len(self.title) > 100 else '')
@@ -210,7 +289,7 @@ class LegFile(TimestampedModelMixin, models.Model):
         return addresses
 
     def topics(self):
-        return settings.TOPIC_CLASSIFIER(self.title)
+        return classify_titles([self.title])[0]
 
     def get_status_label(self):
         if self.status in ['Adopted', 'Approved', 'Direct Introduction', 'Passed'] :
@@ -220,31 +299,39 @@ class LegFile(TimestampedModelMixin, models.Model):
         else :
            return 'label-inverse'
 
-    def mentioned_legfiles(self):
+    def mentioned_legfile_ids(self):
         """
-        Gets a generator for any files (specifically, bills) mentioned in the
-        file.
+        Gets the set of ids of the files (specifically, bills) mentioned in the
+        file's title.
 
         """
         # Find all the strings that match the characteristic regular expression
-        # for a bill id.
+        # for a bill id.  The id matches may each have two groups (the second
+        # of which will contain only the A's).  We only care about the first.
         id_matches = re.findall(r'\s(\d{6}(-A+)?)', self.title)
+        return set(groups[0] for groups in id_matches)
+
+    def mentioned_legfiles(self):
+        """
+        Gets a list of any files (specifically, bills) of the file's city
+        mentioned in the file, loaded in one query.
+
+        """
+        mentioned_legfile_ids = self.mentioned_legfile_ids()
+        if not mentioned_legfile_ids:
+            return []
 
-        # The id matches may each have two groups (the second of which will
-        # contain only the A's).  We only care about the first.
-        mentioned_legfile_ids = set(groups[0] for groups in id_matches)
+        mentioned_legfiles = list(LegFile.objects.filter(city=self.city,
+                                                         id__in=mentioned_legfile_ids))
 
-        for mentioned_legfile_id in mentioned_legfile_ids:
-            # It's possible that no legfile in our database may match the id
-            # we've parsed out.  When this is the case, there's nothing we can
-            # do about it, so just fail "silently" (with a log message).
-            try:
-                mentioned_legfile = LegFile.objects.get(id=mentioned_legfile_id)
-                yield mentioned_legfile
-            except LegFile.DoesNotExist:
-                # TODO: Use a log message.
-                print 'LegFile %r, referenced from key %s, does not exist!!!' % (mentioned_legfile_id, self.pk)
+        # It's possible that no legfile in our database may match an id we've
+        # parsed out.  When this is the case, there's nothing we can do about
+        # it, so just fail "silently" (with a log message).
+        missing_ids = mentioned_legfile_ids - set(legfile.id for legfile in mentioned_legfiles)
+        for missing_id in sorted(missing_ids):
+            log.info('LegFile %r, referenced from key %s, does not exist' % (missing_id, self.pk))
 
+        return mentioned_legfiles
 
     def update(self, attribs, commit=True, **save_kwargs):
         for attr, val in attribs.items():
@@ -293,8 +380,9 @@ class LegFile(TimestampedModelMixin, models.Model):
             if update_mentions:
                 # Add the mentioned files to the metadata
                 metadata.mentioned_legfiles.clear()
-                for mentioned_legfile in self.mentioned_legfiles():
-                    metadata.mentioned_legfiles.add(mentioned_legfile)
+                mentioned_legfiles = self.mentioned_legfiles()
+                if mentioned_legfiles:
+                    metadata.mentioned_legfiles.add(*mentioned_legfiles)
 
             if update_topics:
                 # Add topics to the metadata
@@ -375,6 +463,7 @@ class LegMinutes(TimestampedModelMixin, models.Model):
     url = models.URLField(unique=True)
     fulltext = models.TextField()
     date_taken = models.DateField(null=True)
+    city = models.CharField(max_length=64, db_index=True, default=default_city)
 
     def __unicode__(self):
         return "(%s) %s%s" % (self.date_taken, self.fulltext[:100],
@@ -453,6 +542,24 @@ class LegFileMetaData (TimestampedModelMixin, models.Model):
             (self.legfile.pk, len(self.mentioned_legfiles.all()), len(self.legfile.references_in_legislation.all())))
 
 
+class RelatedLegFile (TimestampedModelMixin, models.Model):
+    """
+    One of the files most similar to a file, by the terms in their titles and
+    attachments, their sponsors, and the files they mention (see
+    phillyleg.related).
+    """
+    legfile = models.ForeignKey('LegFile', related_name='related')
+    related_legfile = models.ForeignKey('LegFile', related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['legfile', '-score']
+        unique_together = [('legfile', 'related_legfile')]
+
+    def __unicode__(self):
+        return u'%s ~ %s (%.3f)' % (self.legfile_id, self.related_legfile_id, self.score)
+
+
 class LegMinutesMetaData (TimestampedModelMixin, models.Model):
     legminutes = models.OneToOneField('LegMinutes', related_name='metadata')
     words = models.ManyToManyField('MetaData_Word', related_name='references_in_minutes')
@@ -475,6 +582,10 @@ class MetaData_Location (TimestampedModelMixin, models.Model):
     geom = models.PointField(null=True)
     valid = models.BooleanField(default=True, blank=True)
 
+    # The districts (of every district plan) that the location is in.  These
+    # are filled in by the assigndistricts command.
+    districts = models.ManyToManyField('CouncilDistrict', related_name='locations', blank=True)
+
     objects = models.GeoManager()
 
     def __unicode__(self):
@@ -490,9 +601,11 @@ class MetaData_Location (TimestampedModelMixin, models.Model):
         pass
 
     def geocode(self):
-        gc = utils.geocode(self.matched_text, settings.LEGISLATION['ADDRESS_BOUNDS'])
+        # Addresses are geocoded within the city being scraped.
+        config = get_city().config
+        gc = utils.geocode(self.matched_text, config['ADDRESS_BOUNDS'])
 
-        if gc and gc['status'] == 'OK' and settings.LEGISLATION['ADDRESS_SUFFIX'] in gc['results'][0]['formatted_address']:
+        if gc and gc['status'] == 'OK' and config['ADDRESS_SUFFIX'] in gc['results'][0]['formatted_address']:
             self.address = gc['results'][0]['formatted_address']
             x = float(gc['results'][0]['geometry']['location']['lng'])
             y = float(gc['results'][0]['geometry']['location']['lat'])
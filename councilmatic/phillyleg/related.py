@@ -0,0 +1,280 @@
+"""
+Related legislation.
+
+Each legislative file is related to the files of its city that are most like
+it: those that share its less common terms (weighted by TF-IDF over its title and
+attachments), its sponsors, or a mention in either file's title.  The most
+related files for each file are saved as RelatedLegFile rows, so a file's page
+reads them with a single query.
+
+The term vectors are sparse (a dict of term weights for each file), and files
+are only compared with the files that share at least one term with them,
+through an inverted index of the terms.
+"""
+
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, Max, Min
+import heapq
+import math
+import re
+
+from phillyleg.models import LegFile, LegFileAttachment, RelatedLegFile
+from utils.querysets import iter_chunks
+
+
+TOP_RELATED = 10
+"""The number of related files saved for each file"""
+
+TITLE_WEIGHT = 2
+"""How many times each word in a title counts, relative to an attachment"""
+
+MAX_DOCUMENT_FREQUENCY = 0.2
+"""Terms in more than this fraction of the files are too common to relate
+   files by"""
+
+SPONSOR_WEIGHT = 0.1
+"""What sharing all of their sponsors adds to two files' score"""
+
+MENTION_WEIGHT = 0.25
+"""What one file mentioning the other adds to two files' score"""
+
+MIN_SCORE = 0.05
+
+WORD_RE = re.compile(r"[a-z][a-z'-]*[a-z]")
+
+
+def tokenize(text):
+    """
+    The lowercased words in the text, of at least three letters.
+    """
+    return [word for word in WORD_RE.findall(text.lower()) if len(word) > 2]
+
+
+def term_counts(title, attachment_texts=()):
+    counts = defaultdict(int)
+    for word in tokenize(title):
+        counts[word] += TITLE_WEIGHT
+    for text in attachment_texts:
+        for word in tokenize(text):
+            counts[word] += 1
+    return counts
+
+
+def tfidf_vectors(counts_by_key, max_df=MAX_DOCUMENT_FREQUENCY):
+    """
+    The unit-length TF-IDF vectors, as dicts of term weights, for a dict of
+    term counts by key.  Term frequencies are dampened logarithmically.
+    Terms that are in only one file, or in more than max_df of them, are left
+    out, since they can't usefully relate files.
+    """
+    document_frequency = defaultdict(int)
+    for counts in counts_by_key.itervalues():
+        for term in counts:
+            document_frequency[term] += 1
+
+    total = len(counts_by_key)
+    max_count = max(2, max_df * total)
+    idf = dict((term, math.log(float(total) / count))
+               for term, count in document_frequency.iteritems()
+               if 1 < count <= max_count)
+
+    vectors = {}
+    for key, counts in counts_by_key.iteritems():
+        vector = dict((term, (1 + math.log(count)) * idf[term])
+                      for term, count in counts.iteritems() if term in idf)
+        norm = math.sqrt(sum(weight * weight for weight in vector.itervalues()))
+        vectors[key] = dict((term, weight / norm) for term, weight in vector.iteritems()) \
+                       if norm else {}
+    return vectors
+
+
+def invert(vectors):
+    """
+    An inverted index of the vectors: a dict from each term to a list of
+    (key, weight) pairs.
+    """
+    postings = defaultdict(list)
+    for key, vector in vectors.iteritems():
+        for term, weight in vector.iteritems():
+            postings[term].append((key, weight))
+    return postings
+
+
+def cosine_similarities(vector, postings):
+    """
+    The cosine similarity of the (unit-length) vector to each vector in the
+    inverted index that shares a term with it, as a dict by key.
+    """
+    scores = defaultdict(float)
+    for term, weight in vector.iteritems():
+        for key, other_weight in postings[term]:
+            scores[key] += weight * other_weight
+    return scores
+
+
+class RelatedIndex (object):
+    """
+    Everything that files are related by -- their term vectors, sponsors and
+    mentions -- loaded for all of a city's files at once.
+    """
+    def __init__(self, vectors, sponsors, mentions):
+        self.vectors = vectors
+        self.postings = invert(vectors)
+        self.sponsors = sponsors
+        self.mentions = mentions
+
+    @classmethod
+    def load(cls, city, chunk_size=1000):
+        """
+        Read the titles, attachments, sponsors and mentions of every file of
+        the city.  Titles and attachment text are read a chunk of files at a
+        time and kept only as term counts.  The mention graph is built from
+        the titles and one map of each of the city's file ids to its key (ids
+        are only unique within a city).
+        """
+        counts = {}
+        mentioned_ids = {}
+        keys_by_id = {}
+        for legfiles in iter_chunks(LegFile.objects.filter(city=city), chunk_size,
+                                    only=('key', 'id', 'title')):
+            attachment_texts = defaultdict(list)
+            attachments = LegFileAttachment.objects \
+                .filter(file__in=[legfile.pk for legfile in legfiles]) \
+                .values_list('file', 'fulltext')
+            for key, fulltext in attachments.iterator():
+                attachment_texts[key].append(fulltext)
+
+            for legfile in legfiles:
+                counts[legfile.pk] = term_counts(legfile.title, attachment_texts[legfile.pk])
+                mentioned_ids[legfile.pk] = legfile.mentioned_legfile_ids()
+                keys_by_id[legfile.id] = legfile.pk
+
+        mentions = defaultdict(set)
+        for key, ids in mentioned_ids.iteritems():
+            for mentioned_key in (keys_by_id[id] for id in ids if id in keys_by_id):
+                if mentioned_key != key:
+                    mentions[key].add(mentioned_key)
+                    mentions[mentioned_key].add(key)
+
+        sponsors = defaultdict(set)
+        for key, sponsor_id in LegFile.sponsors.through.objects \
+                .filter(legfile__city=city) \
+                .values_list('legfile', 'councilmember').iterator():
+            sponsors[key].add(sponsor_id)
+
+        return cls(tfidf_vectors(counts), sponsors, mentions)
+
+    def scores(self, key):
+        """
+        The relatedness of the file to each file that has anything in common
+        with it, as a dict by key.
+        """
+        scores = cosine_similarities(self.vectors.get(key, {}), self.postings)
+        for other in self.mentions.get(key, ()):
+            scores[other] += MENTION_WEIGHT
+        scores.pop(key, None)
+
+        # Most sponsors sponsor a great many files, so shared sponsors only
+        # add to the score of files that already have something in common.
+        sponsors = self.sponsors.get(key)
+        if sponsors:
+            for other in scores:
+                other_sponsors = self.sponsors.get(other)
+                if other_sponsors and sponsors & other_sponsors:
+                    scores[other] += SPONSOR_WEIGHT * \
+                        len(sponsors & other_sponsors) / len(sponsors | other_sponsors)
+
+        return scores
+
+    def most_related(self, key, count=TOP_RELATED):
+        """
+        A list of the (key, score) of the count files most related to the
+        file, most related first.
+        """
+        scores = self.scores(key)
+        return heapq.nlargest(count, ((other, score) for other, score in scores.iteritems()
+                                      if score >= MIN_SCORE),
+                              key=lambda item: (item[1], -item[0]))
+
+
+def changed_legfile_keys(city):
+    """
+    The keys of the city's files that have changed since its related files
+    were last saved, or None if none have been saved yet.
+    """
+    last_saved = RelatedLegFile.objects.filter(legfile__city=city)\
+        .aggregate(last=Max('created_datetime'))['last']
+    if last_saved is None:
+        return None
+    return set(LegFile.objects.filter(city=city, updated_datetime__gt=last_saved)
+               .values_list('pk', flat=True))
+
+
+def affected_legfile_keys(index, changed_keys, count=TOP_RELATED, chunk_size=1000):
+    """
+    The keys of the files whose saved related files a change to the changed
+    files could alter: those that the changed files are now more related to
+    than the least related of their saved ones (or that have fewer than count
+    saved), and those that have a changed file among their saved ones (which
+    it may no longer belong in).  Other files' scores drift a little as new
+    terms change how common each term is; a rebuild brings those up to date.
+    """
+    saved = dict((row['legfile'], (row['related_count'], row['min_score']))
+                 for row in RelatedLegFile.objects.values('legfile')
+                     .annotate(related_count=Count('pk'), min_score=Min('score')))
+
+    affected = set()
+    for key in changed_keys:
+        for other, score in index.scores(key).iteritems():
+            related_count, min_score = saved.get(other, (0, None))
+            if score >= MIN_SCORE and (related_count < count or score > min_score):
+                affected.add(other)
+
+    changed_keys = sorted(changed_keys)
+    for start in range(0, len(changed_keys), chunk_size):
+        affected.update(RelatedLegFile.objects
+            .filter(related_legfile__in=changed_keys[start:start + chunk_size])
+            .values_list('legfile', flat=True))
+    return affected
+
+
+def save_related(index, keys, count=TOP_RELATED, chunk_size=1000):
+    """
+    Replace the saved related files of the files with the given keys, a chunk
+    of files at a time.
+    """
+    keys = sorted(keys)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        rows = [RelatedLegFile(legfile_id=key, related_legfile_id=other, score=round(score, 4))
+                for key in chunk
+                for other, score in index.most_related(key, count)]
+
+        with transaction.commit_on_success():
+            RelatedLegFile.objects.filter(legfile__in=chunk).delete()
+            RelatedLegFile.objects.bulk_create(rows)
+
+
+def update_related(city, rebuild=False, count=TOP_RELATED, chunk_size=1000):
+    """
+    Save the related files of the city's files that have changed since the
+    last update, and of the files that they're now among the most related to
+    (or of every file of the city, to rebuild or if none have been saved
+    yet).  Returns the number of files updated.
+    """
+    changed_keys = None if rebuild else changed_legfile_keys(city)
+    if changed_keys is not None and not changed_keys:
+        return 0
+
+    index = RelatedIndex.load(city, chunk_size)
+    if changed_keys is None:
+        keys = set(index.vectors)
+    else:
+        # Only the city's files (every one of which is in the index) are
+        # updated, even if files of another city were once saved as related.
+        keys = changed_keys | affected_legfile_keys(index, changed_keys, count, chunk_size)
+        keys &= set(index.vectors)
+
+    save_related(index, keys, count, chunk_size)
+    return len(keys)
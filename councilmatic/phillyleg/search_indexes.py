@@ -1,59 +1,214 @@
 import datetime
+import time
 from itertools import chain
+from django.core.cache import cache
 from haystack import indexes
-from phillyleg.models import LegFile, LegMinutes, LegFileMetaData
+from haystack.query import SearchQuerySet
+from phillyleg.cities import (cities_for_connection, current_city, get_cities,
+                              get_current_city)
+from phillyleg.models import LegFile, LegMinutes, LegFileMetaData, MetaData_Topic
+
+
+INDEX_VERSION_CACHE_KEY = 'search_index_version'
+
+
+def get_index_version():
+    """
+    A value that changes whenever the search index is updated.  Include it in
+    the keys of cached search data so that the cache is invalidated by index
+    updates.
+    """
+    return cache.get(INDEX_VERSION_CACHE_KEY, 0)
+
+
+def bump_index_version(using=None):
+    """
+    Change the index version of each city whose documents are in the haystack
+    connection (or of every city).  The versions are cached per city (see
+    phillyleg.cities.make_cache_key).
+    """
+    for slug in (using and cities_for_connection(using)) or get_cities():
+        with current_city(slug):
+            cache.set(INDEX_VERSION_CACHE_KEY, time.time(), 60 * 60 * 24 * 30)
+
+
+def city_search_queryset(sqs=None):
+    """
+    Narrow the search (by default, of everything) to the current city's
+    documents.  When the deployment hosts a single city, every document is
+    that city's, and the search is left as it is; documents indexed before
+    the city field was added are found then too.
+    """
+    if sqs is None:
+        sqs = SearchQuerySet()
+    if len(get_cities()) > 1:
+        sqs = sqs.filter(city_exact=get_current_city())
+    return sqs
+
+
+def filter_by_connection(queryset, using):
+    """
+    Limit the queryset to the objects of the cities whose documents are in
+    the haystack connection.
+    """
+    slugs = cities_for_connection(using)
+    if slugs is not None:
+        queryset = queryset.filter(city__in=slugs)
+    return queryset
 
 
 class LegislationIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True)
 
     file_id = indexes.CharField(model_attr='id')
-    topics = indexes.MultiValueField()
-    status = indexes.CharField(model_attr='status')
-    controlling_body = indexes.CharField(model_attr='controlling_body')
-    file_type = indexes.CharField(model_attr='type')
+    topics = indexes.MultiValueField(faceted=True)
+    status = indexes.CharField(model_attr='status', faceted=True)
+    controlling_body = indexes.CharField(model_attr='controlling_body', faceted=True)
+    file_type = indexes.CharField(model_attr='type', faceted=True)
     key = indexes.IntegerField(model_attr='key')
-    sponsors = indexes.MultiValueField()
+    city = indexes.CharField(model_attr='city', faceted=True)
+    sponsors = indexes.MultiValueField(faceted=True)
 
     order_date = indexes.DateField(model_attr='intro_date')
 
+    # Stored only, so that results can be listed without loading the
+    # legislation from the database (see StoredLegFile).
+    title = indexes.CharField(model_attr='title', indexed=False)
+    intro_date = indexes.DateField(model_attr='intro_date', indexed=False)
+    final_date = indexes.DateField(model_attr='final_date', null=True, indexed=False)
+    location_count = indexes.IntegerField(indexed=False)
+
     def get_model(self):
         return LegFile
 
     def prepare_sponsors(self, leg):
+        sponsors = leg.sponsors.all()
         return (
-            [sponsor.real_name for sponsor in leg.sponsors.all()] +
-            [alias.name for alias in chain(*(sponsor.aliases.all() for sponsor in leg.sponsors.all()))]
+            [sponsor.real_name for sponsor in sponsors] +
+            [alias.name for alias in chain(*(sponsor.aliases.all() for sponsor in sponsors))]
         )
 
     def prepare_topics(self, leg):
         try:
             return [topic.topic for topic in leg.metadata.topics.all()]
         except LegFileMetaData.DoesNotExist:
-            # The only time this should happen is when the legfile is first
-            # saved. A signal gets sent that updates the index for the object
-            # before the legfile's metadata has a chance to be created. We're
-            # just going to have to accept it in this case.
+            # This can happen if the legfile is indexed as it is first saved,
+            # before its metadata has a chance to be created.  With the
+            # QueuedSignalProcessor, legfiles wait in the queue until their
+            # metadata exists instead.
             pass
 
+    def prepare_location_count(self, leg):
+        try:
+            return len(leg.metadata.locations.all())
+        except LegFileMetaData.DoesNotExist:
+            return 0
+
     def index_queryset(self, using=None):
-        return self.get_model().objects.all()\
+        queryset = self.get_model().objects.all()\
             .exclude(title='')\
             .exclude(title=' ')\
             .exclude(title=None)
+        return filter_by_connection(queryset, using)
+
+    def prefetched_queryset(self, using=None):
+        """
+        The objects to index, along with everything that preparing their
+        documents touches, so that bulk indexing doesn't query per object.
+        """
+        return self.index_queryset(using)\
+            .select_related('metadata')\
+            .prefetch_related('sponsors__aliases', 'metadata__topics',
+                              'metadata__locations', 'attachments')
 
     def get_updated_field(self):
         return 'updated_datetime'
 
 
+class StoredLegFile (object):
+    """
+    A stand-in for a legislative file, built from the fields stored in its
+    search result.  It has enough of the ``LegFile`` interface to be listed in
+    search results and feeds, without touching the database.
+    """
+    _meta = LegFile._meta
+
+    fields = ('key', 'file_id', 'title', 'file_type', 'status',
+              'controlling_body', 'intro_date', 'final_date',
+              'location_count', 'topics')
+    """The stored fields that it's built from"""
+
+    def __init__(self, result):
+        self.pk = self.key = int(result.key)
+        self.id = result.file_id
+        self.title = result.title
+        self.type = result.file_type
+        self.status = result.status
+        self.controlling_body = result.controlling_body
+        self.intro_date = result.intro_date
+        self.final_date = result.final_date
+        self.location_count = result.location_count or 0
+        self.metadata = StoredMetaData(result.topics or [])
+
+    @classmethod
+    def can_load(cls, result):
+        """
+        Whether the result has the stored fields we need.  Documents indexed
+        before the fields were added don't.
+        """
+        return result.model is LegFile and result.title is not None
+
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        Build one from a dict of the stored fields of a result (e.g., as
+        cached by search_cache.CachedSearch).
+        """
+        result = StoredFields()
+        result.__dict__.update(fields)
+        return cls(result)
+
+    __unicode__ = vars(LegFile)['__unicode__']
+    get_absolute_url = vars(LegFile)['get_absolute_url']
+    get_status_label = vars(LegFile)['get_status_label']
+
+
+class StoredFields (object):
+    pass
+
+
+class StoredMetaData (object):
+    def __init__(self, topic_names):
+        self.topics = StoredRelation(
+            [MetaData_Topic(topic=topic) for topic in topic_names])
+
+
+class StoredRelation (object):
+    def __init__(self, objs):
+        self.objs = objs
+
+    def all(self):
+        return self.objs
+
+    def count(self):
+        return len(self.objs)
+
+
 class MinutesIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, model_attr='fulltext')
     date_taken = indexes.DateField(null=True)
+    city = indexes.CharField(model_attr='city', faceted=True)
 
     order_date = indexes.DateField(model_attr='date_taken')
 
     def get_model(self):
         return LegMinutes
 
+    def index_queryset(self, using=None):
+        return filter_by_connection(self.get_model().objects.all(), using)
+
+    def prefetched_queryset(self, using=None):
+        return self.index_queryset(using).select_related('metadata')
+
     def get_updated_field(self):
         return 'updated_datetime'
@@ -0,0 +1,50 @@
+from django.db.models import signals
+from django.dispatch import Signal
+from haystack.signals import BaseSignalProcessor
+
+legfile_scraped = Signal(providing_args=['instance'])
+"""Sent once a scraped legfile has been stored along with its sponsors,
+   topics, attachments and actions."""
+
+legminutes_scraped = Signal(providing_args=['instance'])
+"""Sent once a newly scraped set of minutes has been stored."""
+
+content_indexed = Signal(providing_args=['instances'])
+"""Sent by the processindexqueue command with the legfiles and minutes that
+   it has just indexed."""
+
+
+class QueuedSignalProcessor (BaseSignalProcessor):
+    """
+    A haystack signal processor that, instead of updating the search index as
+    each object is saved, queues the object to be indexed later by the
+    processindexqueue command.  Saving doesn't wait on the search backend, and
+    an object that is saved several times while being scraped is only indexed
+    once, after its metadata is complete.
+
+    Use it by setting HAYSTACK_SIGNAL_PROCESSOR to
+    'phillyleg.signals.QueuedSignalProcessor'.
+    """
+
+    def setup(self):
+        # The models can't be imported while haystack is being loaded, so
+        # listen to every model and filter on the sender.
+        signals.post_save.connect(self.handle_save)
+        signals.post_delete.connect(self.handle_delete)
+        legfile_scraped.connect(self.handle_save)
+        legminutes_scraped.connect(self.handle_save)
+
+    def teardown(self):
+        signals.post_save.disconnect(self.handle_save)
+        signals.post_delete.disconnect(self.handle_delete)
+        legfile_scraped.disconnect(self.handle_save)
+        legminutes_scraped.disconnect(self.handle_save)
+
+    def handle_save(self, sender, instance, **kwargs):
+        from phillyleg.models import LegFile, LegMinutes, IndexQueueEntry
+        if isinstance(instance, (LegFile, LegMinutes)) and not kwargs.get('raw'):
+            IndexQueueEntry.objects.enqueue(instance)
+
+    # Deleted objects are queued too; the queue removes objects that no longer
+    # exist from the index.
+    handle_delete = handle_save
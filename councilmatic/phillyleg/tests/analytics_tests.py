@@ -0,0 +1,124 @@
+from nose.tools import *
+from django.test.utils import override_settings
+
+import numpy
+
+from phillyleg.analytics import *
+
+
+class Test__vote_code:
+
+    @istest
+    def reads_yes_no_and_absent_votes (self):
+        assert_equal(vote_code('Ayes'), YES)
+        assert_equal(vote_code(' nay '), NO)
+        assert_equal(vote_code('Excused'), ABSENT)
+
+    @istest
+    def counts_anything_else_as_an_abstention (self):
+        assert_equal(vote_code('Present'), ABSTAIN)
+
+
+class Test__VoteMatrix_addVotes:
+
+    @istest
+    def adds_rows_and_columns_in_key_order (self):
+        matrix = VoteMatrix()
+        matrix.add_votes([1, 2, 3], [20, 10, 10], [5, 5, 7], [YES, NO, YES])
+
+        assert_equal(matrix.member_ids.tolist(), [5, 7])
+        assert_equal(matrix.action_ids.tolist(), [10, 20])
+        assert_equal(matrix.votes.tolist(), [[NO, YES], [YES, NOT_VOTING]])
+        assert_equal(matrix.last_vote_id, 3)
+
+    @istest
+    def keeps_existing_votes_when_growing (self):
+        matrix = VoteMatrix()
+        matrix.add_votes([1, 2], [20, 20], [5, 7], [YES, NO])
+        matrix.add_votes([3, 4], [10, 20], [6, 6], [ABSENT, YES])
+
+        assert_equal(matrix.member_ids.tolist(), [5, 6, 7])
+        assert_equal(matrix.action_ids.tolist(), [10, 20])
+        assert_equal(matrix.votes.tolist(), [[NOT_VOTING, YES], [ABSENT, YES], [NOT_VOTING, NO]])
+        assert_equal(matrix.last_vote_id, 4)
+
+
+class Test__agreement_scores:
+
+    @istest
+    def scores_only_votes_both_members_cast (self):
+        votes = numpy.array([[YES, YES, NO, ABSENT],
+                             [YES, NO, NO, YES]])
+        scores, shared = agreement_scores(votes == YES, votes == NO)
+
+        assert_equal(shared.tolist(), [[3, 3], [3, 4]])
+        assert_almost_equal(scores[0, 1], 2.0 / 3)
+        assert_equal(scores[1, 1], 1.0)
+
+
+class Test__find_blocs:
+
+    @istest
+    def groups_members_that_agree (self):
+        scores = numpy.array([[1.0, 0.9, 0.2, 0.1],
+                              [0.9, 1.0, 0.3, 0.2],
+                              [0.2, 0.3, 1.0, 0.95],
+                              [0.1, 0.2, 0.95, 1.0]])
+
+        assert_equal(sorted(find_blocs(scores, 0.8)), [[0, 1], [2, 3]])
+
+    @istest
+    def leaves_members_without_shared_votes_alone (self):
+        scores = numpy.array([[1.0, numpy.nan],
+                              [numpy.nan, 1.0]])
+
+        assert_equal(sorted(find_blocs(scores, 0.8)), [[0], [1]])
+
+
+class Test__VoteMatrix_summary:
+
+    @istest
+    def reports_participation_and_blocs (self):
+        matrix = VoteMatrix()
+        vote_id = 0
+        for action in range(MIN_SHARED_VOTES):
+            # Members 1 and 2 vote yes, and 3 and 4 vote no; member 4 misses
+            # every other vote.
+            for member, code in [(1, YES), (2, YES), (3, NO), (4, NO if action % 2 else ABSENT)]:
+                vote_id += 1
+                matrix.add_votes([vote_id], [action], [member], [code])
+        for member in [1, 2, 3]:
+            vote_id += 1
+            matrix.add_votes([vote_id], [99], [member], [YES])
+
+        summary = matrix.summary()
+
+        assert_equal(summary['actions'], MIN_SHARED_VOTES + 1)
+        assert_equal(summary['contested_actions'], MIN_SHARED_VOTES)
+        assert_equal(summary['members'][4]['participation'], 0.5)
+        assert_equal(summary['members'][1]['agreement'][0][:2], (2, 1.0))
+        assert_equal(sorted(summary['blocs']), [[1, 2]])
+
+
+class Test__matrixPath:
+
+    @istest
+    @override_settings(VOTE_MATRIX_PATH='/data/vote_matrix.npz', DEFAULT_CITY='philadelphia',
+                       CITIES={'philadelphia': {}, 'chicago': {'KEY_OFFSET': 1000000}})
+    def keeps_each_citys_matrix_apart (self):
+        assert_equal(matrix_path('philadelphia'), '/data/vote_matrix.npz')
+        assert_equal(matrix_path('chicago'), '/data/vote_matrix-chicago.npz')
+
+
+class Test__cacheVoteSummary:
+
+    @istest
+    def records_when_the_summary_was_built (self):
+        matrix = VoteMatrix()
+        matrix.add_votes([1], [1], [1], [YES])
+
+        cache_vote_summary(matrix)
+        first_built = get_vote_summary()['built_datetime']
+        cache_vote_summary(matrix)
+
+        assert_greater(get_vote_summary()['built_datetime'], first_built)
@@ -0,0 +1,106 @@
+from nose.tools import *
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import override_settings
+import threading
+
+from phillyleg.cities import (current_city, get_cities, get_city,
+    get_current_city, city_for_host, make_cache_key)
+from phillyleg.management.scraper_wrappers.scheduler import ScraperScheduler
+
+CITIES = {
+    'philadelphia': {'HOSTS': ['philly.example.com'], 'PRIORITY': 10, 'CONCURRENCY': 2},
+    'chicago': {'HOSTS': ['chicago.example.com'], 'KEY_OFFSET': 1000000},
+    'boston': {'PRIORITY': 5, 'KEY_OFFSET': 2000000},
+}
+
+
+class Test__getCities:
+
+    @istest
+    @override_settings(CITIES=None, DEFAULT_CITY='philadelphia',
+                       LEGISLATION={'SCRAPER': 'example.Scraper'})
+    def falls_back_to_one_city_with_the_legislation_settings (self):
+        cities = get_cities()
+        assert_equal(cities.keys(), ['philadelphia'])
+        assert_equal(cities['philadelphia'].config['SCRAPER'], 'example.Scraper')
+        assert_equal(cities['philadelphia'].key_offset, 0)
+
+    @istest
+    @override_settings(CITIES=CITIES, DEFAULT_CITY='philadelphia')
+    def picks_the_city_by_host (self):
+        assert_equal(city_for_host('Chicago.example.com:8000').slug, 'chicago')
+        assert_equal(city_for_host('elsewhere.example.com').slug, 'philadelphia')
+
+
+    @istest
+    @override_settings(CITIES={'philadelphia': {}, 'chicago': {'KEY_OFFSET': 0}},
+                       DEFAULT_CITY='philadelphia')
+    def refuses_cities_with_the_same_key_offset (self):
+        assert_raises(ImproperlyConfigured, get_cities)
+
+
+class Test__currentCity:
+
+    @istest
+    @override_settings(CITIES=CITIES, DEFAULT_CITY='philadelphia')
+    def partitions_cache_keys (self):
+        with current_city('chicago'):
+            chicago_key = make_cache_key('recent_topics', '', 1)
+        philly_key = make_cache_key('recent_topics', '', 1)
+
+        assert_equal(chicago_key, ':1:chicago:recent_topics')
+        assert_equal(philly_key, ':1:philadelphia:recent_topics')
+
+    @istest
+    @override_settings(CITIES=CITIES, DEFAULT_CITY='philadelphia')
+    def is_kept_per_thread (self):
+        seen = []
+        with current_city('chicago'):
+            thread = threading.Thread(target=lambda: seen.append(get_current_city()))
+            thread.start()
+            thread.join()
+            assert_equal(get_city().slug, 'chicago')
+
+        assert_equal(seen, ['philadelphia'])
+        assert_equal(get_current_city(), 'philadelphia')
+
+
+class Test__ScraperScheduler:
+
+    @istest
+    @override_settings(CITIES=CITIES, DEFAULT_CITY='philadelphia')
+    def starts_jobs_by_priority_within_each_citys_concurrency (self):
+        cities = get_cities()
+        scheduler = ScraperScheduler(workers=3)
+        for name in ['new', 'update']:
+            for slug in sorted(cities):
+                scheduler.add(cities[slug], name, lambda: None)
+
+        # Philadelphia may run both of its jobs at once; the others one each.
+        jobs = [scheduler.next_job() for _ in range(4)]
+        assert_equal([(job.city.slug, job.name) for job in jobs],
+                     [('philadelphia', 'new'), ('philadelphia', 'update'),
+                      ('boston', 'new'), ('chicago', 'new')])
+
+        for job in jobs:
+            scheduler.finish(job)
+        assert_equal([(job.city.slug, job.name) for job in scheduler.pending],
+                     [('boston', 'update'), ('chicago', 'update')])
+
+    @istest
+    @override_settings(CITIES=CITIES, DEFAULT_CITY='philadelphia')
+    def keeps_running_jobs_after_one_fails (self):
+        cities = get_cities()
+        done = []
+
+        def fail():
+            raise ValueError('The scraper broke')
+
+        scheduler = ScraperScheduler(workers=2)
+        scheduler.add(cities['chicago'], 'new', fail)
+        scheduler.add(cities['boston'], 'new', done.append, 'boston')
+        scheduler.add(cities['philadelphia'], 'new', done.append, 'philadelphia')
+        scheduler.run()
+
+        assert_equal(sorted(done), ['boston', 'philadelphia'])
+        assert_equal([job.city.slug for job in scheduler.failed], ['chicago'])
@@ -0,0 +1,60 @@
+from nose.tools import *
+
+import datetime as dt
+import os
+import tempfile
+from django.core.management import call_command
+from StringIO import StringIO
+
+from phillyleg.management.commands.csvimport import coerce
+from phillyleg.models import LegFile, LegAction
+
+
+class Test__coerce:
+
+    @istest
+    def reads_dates_in_either_format (self):
+        field = LegAction._meta.get_field('date_taken')
+        assert_equal(coerce(field, '2011-08-11'), dt.date(2011, 8, 11))
+        assert_equal(coerce(field, '08/11/2011'), dt.date(2011, 8, 11))
+
+    @istest
+    def uses_null_or_the_default_for_empty_values (self):
+        assert_is_none(coerce(LegFile._meta.get_field('final_date'), ''))
+        assert_equal(coerce(LegFile._meta.get_field('is_routine'), ''), True)
+        assert_raises(ValueError, coerce, LegAction._meta.get_field('date_taken'), '')
+
+    @istest
+    def checks_the_length_of_strings (self):
+        assert_raises(ValueError, coerce, LegFile._meta.get_field('version'), 'x' * 101)
+
+
+class Test__csvimport:
+
+    def setup(self):
+        LegFile.objects.all().delete()
+
+    def write_csv(self, text):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as csv_file:
+            csv_file.write(text)
+        return path
+
+    @istest
+    def loads_valid_rows_and_skips_the_rest (self):
+        path = self.write_csv(
+            'key,id,title,intro_date,type,sponsors\n'
+            '1,100001,First,2011-08-11,Bill,"Councilmember A, Councilmember B"\n'
+            'x,100002,Bad key,2011-08-11,Bill,\n'
+            '1,100001,Repeated,2011-08-11,Bill,\n')
+        try:
+            stderr = StringIO()
+            call_command('csvimport', path, stdout=StringIO(), stderr=stderr)
+        finally:
+            os.remove(path)
+
+        legfile = LegFile.objects.get()
+        assert_equal(legfile.title, 'First')
+        assert_equal(sorted(sponsor.real_name for sponsor in legfile.sponsors.all()),
+                     ['Councilmember A', 'Councilmember B'])
+        assert_in('line 3, key', stderr.getvalue())
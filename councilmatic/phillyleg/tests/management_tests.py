@@ -1,6 +1,5 @@
 from unittest import TestCase
 import os
-import bs4 as bs
 import datetime as dt
 import mock
 from StringIO import StringIO
@@ -8,6 +7,8 @@ from StringIO import StringIO
 from phillyleg.management.scraper_wrappers import PhillyLegistarSiteWrapper
 from phillyleg.management.scraper_wrappers import LegistarApiWrapper
 from phillyleg.management.scraper_wrappers import CouncilmaticDataStoreWrapper
+from phillyleg.management.scraper_wrappers.sources.insite_page import LegFilePage
+from phillyleg.management.scraper_wrappers.sources.scraperwiki_db import LegFileReader
 
 class LegistarTests (TestCase):
 
@@ -24,20 +25,45 @@ class LegistarTests (TestCase):
     def open_legfile(self, key):
         return open(os.path.join(self.legfiles_dir, 'key%s.html' % key))
 
+    def test_NonAsciiFieldsAreDecoded(self):
+        html = (u'<html><body>'
+                u'<span id="lblTitleValue">Caf\xe9 licenses \u2014 amendments</span>'
+                u'</body></html>').encode('utf-8')
+
+        page = LegFilePage(StringIO(html))
+        self.assertEqual(page.fields['title'], u'Caf\xe9 licenses \u2014 amendments')
+
+        # A charset in the response's Content-Type wins over a guess.
+        response = mock.Mock()
+        response.read.return_value = u'<span id="lblTitleValue">Caf\xe9</span>'.encode('cp1252')
+        response.info.return_value.getparam.return_value = 'windows-1252'
+
+        page = LegFilePage(response)
+        self.assertEqual(page.fields['title'], u'Caf\xe9')
+
     def test_RecognizeNotesRow(self):
         # The history on some filings (like key=73) have notes.  These need to
         # be detected.
-        html = self.open_legfile('73').read()
-        soup = bs.BeautifulSoup(html)
+        page = LegFilePage(self.open_legfile('73'))
 
         wrapper = PhillyLegistarSiteWrapper(root_url='')
         file_record, attachment_records, action_records, minutes_records = \
-            wrapper.scrape_legis_file(73, soup)
+            wrapper.scrape_legis_file(73, page)
 
         self.assertEqual(
             len([act_rec for act_rec in action_records
                  if act_rec['notes']]), 2)
 
+    def test_PageFieldsAreExtracted(self):
+        page = LegFilePage(self.open_legfile('73'))
+
+        self.assertEqual(page.fields['id'], '000002')
+        self.assertEqual(page.fields['type'], 'Resolution')
+        self.assertEqual(page.fields['intro_date'], '2/3/2000')
+        self.assertEqual(page.attachments,
+            [('Resolution No.00000200.pdf', 'http://legislation.phila.gov/attachments/7949.pdf')])
+        self.assertEqual(len(page.history), 12)
+
     def test_ResolutionPdfParsesCorrectly(self):
         wrapper = PhillyLegistarSiteWrapper(root_url='')
         expected_text = """\n\n\n\n\n\n\n\n\nCity of Philadelphia \n \n \n \n \nCity of Philadelphia \n- 1 - \n \n \n \nCity Council \nChief Clerk's Office \n402 City Hall \nPhiladelphia, PA 19107 \nRESOLUTION NO. 110406 \n \n \nIntroduced May 12, 2011 \n \n \nCouncilmember DiCicco \n \n \nReferred to the \nCommittee of the Whole   \n \n \nRESOLUTION \n \nAppointing David Campoli to the Board of Directors of the Center City District. \n \n \n \nRESOLVED, BY THE COUNCIL OF THE CITY OF PHILADELPHIA, \nTHAT David Campoli is hereby appointed as a member of the Board of Directors of the \nCenter City District, to serve in a term ending December 31, 2012. \n \n \n\n\n\nCity of Philadelphia \n \nRESOLUTION NO. 110406 continued \n \n \n \n \n \nCity of Philadelphia \n- 2 - \n \n \n \n \n\n"""
@@ -107,11 +133,11 @@ class LegistarTests (TestCase):
     def test_detectsErrorsCorrectly(self):
         wrapper = PhillyLegistarSiteWrapper(root_url='')
 
-        soup = bs.BeautifulSoup(self.open_legfile('12000').read())
-        self.assertTrue(wrapper.is_error_page(soup))
+        page = LegFilePage(self.open_legfile('12000'))
+        self.assertTrue(wrapper.is_error_page(page))
 
-        soup = bs.BeautifulSoup(self.open_legfile('73').read())
-        self.assertTrue(not wrapper.is_error_page(soup))
+        page = LegFilePage(self.open_legfile('73'))
+        self.assertTrue(not wrapper.is_error_page(page))
 
     def test_ExitsSilentlyOnNoNewContent(self):
         wrapper = PhillyLegistarSiteWrapper(root_url='')
@@ -134,6 +160,107 @@ class LegistarTests (TestCase):
         self.assertEqual(wrapper.urlopen.call_count, 10)
 
 
+class ScraperWikiReaderTests (TestCase):
+
+    def setUp(self):
+        import sqlite3
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript("""
+            create table swdata (key integer, id text, type text, url text,
+                status text, title text, controlling_body text,
+                intro_date text, final_date text, version text, contact text,
+                sponsors text);
+            create table attachments (key integer, description text, url text);
+            create table actions (key integer, date_taken text,
+                acting_body text, description text, motion text,
+                minutes_url text, notes text);
+            create table minutes (url text, fulltext text, date_taken text);
+        """)
+        for key in range(73, 78):
+            self.conn.execute('insert into swdata values (?,?,?,?,?,?,?,?,?,?,?,?)',
+                (key, str(key), 'Bill', 'http://example.com/%s' % key, 'Passed',
+                 'Title %s' % key, 'Council', '2011-04-05', '', '1', '', 'Smith'))
+        self.conn.execute('insert into attachments values (74, "Text", "http://example.com/74.pdf")')
+        self.conn.execute('insert into actions values (74, "2011-04-05", "Council", "Introduced", "", "http://example.com/m1", "")')
+        self.conn.execute('insert into actions values (74, "2011-04-12", "Council", "Passed", "", "http://example.com/m1", "")')
+        self.conn.execute('insert into actions values (76, "2011-04-12", "Council", "Passed", "", "http://example.com/m2", "")')
+        self.conn.execute('insert into minutes values ("http://example.com/m1", "Minutes", "2011-04-12T00:00:00")')
+        self.conn.execute('insert into minutes values ("http://example.com/m2", "Minutes", "2011-04-19T00:00:00")')
+
+    def test_ReadsFilesAfterKeyInChunks(self):
+        reader = LegFileReader(self.conn, chunk_size=2)
+        legis_files = list(reader.iter_legis_files(73))
+
+        self.assertEqual([record['key'] for record, _, _, _ in legis_files], [74, 75, 76, 77])
+        self.assertEqual(legis_files[0][0]['intro_date'], dt.datetime(2011, 4, 5))
+        self.assertEqual(legis_files[0][0]['final_date'], None)
+
+    def test_GroupsRelatedRowsWithTheirFiles(self):
+        reader = LegFileReader(self.conn, chunk_size=2)
+        legis_files = dict((record['key'], (attachments, actions, minutes))
+                           for record, attachments, actions, minutes in reader.iter_legis_files(73))
+
+        attachments, actions, minutes = legis_files[74]
+        self.assertEqual([a['url'] for a in attachments], ['http://example.com/74.pdf'])
+        self.assertEqual([a['description'] for a in actions], ['Introduced', 'Passed'])
+        self.assertEqual([(m['url'], m['date_taken']) for m in minutes],
+                         [('http://example.com/m1', dt.date(2011, 4, 12))])
+
+        self.assertEqual(legis_files[75], ([], [], []))
+        self.assertEqual([m['url'] for m in legis_files[76][2]], ['http://example.com/m2'])
+
+    def test_ReadsSingleFile(self):
+        reader = LegFileReader(self.conn)
+        record, attachments, actions, minutes = reader.read_legis_file(76)
+
+        self.assertEqual(record['title'], 'Title 76')
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(reader.read_legis_file(100), None)
+
+
+class HostedLegistarTests (TestCase):
+    def test_ResumesTheSearchAfterAFailedRequest(self):
+        import urllib2
+        from phillyleg.management.scraper_wrappers.sources.hosted_legistar_scraper import HostedLegistarSiteWrapper
+
+        searches = []
+        def search_summaries():
+            searches.append(True)
+            for row in range(1, 5):
+                if len(searches) == 1 and row == 3:
+                    raise urllib2.URLError('timed out')
+                yield {'row': row}
+
+        wrapper = HostedLegistarSiteWrapper.__new__(HostedLegistarSiteWrapper)
+        wrapper.throttle = mock.Mock()
+        wrapper.throttle.call.side_effect = lambda func, *a, **k: func(*a, **k)
+        wrapper.search_summaries = search_summaries
+        wrapper.summaries_read = 0
+        wrapper.legislation_summaries = wrapper.search_summaries()
+
+        rows = [wrapper.next_summary()['row'] for _ in range(4)]
+        self.assertEqual(rows, [1, 2, 3, 4])
+        self.assertEqual(len(searches), 2)
+        self.assertRaises(StopIteration, wrapper.next_summary)
+
+    def test_RaisesAfterTooManyFailedRequests(self):
+        import urllib2
+        from phillyleg.management.scraper_wrappers.sources.hosted_legistar_scraper import HostedLegistarSiteWrapper
+
+        def search_summaries():
+            raise urllib2.URLError('timed out')
+            yield
+
+        wrapper = HostedLegistarSiteWrapper.__new__(HostedLegistarSiteWrapper)
+        wrapper.throttle = mock.Mock()
+        wrapper.throttle.call.side_effect = lambda func, *a, **k: func(*a, **k)
+        wrapper.search_summaries = search_summaries
+        wrapper.summaries_read = 0
+        wrapper.legislation_summaries = wrapper.search_summaries()
+
+        self.assertRaises(urllib2.URLError, wrapper.next_summary)
+
+
 class OrmStoreTests (TestCase):
     def test_RecoversGracefullyAfterIntegrityError (self):
         from phillyleg.models import LegFile
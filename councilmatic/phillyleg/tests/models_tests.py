@@ -141,3 +141,29 @@ class Test__LegFile_refresh:
 
         legfile.refresh()
         assert_equal(legfile.title, '''abcde''')
+
+
+class Test__IndexQueueEntry_enqueue:
+
+    def setup(self):
+        IndexQueueEntry.objects.all().delete()
+
+    @istest
+    def coalesces_repeated_changes_to_an_object (self):
+        legfile = LegFile(id='123456', key=1)
+        IndexQueueEntry.objects.enqueue(legfile)
+        first_queued = IndexQueueEntry.objects.get().queued_datetime
+
+        IndexQueueEntry.objects.enqueue(legfile)
+
+        entries = IndexQueueEntry.objects.all()
+        assert_equal(len(entries), 1)
+        assert_equal((entries[0].model_name, entries[0].object_key), ('legfile', 1))
+        assert_true(entries[0].queued_datetime >= first_queued)
+
+    @istest
+    def is_only_ready_once_the_window_has_passed (self):
+        IndexQueueEntry.objects.enqueue(LegFile(id='123456', key=1))
+
+        assert_equal(IndexQueueEntry.objects.ready(dt.timedelta(minutes=1)).count(), 0)
+        assert_equal(IndexQueueEntry.objects.ready(dt.timedelta(0)).count(), 1)
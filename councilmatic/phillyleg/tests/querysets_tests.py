@@ -0,0 +1,36 @@
+from nose.tools import *
+from StringIO import StringIO
+
+from phillyleg.models import LegFile
+from utils.querysets import *
+
+
+class Test__iterChunks:
+
+    def setup(self):
+        LegFile.objects.all().delete()
+        for key in [5, 1, 4, 2, 3]:
+            LegFile(key=key, id='%06d' % key, title='File %d' % key).save(
+                update_words=False, update_mentions=False,
+                update_locations=False, update_topics=False)
+
+    @istest
+    def reads_objects_in_key_order_a_chunk_at_a_time (self):
+        chunks = list(iter_chunks(LegFile.objects.all(), 2))
+        assert_equal([[legfile.pk for legfile in chunk] for chunk in chunks],
+                     [[1, 2], [3, 4], [5]])
+
+    @istest
+    def keeps_the_querysets_filters (self):
+        chunks = list(iter_chunks(LegFile.objects.filter(key__gte=3), 2, fields=('key',), flat=True))
+        assert_equal(chunks, [[3, 4], [5]])
+
+    @istest
+    def reports_progress_for_each_chunk (self):
+        stream = StringIO()
+        progress = Progress('Files', stream, total=5, interval=0)
+
+        items = list(iter_chunked(LegFile.objects.all(), 2, fields=('key', 'title'), progress=progress))
+        assert_equal(items[0], (1, 'File 1'))
+        assert_equal(progress.count, 5)
+        assert_equal(len(stream.getvalue().splitlines()), 3)
@@ -0,0 +1,95 @@
+from django.test import TestCase
+from nose.tools import *
+
+from phillyleg.models import LegFile
+from phillyleg.related import *
+
+
+class Test__tokenize:
+
+    @istest
+    def keeps_lowercased_words_of_three_letters_or_more (self):
+        assert_equal(tokenize(u"An Ordinance amending the Zoning Code's 14-100 of it"),
+                     [u'ordinance', u'amending', u'the', u'zoning', u"code's"])
+
+
+class Test__tfidfVectors:
+
+    @istest
+    def leaves_out_terms_in_one_file_or_too_many (self):
+        vectors = tfidf_vectors({
+            1: {'zoning': 1, 'ordinance': 1, 'fishtown': 1},
+            2: {'zoning': 1, 'ordinance': 1},
+            3: {'ordinance': 1},
+        }, max_df=0.7)
+
+        assert_equal(vectors[1].keys(), ['zoning'])
+        assert_equal(vectors[3], {})
+
+    @istest
+    def makes_unit_length_vectors (self):
+        vectors = tfidf_vectors({
+            1: {'zoning': 3, 'parking': 1},
+            2: {'zoning': 1, 'parking': 2},
+            3: {'honoring': 1},
+            4: {'honoring': 1},
+            5: {'budget': 1},
+        }, max_df=0.5)
+
+        for key in (1, 2, 3, 4):
+            assert_almost_equal(sum(weight ** 2 for weight in vectors[key].values()), 1.0)
+        assert_greater(vectors[1]['zoning'], vectors[1]['parking'])
+
+
+class Test__cosineSimilarities:
+
+    @istest
+    def scores_only_the_vectors_that_share_a_term (self):
+        vectors = {1: {'zoning': 0.6, 'parking': 0.8},
+                   2: {'zoning': 1.0},
+                   3: {'honoring': 1.0}}
+
+        scores = cosine_similarities(vectors[1], invert(vectors))
+        assert_equal(sorted(scores), [1, 2])
+        assert_almost_equal(scores[1], 1.0)
+        assert_almost_equal(scores[2], 0.6)
+
+
+class Test__RelatedIndex_mostRelated:
+
+    @istest
+    def adds_mentions_and_shared_sponsors_to_term_similarity (self):
+        index = RelatedIndex(
+            vectors={1: {'zoning': 1.0}, 2: {'zoning': 1.0}, 3: {'zoning': 1.0}, 4: {}},
+            sponsors={1: set([10]), 2: set([10, 11]), 3: set([12]), 4: set([10])},
+            mentions={1: set([4]), 4: set([1])})
+
+        related = index.most_related(1)
+        assert_equal([key for key, score in related], [2, 3, 4])
+        assert_almost_equal(related[0][1], 1.0 + SPONSOR_WEIGHT / 2)
+        assert_almost_equal(related[1][1], 1.0)
+        assert_almost_equal(related[2][1], MENTION_WEIGHT + SPONSOR_WEIGHT)
+
+    @istest
+    def keeps_only_the_given_number (self):
+        index = RelatedIndex(
+            vectors=dict((key, {'zoning': 1.0}) for key in range(1, 6)),
+            sponsors={}, mentions={})
+
+        assert_equal([key for key, score in index.most_related(1, 2)], [2, 3])
+
+
+class Test__affectedLegfileKeys (TestCase):
+
+    def setUp(self):
+        for key in (1, 2, 3):
+            LegFile.objects.create(key=key, title='File %d' % key)
+        RelatedLegFile.objects.create(legfile_id=1, related_legfile_id=2, score=0.5)
+
+    @istest
+    def includes_files_that_have_a_changed_file_saved_as_related (self):
+        # File 2 no longer has anything in common with file 1, but file 1's
+        # saved list still has it.
+        index = RelatedIndex(vectors={1: {}, 2: {}, 3: {}}, sponsors={}, mentions={})
+
+        assert_equal(affected_legfile_keys(index, set([2])), set([1]))
@@ -0,0 +1,105 @@
+from nose.tools import *
+import urllib2
+
+from phillyleg.management.scraper_wrappers.throttle import HostThrottle, get_throttle
+
+
+class FakeClockThrottle (HostThrottle):
+    """A throttle whose clock only moves when it sleeps"""
+    def __init__(self, *args, **kwargs):
+        self.now = 1000.0
+        self.slept = []
+        super(FakeClockThrottle, self).__init__(*args, **kwargs)
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def fail():
+    raise urllib2.URLError('timed out')
+
+
+def not_found():
+    raise urllib2.HTTPError('http://example.com/', 404, 'Not Found', {}, None)
+
+
+class Test__HostThrottle:
+
+    @istest
+    def lets_a_burst_through_then_spaces_requests_by_the_rate (self):
+        throttle = FakeClockThrottle('example.com', rate=2.0, burst=3, increase=0)
+        for _ in range(5):
+            throttle.call(lambda: None)
+
+        assert_equal(throttle.slept, [0.5, 0.5])
+
+    @istest
+    def speeds_up_on_success_and_backs_off_on_failure (self):
+        throttle = FakeClockThrottle('example.com', rate=2.0, increase=0.5, backoff=0.5)
+        throttle.call(lambda: None)
+        assert_equal(throttle.rate, 2.5)
+
+        assert_raises(urllib2.URLError, throttle.call, fail)
+        assert_equal(throttle.rate, 1.25)
+
+    @istest
+    def does_not_count_missing_pages_as_failures (self):
+        throttle = FakeClockThrottle('example.com', rate=2.0, increase=0)
+        assert_raises(urllib2.HTTPError, throttle.call, not_found)
+
+        assert_equal(throttle.failures, 0)
+        assert_equal(throttle.rate, 2.0)
+
+    @istest
+    def pauses_the_host_after_repeated_failures (self):
+        throttle = FakeClockThrottle('example.com', rate=100.0, max_failures=3, pause=60)
+        for _ in range(3):
+            assert_raises(urllib2.URLError, throttle.call, fail)
+        assert_equal(throttle.pauses, 1)
+
+        # The next request waits out the pause; when it fails too, the pause
+        # doubles.
+        throttle.slept = []
+        assert_raises(urllib2.URLError, throttle.call, fail)
+        assert_almost_equal(sum(throttle.slept), 60)
+        assert_equal(throttle.pauses, 2)
+
+        throttle.slept = []
+        throttle.call(lambda: None)
+        assert_almost_equal(sum(throttle.slept), 120)
+        assert_equal(throttle.consecutive_failures, 0)
+        assert_equal(throttle.pause_length, 60)
+
+    @istest
+    def lets_one_trial_through_after_a_pause_and_the_rest_at_the_rate (self):
+        throttle = FakeClockThrottle('example.com', rate=4.0, max_failures=2,
+                                     pause=60, backoff=0.5)
+        for _ in range(2):
+            assert_raises(urllib2.URLError, throttle.call, fail)
+        assert_equal(throttle.rate, 1.0)
+
+        waits = [throttle.reserve() for _ in range(4)]
+        assert_equal(waits, [60.0, 61.0, 62.0, 63.0])
+
+    @istest
+    def reports_the_achieved_rate (self):
+        throttle = FakeClockThrottle('example.com', rate=1.0, burst=1, increase=0)
+        for _ in range(5):
+            throttle.call(lambda: None)
+
+        stats = throttle.stats()
+        assert_equal(stats['requests'], 5)
+        assert_almost_equal(stats['achieved_rate'], 1.0)
+
+
+class Test__getThrottle:
+
+    @istest
+    def shares_one_throttle_per_host (self):
+        throttle = get_throttle('http://Legislation.example.com/detailreport/?key=1')
+        assert_is(get_throttle('http://legislation.example.com/'), throttle)
+        assert_is(get_throttle('legislation.example.com'), throttle)
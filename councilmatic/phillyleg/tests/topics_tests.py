@@ -0,0 +1,61 @@
+from nose.tools import *
+
+from phillyleg.topics import *
+
+
+class Test__KeywordClassifier:
+
+    def setup(self):
+        self.classifier = KeywordClassifier({
+            'Zoning': ['zoning', 'overlay district'],
+            'Taxes': ['tax', 'business privilege'],
+            'Business': ['business privilege'],
+        })
+
+    @istest
+    def matches_whole_words_and_phrases_regardless_of_case (self):
+        assert_equal(self.classifier(u'An Ordinance amending the ZONING code for the Overlay\n District'),
+                     ['Zoning'])
+        assert_equal(self.classifier(u'Taxes and taxation'), [])
+
+    @istest
+    def gives_every_topic_of_a_keyword (self):
+        assert_equal(self.classifier(u'Business Privilege Tax'), ['Business', 'Taxes'])
+
+    @istest
+    def finds_the_keywords_within_a_phrase (self):
+        classifier = KeywordClassifier({
+            'Taxes': ['tax'],
+            'Real Estate': ['real estate tax'],
+            'Property': ['real estate'],
+        })
+        assert_equal(classifier(u'A Real Estate Tax abatement'),
+                     ['Property', 'Real Estate', 'Taxes'])
+        assert_equal(classifier(u'Real estate taxes'), ['Property'])
+
+    @istest
+    def classifies_many_titles_at_once (self):
+        assert_equal(self.classifier.classify_many([u'zoning', u'nothing', u'a tax']),
+                     [['Zoning'], [], ['Taxes']])
+
+    @istest
+    def has_a_signature_that_changes_with_the_rules (self):
+        assert_equal(self.classifier.signature,
+                     KeywordClassifier({'Taxes': ['Tax', 'business privilege'],
+                                        'Business': ['business privilege'],
+                                        'Zoning': ['overlay district', 'zoning']}).signature)
+        assert_not_equal(self.classifier.signature,
+                         KeywordClassifier({'Zoning': ['zoning']}).signature)
+
+
+class Test__classifyTitles:
+
+    @istest
+    def calls_plain_classifiers_with_each_title (self):
+        calls = []
+        def classifier(title):
+            calls.append(title)
+            return [title.upper()]
+
+        assert_equal(classify_titles(['a', 'b', 'a'], classifier), [['A'], ['B'], ['A']])
+        assert_equal(sorted(calls), ['a', 'b'])
@@ -0,0 +1,370 @@
+"""
+GeoJSON map tiles of the council districts and of the locations mentioned in
+legislation.
+
+Tiles are addressed like other web map tiles, by zoom level, column and row
+(``/tiles/<layer>/<z>/<x>/<y>.json``).  District shapes are clipped to each
+tile (with a small margin, so that their edges don't show at tile seams) and
+simplified to the tile's resolution.  Below CLUSTER_MAX_ZOOM, locations are
+clustered on a grid within each tile, with the number of locations and of
+mentions in legislation in each cluster.
+
+Tiles show the current city's districts and locations (see
+phillyleg.cities).  Tiles outside the extent of a layer's features are empty,
+and are served without being rendered or saved.  Tiles up to
+PRECOMPUTED_MAX_ZOOM are saved under ``settings.TILE_CACHE_DIR``, by city, and
+served from there for TILE_CACHE_TIMEOUT; the rendertiles command renders
+them, since they cover the most ground and are the slowest to render, ahead of
+time.  Higher zoom levels have too many tiles to save on disk, so they're kept
+in the (bounded) Django cache instead.
+"""
+
+import datetime
+import json
+import math
+import os
+import tempfile
+import time
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+from django.db.models import Count
+from django.http import Http404, HttpResponse
+from django.views import generic as views
+
+from phillyleg.cities import get_current_city
+from phillyleg.models import CouncilDistrict, CouncilDistrictPlan, MetaData_Location
+
+
+LAYERS = ('districts', 'locations')
+
+TILE_SIZE = 256
+"""The width and height of a tile, in pixels"""
+
+MAX_ZOOM = 18
+
+CLIP_MARGIN = 1.0 / 16
+"""How far past a tile's edges district shapes are drawn, as a fraction of
+   the tile's size"""
+
+CLUSTER_GRID = 8
+"""The number of cells across (and down) a tile that locations are clustered
+   into"""
+
+CLUSTER_MAX_ZOOM = 16
+"""The zoom level from which locations are no longer clustered"""
+
+PRECOMPUTED_MAX_ZOOM = 13
+"""The highest zoom level that the rendertiles command renders"""
+
+TILE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def tile_bounds(z, x, y):
+    """
+    The (west, south, east, north) bounds of a tile, in degrees.
+    """
+    n = 2.0 ** z
+
+    def lon(x):
+        return x / n * 360.0 - 180.0
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return lon(x), lat(y + 1), lon(x + 1), lat(y)
+
+
+def tiles_covering(extent, z):
+    """
+    Generate the (x, y) of the tiles at zoom level z that cover the extent,
+    given as (west, south, east, north) in degrees.
+    """
+    n = 2 ** z
+    west, south, east, north = extent
+
+    def col(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def row(lat):
+        lat = math.radians(lat)
+        y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2
+        return min(n - 1, max(0, int(y * n)))
+
+    for x in range(col(west), col(east) + 1):
+        for y in range(row(north), row(south) + 1):
+            yield x, y
+
+
+def bbox_polygon(west, south, east, north):
+    polygon = Polygon.from_bbox((west, south, east, north))
+    polygon.srid = 4326
+    return polygon
+
+
+def round_coordinates(coordinates, places):
+    """
+    Round the numbers in a GeoJSON coordinates array, however deeply nested.
+    """
+    if isinstance(coordinates, (list, tuple)):
+        return [round_coordinates(item, places) for item in coordinates]
+    return round(coordinates, places)
+
+
+def geometry_json(geometry, tolerance):
+    """
+    The GeoJSON geometry dict for a GEOS geometry, with its coordinates
+    rounded to a tenth of the tolerance.
+    """
+    places = max(0, int(math.ceil(-math.log10(tolerance))) + 1)
+    data = json.loads(geometry.json)
+    data['coordinates'] = round_coordinates(data['coordinates'], places)
+    return data
+
+
+def current_plan():
+    """
+    The current city's district plan in effect today, or None if there is
+    none.
+    """
+    plans = CouncilDistrictPlan.objects.filter(city=get_current_city(),
+                                               date__lte=datetime.date.today())
+    return plans.order_by('-date')[:1].get() if plans.exists() else None
+
+
+def render_districts(z, x, y, plan):
+    """
+    A GeoJSON feature collection of the plan's districts in the tile, clipped
+    and simplified.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    margin_x = (east - west) * CLIP_MARGIN
+    margin_y = (north - south) * CLIP_MARGIN
+    clip = bbox_polygon(west - margin_x, south - margin_y,
+                        east + margin_x, north + margin_y)
+    tolerance = (east - west) / TILE_SIZE
+
+    features = []
+    districts = plan.districts.filter(shape__intersects=clip) \
+        .prefetch_related('tenures__councilmember')
+    for district in districts:
+        shape = district.shape.intersection(clip) \
+            .simplify(tolerance, preserve_topology=True)
+        if shape.empty:
+            continue
+
+        representative = district.representative
+        features.append({
+            'type': 'Feature',
+            'id': district.pk,
+            'geometry': geometry_json(shape, tolerance),
+            'properties': {
+                'district': district.id,
+                'plan': plan.pk,
+                'representative': representative and representative.real_name,
+            },
+        })
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def city_locations():
+    """
+    The valid locations mentioned in the current city's legislation.
+    """
+    return MetaData_Location.objects.filter(
+        valid=True, references_in_legislation__legfile__city=get_current_city())
+
+
+def render_locations(z, x, y):
+    """
+    A GeoJSON feature collection of the valid locations in the tile, each
+    with the number of the city's legislative files that mention it.  Below
+    CLUSTER_MAX_ZOOM, the locations in each cell of a CLUSTER_GRID grid are
+    combined into one point, at their average position.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    tolerance = (east - west) / TILE_SIZE
+    # The count is of the city's files, which the locations were filtered by.
+    locations = city_locations() \
+        .filter(geom__intersects=bbox_polygon(west, south, east, north)) \
+        .annotate(legfile_count=Count('references_in_legislation')) \
+        .only('address', 'geom')
+
+    features = []
+    if z >= CLUSTER_MAX_ZOOM:
+        for location in locations:
+            features.append({
+                'type': 'Feature',
+                'id': location.pk,
+                'geometry': geometry_json(location.geom, tolerance),
+                'properties': {'address': location.address,
+                               'legfiles': location.legfile_count},
+            })
+
+    else:
+        cell_width = (east - west) / CLUSTER_GRID
+        cell_height = (north - south) / CLUSTER_GRID
+        cells = {}
+        for location in locations:
+            lon, lat = location.geom.x, location.geom.y
+            cell = (min(CLUSTER_GRID - 1, int((lon - west) / cell_width)),
+                    min(CLUSTER_GRID - 1, int((lat - south) / cell_height)))
+            totals = cells.setdefault(cell, [0, 0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += location.legfile_count
+            totals[2] += lon
+            totals[3] += lat
+
+        for count, legfile_count, sum_x, sum_y in cells.values():
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point',
+                             'coordinates': round_coordinates([sum_x / count, sum_y / count], 6)},
+                'properties': {'locations': count, 'legfiles': legfile_count},
+            })
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def render_tile(layer, z, x, y, plan=None):
+    if layer == 'districts':
+        return json.dumps(render_districts(z, x, y, plan), separators=(',', ':'))
+    return json.dumps(render_locations(z, x, y), separators=(',', ':'))
+
+
+def tile_path(layer, z, x, y, plan=None):
+    """
+    Where the tile is saved, or None if tiles aren't saved.  Tiles are saved
+    by city, and district tiles by plan, so a new plan doesn't show old
+    districts.
+    """
+    cache_dir = getattr(settings, 'TILE_CACHE_DIR', None)
+    if not cache_dir:
+        return None
+    if layer == 'districts':
+        layer = 'districts-%s' % plan.pk
+    return os.path.join(cache_dir, get_current_city(), layer, str(z), str(x), '%d.json' % y)
+
+
+def save_tile(path, content):
+    """
+    Write a tile to a temporary file that then replaces any old one, so that
+    a half-written tile is never served.
+    """
+    tile_dir = os.path.dirname(path)
+    if not os.path.isdir(tile_dir):
+        try:
+            os.makedirs(tile_dir)
+        except OSError:
+            # Another process made it in the meantime.
+            pass
+
+    fd, temp_path = tempfile.mkstemp(dir=tile_dir)
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write(content)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+EMPTY_TILE = json.dumps({'type': 'FeatureCollection', 'features': []},
+                        separators=(',', ':'))
+
+
+def layer_extent(layer, plan=None, refresh=False):
+    """
+    The (west, south, east, north) extent of the layer's features in the
+    current city (of the plan's districts, for the district layer), or None
+    if it has none.  The extent is cached for TILE_CACHE_TIMEOUT, unless
+    refresh is true.
+    """
+    cache_key = 'tile_extent:%s:%s' % (layer, plan.pk if plan else '')
+    extent = None if refresh else cache.get(cache_key)
+    if extent is None:
+        if layer == 'districts':
+            extent = CouncilDistrict.objects.filter(plan=plan).extent()
+        else:
+            extent = city_locations().extent()
+        # An empty layer is cached as an empty tuple.
+        extent = tuple(extent or ())
+        cache.set(cache_key, extent, TILE_CACHE_TIMEOUT)
+    return extent or None
+
+
+def tile_in_extent(z, x, y, extent):
+    """
+    Whether the tile (with the margin that district shapes are clipped with)
+    overlaps the extent.
+    """
+    if extent is None:
+        return False
+    west, south, east, north = tile_bounds(z, x, y)
+    margin_x = (east - west) * CLIP_MARGIN
+    margin_y = (north - south) * CLIP_MARGIN
+    return (west - margin_x <= extent[2] and extent[0] <= east + margin_x and
+            south - margin_y <= extent[3] and extent[1] <= north + margin_y)
+
+
+def get_tile(layer, z, x, y, plan=None):
+    """
+    The tile's GeoJSON.  Tiles outside the layer's extent are empty.  Tiles
+    up to PRECOMPUTED_MAX_ZOOM come from the tile cache if they were saved
+    there less than TILE_CACHE_TIMEOUT ago, and are otherwise rendered and
+    saved; higher ones are cached in the Django cache.
+    """
+    if not tile_in_extent(z, x, y, layer_extent(layer, plan)):
+        return EMPTY_TILE
+
+    if z > PRECOMPUTED_MAX_ZOOM:
+        cache_key = 'tile:%s:%s:%d:%d:%d' % (layer, plan.pk if plan else '', z, x, y)
+        content = cache.get(cache_key)
+        if content is None:
+            content = render_tile(layer, z, x, y, plan)
+            cache.set(cache_key, content, TILE_CACHE_TIMEOUT)
+        return content
+
+    path = tile_path(layer, z, x, y, plan)
+    if path and os.path.exists(path) and \
+            time.time() - os.path.getmtime(path) < TILE_CACHE_TIMEOUT:
+        with open(path) as tile_file:
+            return tile_file.read()
+
+    content = render_tile(layer, z, x, y, plan)
+    if path:
+        save_tile(path, content)
+    return content
+
+
+class TileView (views.View):
+    """
+    Serve a GeoJSON tile of a layer of the request's city.  District tiles
+    show the plan in effect today, or the city's plan given by id in the
+    ``plan`` parameter.
+    """
+    max_age = 60 * 60
+
+    def get(self, request, layer, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if layer not in LAYERS or z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            raise Http404
+
+        plan = None
+        if layer == 'districts':
+            if request.GET.get('plan'):
+                try:
+                    plan = CouncilDistrictPlan.objects.get(pk=request.GET['plan'],
+                                                           city=get_current_city())
+                except (CouncilDistrictPlan.DoesNotExist, ValueError):
+                    raise Http404
+            else:
+                plan = current_plan()
+                if plan is None:
+                    raise Http404
+
+        response = HttpResponse(get_tile(layer, z, x, y, plan),
+                                content_type='application/json')
+        response['Cache-Control'] = 'public, max-age=%d' % self.max_age
+        return response
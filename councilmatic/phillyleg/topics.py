@@ -0,0 +1,126 @@
+"""
+Topic classification of legislation.
+
+``settings.TOPIC_CLASSIFIER`` is any callable that takes a title and returns
+a list of topic names.  A KeywordClassifier can be used for one: it compiles
+its rules into a single regular expression, so each title is scanned once
+for every keyword of every topic, and it classifies many titles at a time.
+The topics of a KeywordClassifier's titles are cached by title hash (and by a
+hash of the rules, so changing the rules starts afresh).
+
+This module is meant to be importable from a settings file, so it doesn't
+import the models or the cache at the top.
+"""
+
+import hashlib
+import re
+
+
+TOPIC_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class KeywordClassifier (object):
+    """
+    Classify titles by keywords: rules is a dict from each topic name to the
+    words or phrases that put a title in that topic.  Keywords match whole
+    words, regardless of case.
+
+        TOPIC_CLASSIFIER = KeywordClassifier({
+            'Zoning': ['zoning', 'overlay district', 'variance'],
+            'Budget': ['budget', 'appropriation', 'fiscal year'],
+        })
+    """
+    def __init__(self, rules):
+        self.topics_by_keyword = {}
+        for topic, keywords in rules.items():
+            for keyword in keywords:
+                keyword = ' '.join(keyword.lower().split())
+                self.topics_by_keyword.setdefault(keyword, set()).add(topic)
+
+        # The keywords are matched in a lookahead, which consumes nothing, so
+        # that the scan tries every word of a title, and finds the keywords
+        # within a longer phrase as well as the phrase.  At each word, the
+        # longest keyword that matches there is found, and it carries the
+        # topics of the keywords that it starts with.  Runs of white space in
+        # a title match the single spaces in a phrase.
+        keywords = sorted(self.topics_by_keyword, key=lambda keyword: (-len(keyword), keyword))
+        self.pattern = re.compile(
+            r'\b(?=(%s)\b)' % '|'.join(self.keyword_pattern(keyword)
+                                       for keyword in keywords),
+            re.IGNORECASE | re.UNICODE) if keywords else None
+
+        self.topics_by_match = dict((keyword, set()) for keyword in keywords)
+        for other in keywords:
+            starts = re.compile(self.keyword_pattern(other) + r'\b', re.UNICODE)
+            for keyword in keywords:
+                if starts.match(keyword):
+                    self.topics_by_match[keyword].update(self.topics_by_keyword[other])
+
+        self.signature = hashlib.sha1(repr(sorted(
+            (keyword, sorted(topics))
+            for keyword, topics in self.topics_by_keyword.items()))).hexdigest()[:12]
+
+    @staticmethod
+    def keyword_pattern(keyword):
+        return re.escape(keyword).replace(r'\ ', r'\s+')
+
+    def __call__(self, title):
+        return self.classify_many([title])[0]
+
+    def classify_many(self, titles):
+        """
+        The sorted list of topics of each title.
+        """
+        if self.pattern is None:
+            return [[] for title in titles]
+
+        results = []
+        for title in titles:
+            topics = set()
+            for keyword in self.pattern.findall(title):
+                topics.update(self.topics_by_match[' '.join(keyword.lower().split())])
+            results.append(sorted(topics))
+        return results
+
+
+def title_cache_key(signature, title):
+    if isinstance(title, unicode):
+        title = title.encode('utf-8')
+    return 'topics:%s:%s' % (signature, hashlib.sha1(title).hexdigest())
+
+
+def classify_titles(titles, classifier=None):
+    """
+    The list of topics of each title, by the given classifier or
+    ``settings.TOPIC_CLASSIFIER``.  Classifiers with a ``classify_many``
+    method get all of the titles that aren't cached at once; others are
+    called with each title.  Only classifiers with a ``signature`` that
+    changes along with their rules have their results cached.
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+
+    if classifier is None:
+        classifier = settings.TOPIC_CLASSIFIER
+    titles = list(titles)
+    signature = getattr(classifier, 'signature', None)
+
+    cached = {}
+    if signature is not None:
+        keys = dict((title_cache_key(signature, title), title) for title in titles)
+        cached = dict((keys[key], topics) for key, topics in cache.get_many(keys.keys()).items())
+
+    uncached = list(set(title for title in titles if title not in cached))
+    if hasattr(classifier, 'classify_many'):
+        classified = classifier.classify_many(uncached)
+    else:
+        classified = [list(classifier(title)) for title in uncached]
+    classified = dict(zip(uncached, classified))
+
+    if signature is not None and classified:
+        cache.set_many(dict((title_cache_key(signature, title), topics)
+                            for title, topics in classified.items()),
+                       TOPIC_CACHE_TIMEOUT)
+
+    classified.update(cached)
+    return [classified[title] for title in titles]
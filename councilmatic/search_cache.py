@@ -0,0 +1,187 @@
+"""
+Caching of search results.
+
+The same searches come in again and again: from the search page as it's paged
+through, from RSS readers polling the search's feed, and from subscribers'
+search feeds. The results of each search are cached as an ordered list of the
+keys of the objects it matched, under a key made from the search's normalized
+parameters, so that the search backend is asked once per search until the
+index is next updated.
+"""
+
+import hashlib
+import json
+from django.core.cache import cache
+
+from councilmatic.pagination import CURSOR_PARAM
+from phillyleg.search_indexes import StoredLegFile, get_index_version
+
+
+SEARCH_CACHE_TIMEOUT = 60 * 60
+"""The longest that search results are cached.  They're dropped sooner if the
+   search index is updated."""
+
+MAX_CACHED_RESULTS = 800
+"""The number of results to cache for each search.  Pages past these are
+   fetched from the search backend.  (This fits in one request to the backend
+   at the HAYSTACK_ITERATOR_LOAD_PER_QUERY in the sample settings.)"""
+
+IGNORED_PARAMS = ('page', CURSOR_PARAM)
+"""Parameters that don't change the results of a search.  Every page of a
+   search shares its cached results, and is sliced from them (see
+   CachedSearch.get_ids_after)."""
+
+
+def normalize_search_params(params):
+    """
+    Put a search's parameters (a QueryDict, such as request.GET, or a dict of
+    values or lists of values) into a canonical form, so that equivalent
+    searches look the same.  Paging and empty values are dropped, whitespace
+    is collapsed, and the parameters and their values are sorted.  Returns a
+    list of [name, [values]] pairs.
+    """
+    if hasattr(params, 'lists'):
+        items = params.lists()
+    else:
+        items = [(name, values if isinstance(values, (list, tuple)) else [values])
+                 for name, values in params.items()]
+
+    normalized = []
+    for name, values in items:
+        if name in IGNORED_PARAMS:
+            continue
+
+        values = set(u' '.join(unicode(value).split())
+                     for value in values if value is not None)
+        values.discard(u'')
+        if values:
+            normalized.append([name, sorted(values)])
+
+    return sorted(normalized)
+
+
+def search_cache_key(namespace, params):
+    """
+    The cache key for a search.  The namespace tells apart searches that are
+    built differently from the same parameters.  The key includes the index
+    version, so that updating the index invalidates every cached search.
+    """
+    search = json.dumps([namespace, normalize_search_params(params)])
+    return 'search:%s:%s' % (get_index_version(),
+                             hashlib.md5(search).hexdigest())
+
+
+def get_or_cache_search(namespace, params, getter_func):
+    """
+    Retrieve a value computed from a search's results from the cache, or cache
+    and return the value returned by running getter_func with no arguments.
+    """
+    cache_key = search_cache_key(namespace, params) + ':value'
+    val = cache.get(cache_key)
+    if val is None:
+        val = getter_func()
+        cache.set(cache_key, val, SEARCH_CACHE_TIMEOUT)
+    return val
+
+
+class CachedSearch (object):
+    """
+    The results of a search, as a list of ('app_label.model_name', key) pairs
+    in search order, along with the stored fields of the legislation among
+    them (so that cached pages can be listed without loading the objects).
+    The search is run (for the first MAX_CACHED_RESULTS results, and the total
+    count) the first time the results are needed, and is cached until the
+    index is updated.
+    """
+
+    def __init__(self, sqs, params, namespace='search'):
+        """
+        The search params (see normalize_search_params) should be the ones that
+        the search queryset was built from; they are what identify the search
+        in the cache.
+        """
+        self.sqs = sqs
+        self.cache_key = search_cache_key([namespace, sqs.query.order_by], params)
+        self._results = None
+
+    @property
+    def results(self):
+        if self._results is None:
+            self._results = cache.get(self.cache_key)
+            if self._results is None:
+                self._results = self.run()
+                cache.set(self.cache_key, self._results, SEARCH_CACHE_TIMEOUT)
+        return self._results
+
+    def run(self):
+        values = self.sqs.values('app_label', 'model_name', 'pk', *StoredLegFile.fields)
+
+        ids = []
+        stored = {}
+        for value in values[:MAX_CACHED_RESULTS]:
+            if value['pk'] is None:
+                continue
+
+            ids.append(('%s.%s' % (value['app_label'], value['model_name']), value['pk']))
+            if value['model_name'] == 'legfile' and value['title'] is not None:
+                stored[str(value['pk'])] = dict(
+                    (field, value[field]) for field in StoredLegFile.fields)
+
+        # The count comes back with the first batch of results, so this
+        # doesn't query the backend again.
+        return {'count': values.count(), 'ids': ids, 'stored': stored}
+
+    def count(self):
+        return self.results['count']
+
+    __len__ = count
+
+    def get_ids(self, start, stop):
+        """
+        The ids of the results from start up to stop, or None if those go past
+        the cached results.
+        """
+        count, ids = self.results['count'], self.results['ids']
+        stop = count if stop is None else min(stop, count)
+        if stop > len(ids):
+            return None
+        return ids[start:stop]
+
+    def get_ids_after(self, pk, count):
+        """
+        The ids of up to count results after the one with the given key, or
+        from the start if the key is None.  Returns None if the key isn't among
+        the cached results, or if the results asked for go past them.
+        """
+        start = 0
+        if pk is not None:
+            pks = [str(result_pk) for _, result_pk in self.results['ids']]
+            try:
+                start = pks.index(str(pk)) + 1
+            except ValueError:
+                return None
+        return self.get_ids(start, start + count)
+
+    def get_stored_objects(self, ids):
+        """
+        StoredLegFiles for the given result ids, or None if any of them
+        doesn't have its stored fields cached.
+        """
+        stored = self.results.get('stored', {})
+        try:
+            return [StoredLegFile.from_fields(stored[str(pk)]) for _, pk in ids]
+        except KeyError:
+            return None
+
+    def facet_counts(self, counter):
+        """
+        The facet counts for the search, as counted by calling counter with the
+        search queryset (see forms.facet_counts), cached along with the results.
+        """
+        cache_key = self.cache_key + ':facets'
+        counts = cache.get(cache_key)
+        if counts is None:
+            # Backends that don't do faceting give None; cache that too.
+            counts = {'counts': counter(self.sqs)}
+            cache.set(cache_key, counts, SEARCH_CACHE_TIMEOUT)
+        return counts['counts']
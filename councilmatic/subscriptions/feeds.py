@@ -6,15 +6,19 @@ from datetime import date, datetime
 from email.mime.text import MIMEText
 from logging import getLogger
 
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min, Q
 from django.db.models.manager import Manager
 from django.template import Context
 from django.template.loader import get_template
 from django.utils.encoding import smart_str, smart_unicode
 
 from models import ContentFeedRecord
+from models import ContentFeedIndexTerm
 from models import ContentFeedParameter
+from models import PendingFeedContent
 from models import Subscription
 from models import SubscriptionDispatchRecord
 
@@ -58,7 +62,7 @@ class ContentFeed (object):
         """
         Return a dictionary of keyword arguments that can be used to construct
         a feed identical to this one.  The values in the dictionary should be
-        strings only.
+        JSON-serializable.
         """
         raise NotImplementedError()
 
@@ -81,6 +85,23 @@ class ContentFeed (object):
         """
         raise NotImplementedError()
 
+    def get_index_terms(self):
+        """
+        Return a list of (field, value) terms that every content item in the
+        feed must have, most selective first.  An empty list means that every
+        item belongs in the feed.  Return None if the feed cannot be matched
+        against content item by item; those feeds are queried in full instead.
+        """
+        return None
+
+    @classmethod
+    def get_terms_for(cls, item):
+        """
+        Return the set of (field, value) terms that the given content item
+        has, in the same form as those returned by ``get_index_terms``.
+        """
+        raise NotImplementedError()
+
     class NotFound (Exception):
         pass
 
@@ -173,17 +194,40 @@ class ContentFeedLibrary (object):
 
         return record
 
+    def get_feed_name(self, ContentFeedClass):
+        """Retrieve the name that the given feed class is registered by."""
+        try:
+            return self._reverse[ContentFeedClass]
+        except KeyError:
+            raise ContentFeedClass.NotFound(
+                '%s is not registered in the library' %
+                (ContentFeedClass.__name__,))
+
+    def mark_stale(self, ContentFeedClass, **params):
+        """
+        Flag the records for feeds of the given class as needing to be
+        updated.  If any params are given, only the records whose parameters
+        have the given values are flagged.  Returns the number of records that
+        were newly flagged.
+        """
+        name = self.get_feed_name(ContentFeedClass)
+        records = ContentFeedRecord.objects.filter(feed_name=name, is_stale=False)
+        for param_name, param_value in params.items():
+            # Parameter values are stored canonically, so an exact match on
+            # the serialized value is enough.
+            records = records.filter(feed_params__name=param_name,
+                                     feed_params__value=param_value)
+
+        return records.update(is_stale=True)
+
 
 class ContentFeedRecordUpdater (object):
     """Responsible for updating the metadata in a content feed"""
 
     def update(self, record, library=None):
         """
-        Changes the last_updated of a legfiles feed to most recent intro date.
-
-        Iterate through each item (page) in the feed (book) and check when it
-        was last updated.  Be careful and don't use this as a matter of normal
-        course; it may be slow.
+        Changes the last_updated of a feed record to the latest time that the
+        feed's content was updated, and clears the record's stale flag.
         """
         if library is None:
             library = ContentFeedLibrary()
@@ -192,16 +236,28 @@ class ContentFeedRecordUpdater (object):
         if feed is None:
             return
 
-        all_content = feed.get_content()
-        latest = None
-        if all_content:
-            latest = feed.get_last_updated_time()
+        # Clear the flag before calculating, so that any change that comes in
+        # while we're working marks the record stale again.
+        ContentFeedRecord.objects.filter(pk=record.pk).update(is_stale=False)
+        record.is_stale = False
+
+        if record.index_terms.exists():
+            # Indexed feeds are updated as content is matched against them,
+            # so the latest match is the latest update.
+            latest = record.pending_content.aggregate(
+                latest=Max('matched_datetime'))['latest']
+        else:
+            try:
+                latest = feed.get_last_updated_time()
+            except (IndexError, ValueError):
+                # Feeds with no content fail to find a latest item.
+                latest = None
 
         if latest is None:
             latest = datetime.min
 
         record.last_updated = latest
-        record.save()
+        record.save(update_fields=['last_updated'])
 
     def update_all(self, records, library=None):
         """Updates all the feeds in a collection (yes, it's just a for loop)"""
@@ -209,6 +265,130 @@ class ContentFeedRecordUpdater (object):
             self.update(record, library)
 
 
+class ContentFeedPercolator (object):
+    """
+    Responsible for matching new content against the stored feeds, instead of
+    running every stored feed's query over all of the content.
+
+    Each feed record is indexed by one of the terms that all of its content
+    must have (see ``ContentFeed.get_index_terms``).  When a content item is
+    written, only the records indexed by one of the item's terms are checked,
+    and those that match have the item recorded as pending content.  Dispatch
+    then reads the pending content instead of querying the feed.
+    """
+
+    ANY = ('*', '*')
+    """The index term for feeds that every content item matches"""
+
+    def index(self, record, library=None):
+        """Add the given feed record to the reverse index."""
+        if library is None:
+            library = ContentFeedLibrary()
+
+        if record.feed_name not in library.feeds:
+            return
+
+        feed = library.get_feed(record)
+        if feed is None:
+            return
+
+        terms = feed.get_index_terms()
+        if terms is None:
+            return
+
+        field, value = terms[0] if terms else self.ANY
+        record.index_terms.all().delete()
+        ContentFeedIndexTerm.objects.create(
+            feed_record=record, field=field, value=value[:256])
+
+    def match(self, ContentFeedClass, item, library=None):
+        """
+        Return the indexed records of the given feed class that the content
+        item matches.
+        """
+        if library is None:
+            library = ContentFeedLibrary()
+
+        item_terms = set(ContentFeedClass.get_terms_for(item))
+
+        terms_by_field = defaultdict(set)
+        for field, value in item_terms | set([self.ANY]):
+            terms_by_field[field].add(value[:256])
+
+        term_filter = Q()
+        for field, values in terms_by_field.items():
+            term_filter |= Q(field=field, value__in=values)
+
+        record_ids = ContentFeedIndexTerm.objects.filter(term_filter)\
+            .values_list('feed_record', flat=True)
+        candidates = ContentFeedRecord.objects\
+            .filter(pk__in=record_ids, feed_name=library.get_feed_name(ContentFeedClass))\
+            .prefetch_related('feed_params')
+
+        matches = []
+        for record in candidates:
+            feed = library.get_feed(record)
+            if feed is not None and set(feed.get_index_terms()) <= item_terms:
+                matches.append(record)
+        return matches
+
+    def percolate(self, ContentFeedClass, item, library=None):
+        """
+        Record the given content item as pending for every indexed record of
+        the given feed class that the item matches.  Returns the list of
+        matching records.
+        """
+        matches = self.match(ContentFeedClass, item, library)
+
+        if matches:
+            now = datetime.now()
+            content_type = ContentType.objects.get_for_model(item)
+            for record in matches:
+                # Content that is already pending has changed again, so it is
+                # pending as of now.
+                pending, created = PendingFeedContent.objects.get_or_create(
+                    feed_record=record, content_type=content_type,
+                    content_id=item.pk, defaults={'matched_datetime': now})
+                if not created:
+                    PendingFeedContent.objects.filter(pk=pending.pk)\
+                        .update(matched_datetime=now)
+
+            ContentFeedRecord.objects.filter(pk__in=[r.pk for r in matches])\
+                .update(last_updated=now, is_stale=False)
+
+        return matches
+
+    def mark_stale(self, ContentFeedClass, item, library=None):
+        """
+        Flag the records of the given feed class that the content item may
+        have changed: the indexed records that it matches, and the records
+        that aren't indexed (which can't be matched without running their
+        queries).  Returns the number of records that were newly flagged.
+        """
+        if library is None:
+            library = ContentFeedLibrary()
+
+        matches = self.match(ContentFeedClass, item, library)
+        records = ContentFeedRecord.objects.filter(
+            feed_name=library.get_feed_name(ContentFeedClass), is_stale=False)
+
+        unindexed = records.filter(index_terms__isnull=True)
+        matched = records.filter(pk__in=[record.pk for record in matches])
+        return unindexed.update(is_stale=True) + matched.update(is_stale=True)
+
+    def get_pending_content(self, record, since):
+        """
+        Return the content items that were matched to the record after the
+        given time, or None if the record is not indexed.
+        """
+        if not record.index_terms.exists():
+            return None
+
+        pending = record.pending_content.filter(matched_datetime__gt=since)\
+            .prefetch_related('content')
+        return [p.content for p in pending if p.content is not None]
+
+
 class ContentFeedRecordCleaner (object):
     """Responsible for identifying and removing all unused feeds"""
 
@@ -221,6 +401,15 @@ class ContentFeedRecordCleaner (object):
         used_record_ids = Subscription.objects.values('feed_record__id').distinct()
         ContentFeedRecord.objects.exclude(id__in=used_record_ids).delete()
 
+        # Pending content that has been sent to every subscriber of a feed
+        # is no longer pending.
+        sent_times = Subscription.objects.values('feed_record')\
+            .annotate(sent=Min('last_sent'))
+        for sent_time in sent_times:
+            PendingFeedContent.objects.filter(
+                feed_record=sent_time['feed_record'],
+                matched_datetime__lte=sent_time['sent']).delete()
+
 
 class SubscriptionDispatcher (object):
     """
@@ -254,6 +443,7 @@ class SubscriptionDispatcher (object):
         log.debug('Checking for updates to %s in %s' % (subscriptions, library))
 
         content_changes = defaultdict(lambda: [dict(), datetime.min])
+        percolator = ContentFeedPercolator()
 
         for subscription in subscriptions:
             feed = library.get_feed(subscription.feed_record)
@@ -262,7 +452,12 @@ class SubscriptionDispatcher (object):
             # was last sent (this assumes that the feed_record has been
             # updated to accurately represent the feed).
             if subscription.last_sent < subscription.feed_record.last_updated:
-                new_contents = feed.get_updates_since(subscription.last_sent)
+                # Prefer the content that was matched to the feed as it was
+                # written over running the feed's query.
+                new_contents = percolator.get_pending_content(
+                    subscription.feed_record, subscription.last_sent)
+                if new_contents is None:
+                    new_contents = feed.get_updates_since(subscription.last_sent)
 
                 for item in new_contents:
                     changes, change_time = feed.get_changes_to(item, subscription.last_sent)
@@ -1,29 +1,77 @@
-import pickle
+import json
 
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
 from django.db.models import fields
-from django.db.models.fields.subclassing import SubfieldBase
+from django.db.models.query import QuerySet
+
+
+def serialize(value):
+    """
+    Encode a value as canonical JSON.  Keys are sorted and separators are
+    compact, so two equal values always encode to exactly the same string.
+    That lets us compare, look up, and index serialized values directly in
+    the database.
+    """
+    return json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True,
+                      separators=(',', ':'))
+
+
+def deserialize(value):
+    return json.loads(value)
+
 
 class SerializedObjectField(fields.TextField):
+    """
+    Stores any JSON-serializable value.  Values are decoded as they're loaded
+    from the database, by the querysets of SerializedObjectManager (so a model
+    with the field should use that manager); values assigned in Python are
+    left as they are, so assigning the string '123' doesn't give you 123.
+    """
     description = "SerializedObject"
-    __metaclass__ = SubfieldBase
 
     def get_internal_type(self):
         return "TextField"
 
     @classmethod
     def get_prep_value(cls, value):
-        return pickle.dumps(value)
+        return serialize(value)
+
+    def to_python_from_db(self, value):
+        if not isinstance(value, basestring):
+            return value
 
-    def to_python(self, value):
         try:
-            return pickle.loads(str(value))
+            return deserialize(value)
 
-        # Assume that, if we get an error either in the string conversion or in
-        # the unpickling of that string, we mean that this is the exact value we
-        # want.
-        except:
+        # Assume that, if we get an error decoding the string, we mean that
+        # this is the exact value we want.
+        except ValueError:
             return value
 
+
+class SerializedObjectQuerySet(QuerySet):
+    """Decodes the SerializedObjectFields of the objects that it loads"""
+
+    def iterator(self):
+        serialized_fields = [field for field in self.model._meta.fields
+                             if isinstance(field, SerializedObjectField)]
+
+        for obj in super(SerializedObjectQuerySet, self).iterator():
+            for field in serialized_fields:
+                # Deferred fields aren't loaded yet.
+                if field.attname in obj.__dict__:
+                    obj.__dict__[field.attname] = \
+                        field.to_python_from_db(obj.__dict__[field.attname])
+            yield obj
+
+
+class SerializedObjectManager(models.Manager):
+    use_for_related_fields = True
+
+    def get_query_set(self):
+        return SerializedObjectQuerySet(self.model, using=self._db)
+
 #
 # This little bit of magic is here because I tried to migrate with a
 # SerializedObjectField, and got an error that directed me to
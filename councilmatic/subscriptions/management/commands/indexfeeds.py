@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from councilmatic.subscriptions.feeds import import_all_feeds
+from councilmatic.subscriptions.feeds import ContentFeedPercolator
+from councilmatic.subscriptions.models import ContentFeedRecord
+
+
+class Command(BaseCommand):
+    help = "Rebuild the index used to match new content against the subscribed feeds."
+
+    def get_records(self):
+        records = ContentFeedRecord.objects.filter(subscription__isnull=False)\
+            .distinct().prefetch_related('feed_params')
+        return records
+
+    def handle(self, *args, **options):
+        # Make sure that the library knows about all the types of feeds.
+        import_all_feeds()
+
+        percolator = ContentFeedPercolator()
+        for record in self.get_records():
+            percolator.index(record)
@@ -3,6 +3,7 @@ from django.core.management.base import BaseCommand, CommandError
 from councilmatic.subscriptions.feeds import import_all_feeds
 from councilmatic.subscriptions.feeds import SubscriptionEmailer
 from councilmatic.subscriptions.models import Subscriber
+from utils.querysets import iter_chunked, Progress
 
 class Command(BaseCommand):
     help = "Send a digest of the new items in the users' subscription lists."
@@ -14,5 +15,7 @@ class Command(BaseCommand):
         dispatcher = SubscriptionEmailer()
 
         subscribers = Subscriber.objects.all()
-        for subscriber in subscribers:
+        progress = Progress('Subscribers sent to', total=subscribers.count())
+        for subscriber in iter_chunked(subscribers, progress=progress):
             dispatcher.dispatch_subscriptions_for(subscriber)
+        progress.done()
@@ -3,10 +3,11 @@ from django.core.management.base import BaseCommand, CommandError
 from councilmatic.subscriptions.feeds import import_all_feeds
 from councilmatic.subscriptions.feeds import SubscriptionEmailer
 from councilmatic.subscriptions.models import Subscriber, User
+from utils.querysets import iter_chunked
 
 class Command(BaseCommand):
     help = "Create subscribers for all those users that don't have one."
 
     def handle(self, *args, **options):
-        for user in User.objects.all():
+        for user in iter_chunked(User.objects.all()):
             Subscriber.objects.get_or_create_for_user(user)
@@ -1,21 +1,36 @@
 from django.core.management.base import BaseCommand, CommandError
+import optparse
 
 from councilmatic.subscriptions.feeds import import_all_feeds
 from councilmatic.subscriptions.feeds import ContentFeedRecordUpdater
 from councilmatic.subscriptions.models import ContentFeedRecord
+from utils.querysets import iter_chunked, Progress
 
 
 class Command(BaseCommand):
     help = "Update the meta-information for the subscription content feeds."
+    option_list = BaseCommand.option_list + (
+            optparse.make_option('--stale',
+                action='store_true',
+                dest='stale_only',
+                default=False,
+                help='Only update the feeds whose content has changed since they were last updated'),
+            )
 
-    def get_records(self):
+    def get_records(self, stale_only=False):
         records = ContentFeedRecord.objects.all()
+        if stale_only:
+            records = records.filter(is_stale=True)
         return records
 
     def handle(self, *args, **options):
         # Make sure that the library knows about all the types of feeds.
         import_all_feeds()
 
-        records = self.get_records()
+        # Read the records a chunk at a time, so that memory use doesn't grow
+        # with the number of feeds.
+        records = self.get_records(options.get('stale_only', False))
+        progress = Progress('Feeds updated', total=records.count())
         updater = ContentFeedRecordUpdater()
-        updater.update_all(records)
+        updater.update_all(iter_chunked(records, progress=progress))
+        progress.done()
@@ -9,7 +9,7 @@ from django.db import transaction, DatabaseError, IntegrityError
 from django.utils.translation import ugettext as _
 import haystack.query as haystack
 
-from councilmatic.subscriptions.fields import SerializedObjectField
+from councilmatic.subscriptions.fields import SerializedObjectField, SerializedObjectManager
 
 log = logging.getLogger(__name__)
 
@@ -18,8 +18,9 @@ class ContentFeedRecord (models.Model):
     """
     Stores information necessary for retrieving a content feed.
 
-    The query for the ``ContentFeed`` is stored as a pickled iterable object.
-    Don't judge me!!! Calling ``get_content`` on a ``ContentFeed`` will return
+    The parameters for the ``ContentFeed`` are stored as canonical JSON, so
+    equivalent feeds have byte-for-byte equal parameter values. Calling
+    ``get_content`` on a ``ContentFeed`` will return
     you the results of the query. Calling ``get_last_updated`` will return you
     the last time the given set of content was updated.
 
@@ -44,6 +45,10 @@ class ContentFeedRecord (models.Model):
     last_updated = models.DateTimeField(default=datetime.datetime.min)
     """The stored value of the last time content in the feed was updated."""
 
+    is_stale = models.BooleanField(default=True, db_index=True)
+    """Whether content in the feed may have changed since last_updated was
+       calculated."""
+
     def __unicode__(self):
         string = u'a %s feed: ' % (self.feed_name,)
         params = ['%s = %s' % (p.name, p.value) for p in self.feed_params.all()]
@@ -67,7 +72,32 @@ class ContentFeedParameter (models.Model):
 
     feed_record = models.ForeignKey(ContentFeedRecord, related_name='feed_params')
     name = models.CharField(max_length=256)
-    value = models.TextField()
+    value = SerializedObjectField()
+
+    objects = SerializedObjectManager()
+
+
+class ContentFeedIndexTerm (models.Model):
+    """An entry in the reverse index of feeds; the feed record will only
+       contain content items that have the given term"""
+
+    feed_record = models.ForeignKey(ContentFeedRecord, related_name='index_terms')
+    field = models.CharField(max_length=64)
+    value = models.CharField(max_length=256, db_index=True)
+
+
+class PendingFeedContent (models.Model):
+    """A content item that was matched to a feed as it was written, and that
+       has yet to be dispatched to the feed's subscribers"""
+
+    feed_record = models.ForeignKey(ContentFeedRecord, related_name='pending_content')
+    content_type = models.ForeignKey(ContentType)
+    content_id = models.PositiveIntegerField()
+    content = generic.GenericForeignKey('content_type', 'content_id')
+    matched_datetime = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = (('feed_record', 'content_type', 'content_id'),)
 
 
 # Subscriber
@@ -195,6 +225,21 @@ class Subscription (models.Model):
         super(Subscription, self).save(*args, **kwargs)
 
 
+@receiver(post_save, sender=Subscription)
+def index_subscribed_feed_record(sender, **kwargs):
+    """
+    Add the feed record of a new subscription to the reverse index of feeds,
+    so that new content can be matched against it.
+    """
+    subscription = kwargs.get('instance')
+    created = kwargs.get('created')
+    raw = kwargs.get('raw')
+
+    if created and not raw:
+        from feeds import ContentFeedPercolator
+        ContentFeedPercolator().index(subscription.feed_record)
+
+
 class SubscriptionDispatchRecord (models.Model):
     """Records a subscription delivery"""
 
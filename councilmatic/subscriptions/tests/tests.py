@@ -2,7 +2,6 @@
 """
 
 import datetime
-import pickle
 
 from django.test import TestCase
 from logging import getLogger
@@ -12,12 +11,14 @@ from nose.tools import *
 
 from councilmatic.subscriptions.feeds import ContentFeed
 from councilmatic.subscriptions.feeds import ContentFeedLibrary
+from councilmatic.subscriptions.feeds import ContentFeedPercolator
 from councilmatic.subscriptions.feeds import ContentFeedRecordCleaner
 from councilmatic.subscriptions.feeds import ContentFeedRecordUpdater
 from councilmatic.subscriptions.feeds import SubscriptionDispatcher
 from councilmatic.subscriptions.forms import SubscriptionForm
 from councilmatic.subscriptions.models import ContentFeedParameter
 from councilmatic.subscriptions.models import ContentFeedRecord
+from councilmatic.subscriptions.models import PendingFeedContent
 from councilmatic.subscriptions.models import Subscriber
 from councilmatic.subscriptions.models import Subscription
 from councilmatic.subscriptions.models import SerializedObjectField
@@ -290,6 +291,145 @@ class Test_ContentFeedUpdater_updateAll (TestCase):
         assert_equal(self.feeds[0].get_last_updated_time.call_count, 1)
 
 
+class Test_ContentFeedUpdater_update_staleness (TestCase):
+
+    def setUp(self):
+        library = self.library = ContentFeedLibrary(shared=False)
+        library.register(ListItemFeed, 'list feed')
+
+        self.feed = ListItemFeed("['hello']")
+        self.record = library.get_record(self.feed)
+
+    @istest
+    def clears_the_stale_flag_on_the_record(self):
+        assert_true(self.record.is_stale)
+
+        updater = ContentFeedRecordUpdater()
+        updater.update(self.record, self.library)
+
+        record = ContentFeedRecord.objects.get(pk=self.record.pk)
+        assert_false(record.is_stale)
+
+
+class Test_ContentFeedLibrary_markStale (TestCase):
+
+    def setUp(self):
+        ContentFeedRecord.objects.all().delete()
+
+        library = self.library = ContentFeedLibrary(shared=False)
+        library.register(ListItemFeed, 'list feed')
+
+        self.feeds = [ ListItemFeed("['hello']"),
+                       ListItemFeed("['world']") ]
+        self.feed_records = [library.get_record(feed) for feed in self.feeds]
+        ContentFeedRecord.objects.all().update(is_stale=False)
+
+    @istest
+    def marks_all_records_for_the_feed_class_without_params(self):
+        count = self.library.mark_stale(ListItemFeed)
+
+        assert_equal(count, 2)
+        assert_equal(ContentFeedRecord.objects.filter(is_stale=True).count(), 2)
+
+    @istest
+    def marks_only_records_with_matching_params(self):
+        count = self.library.mark_stale(ListItemFeed, items="['hello']")
+
+        assert_equal(count, 1)
+        stale = ContentFeedRecord.objects.get(is_stale=True)
+        assert_equal(stale.pk, self.feed_records[0].pk)
+
+    @istest
+    def raises_NotFound_when_feed_is_not_registered(self):
+        class BogusFeed(ContentFeed):
+            pass
+
+        assert_raises(BogusFeed.NotFound, self.library.mark_stale, BogusFeed)
+
+
+class WordFeed (ContentFeed):
+    def __init__(self, words):
+        self.words = words
+
+    def get_params(self):
+        return {'words': self.words}
+
+    def get_index_terms(self):
+        return [('word', word) for word in self.words.split()]
+
+    @classmethod
+    def get_terms_for(cls, legfile):
+        return set(('word', word) for word in legfile.title.split())
+
+
+class Test_ContentFeedPercolator_percolate (TestCase):
+
+    def setUp(self):
+        LegFile.objects.all().delete()
+        ContentFeedRecord.objects.all().delete()
+
+        library = self.library = ContentFeedLibrary(shared=False)
+        library.register(WordFeed, 'word feed')
+
+        self.matching = library.get_record(WordFeed('zoning board'))
+        self.missing = library.get_record(WordFeed('zoning taxes'))
+
+        self.percolator = ContentFeedPercolator()
+        self.percolator.index(self.matching, library)
+        self.percolator.index(self.missing, library)
+
+        self.legfile = LegFile.objects.create(key=1, title='zoning board appeal')
+
+    @istest
+    def records_pending_content_only_for_matching_feeds(self):
+        matches = self.percolator.percolate(WordFeed, self.legfile, self.library)
+
+        assert_equal([record.pk for record in matches], [self.matching.pk])
+        assert_equal(PendingFeedContent.objects.filter(feed_record=self.matching).count(), 1)
+        assert_equal(PendingFeedContent.objects.filter(feed_record=self.missing).count(), 0)
+
+    @istest
+    def makes_matched_content_available_for_dispatch(self):
+        before = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        self.percolator.percolate(WordFeed, self.legfile, self.library)
+
+        pending = self.percolator.get_pending_content(self.matching, before)
+
+        assert_equal(pending, [self.legfile])
+
+    @istest
+    def refreshes_the_match_time_of_content_that_matches_again(self):
+        self.percolator.percolate(WordFeed, self.legfile, self.library)
+        first_matched = datetime.datetime.now() - datetime.timedelta(days=1)
+        PendingFeedContent.objects.all().update(matched_datetime=first_matched)
+
+        self.percolator.percolate(WordFeed, self.legfile, self.library)
+
+        pending = PendingFeedContent.objects.get(feed_record=self.matching)
+        assert_greater(pending.matched_datetime, first_matched)
+
+    @istest
+    def returns_None_as_pending_content_for_unindexed_records(self):
+        library = ContentFeedLibrary(shared=False)
+        library.register(ListItemFeed, 'list feed')
+        record = library.get_record(ListItemFeed('[1]'))
+
+        pending = self.percolator.get_pending_content(record, datetime.datetime.min)
+
+        assert_is_none(pending)
+
+    @istest
+    def marks_only_matching_and_unindexed_records_stale(self):
+        unindexed = self.library.get_record(WordFeed('city hall'))
+        ContentFeedRecord.objects.all().update(is_stale=False)
+
+        count = self.percolator.mark_stale(WordFeed, self.legfile, self.library)
+
+        assert_equal(count, 2)
+        stale = ContentFeedRecord.objects.filter(is_stale=True).order_by('pk')
+        assert_equal([record.pk for record in stale], [self.matching.pk, unindexed.pk])
+
+
 class Test_ContentFeedCleaner_clean (TestCase):
 
     def setUp(self):
@@ -323,15 +463,62 @@ class Test_ContentFeedCleaner_clean (TestCase):
         assert_not_in(self.tosser, feed_records)
 
 
-class Test_SerializedObjectField_toPython (TestCase):
+class Test_SerializedObjectField_toPythonFromDb (TestCase):
+
+    def test_decodes_json_strings(self):
+        field = SerializedObjectField()
+
+        result = field.to_python_from_db(u'{"q":"zoning","sponsors":["Jones"]}')
+
+        self.assertEqual(result, {'q': 'zoning', 'sponsors': ['Jones']})
 
-    def test_converts_unicode_strings_to_nonunicode_before_loading(self):
-        pickled_list = u'(lp0\n.'
+    def test_returns_undecodable_strings_unchanged(self):
         field = SerializedObjectField()
 
-        result = field.to_python(pickled_list)
+        result = field.to_python_from_db(u'(lp0\n.')
+
+        self.assertEqual(result, u'(lp0\n.')
+
+
+class Test_SerializedObjectField_roundTrip (TestCase):
+
+    def setUp(self):
+        ContentFeedRecord.objects.all().delete()
+        self.record = ContentFeedRecord.objects.create(feed_name='word feed')
+
+    def test_leaves_assigned_strings_alone(self):
+        param = ContentFeedParameter(feed_record=self.record, name='words')
+
+        param.value = '123'
+
+        self.assertEqual(param.value, '123')
+
+    def test_loads_numeric_looking_strings_as_strings(self):
+        ContentFeedParameter.objects.create(feed_record=self.record, name='words', value='123')
+        ContentFeedParameter.objects.create(feed_record=self.record, name='count', value=123)
+
+        values = dict((param.name, param.value)
+                      for param in self.record.feed_params.all())
+
+        self.assertEqual(values, {'words': '123', 'count': 123})
+
+
+class Test_SerializedObjectField_getPrepValue (TestCase):
+
+    def test_encodes_equal_values_to_equal_strings(self):
+        first = {'q': 'zoning', 'sponsors': ['Jones'], 'statuses': 'Passed'}
+        second = {}
+        second['statuses'] = 'Passed'
+        second['sponsors'] = ['Jones']
+        second['q'] = 'zoning'
+
+        self.assertEqual(SerializedObjectField.get_prep_value(first),
+                         SerializedObjectField.get_prep_value(second))
+
+    def test_encodes_compactly(self):
+        result = SerializedObjectField.get_prep_value({'b': 1, 'a': [1, 2]})
 
-        self.assertEqual(result, [])
+        self.assertEqual(result, '{"a":[1,2],"b":1}')
 
 
 class Test_SingleSubscriptionMixin_getContextData:
@@ -7,6 +7,7 @@ admin.autodiscover()
 
 from django.views.generic import ListView, DetailView, TemplateView
 import phillyleg.models
+import phillyleg.tiles
 
 import subscriptions.views
 import bookmarks.views
@@ -15,6 +16,7 @@ import opinions.views
 
 from . import views
 from . import api
+from . import export
 
 urlpatterns = patterns(
     '',
@@ -95,6 +97,16 @@ urlpatterns = patterns(
 
     url(r'^api/', include(api.router.urls)),
 
+    # Bulk export, e.g. export/legislation.ndjson?since=2013-06-01
+    url(r'^export/(?P<table>\w+)\.(?P<format>\w+)$',
+        export.ExportView.as_view(),
+        name='export'),
+
+    # Map tiles, e.g. tiles/districts/12/1192/1550.json
+    url(r'^tiles/(?P<layer>\w+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.json$',
+        phillyleg.tiles.TileView.as_view(),
+        name='tile'),
+
     # url(r'^api/v2/subscribers/(?P<pk>\d+)$',
     #     api.SubscriberView.as_view(),
     #     name='api_subscriber_instance'),
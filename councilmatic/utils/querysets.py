@@ -0,0 +1,106 @@
+"""
+Memory-bounded iteration over large querysets.
+
+Iterating over a queryset caches every row in memory until the loop is done,
+and ``iterator()`` still has the database driver read the whole result at
+once.  These helpers read a queryset in key order, a chunk of rows at a time,
+selecting each chunk by the last key of the one before (keyset paging), so
+memory use depends on the chunk size and not on the size of the table, and
+deep chunks cost no more than shallow ones.
+"""
+
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+def iter_key_chunks(queryset, chunk_size, after=None):
+    """
+    Generate lists of primary keys from the queryset, in key order.  Each
+    chunk is selected by the last key of the previous one, so deep chunks
+    cost no more than shallow ones.
+    """
+    keys = queryset.order_by('pk').values_list('pk', flat=True)
+    while True:
+        chunk_keys = keys if after is None else keys.filter(pk__gt=after)
+        chunk = list(chunk_keys[:chunk_size])
+        if not chunk:
+            break
+
+        yield chunk
+        after = chunk[-1]
+
+
+def iter_chunks(queryset, chunk_size=1000, only=None, fields=None, flat=False,
+                after=None):
+    """
+    Generate lists of the queryset's objects, in key order, chunk_size at a
+    time.  The queryset's filters and select_related/prefetch_related apply
+    to each chunk.  Give only to load just those fields of each object, or
+    fields to get ``values_list`` tuples (or single values, with flat)
+    instead of objects.
+    """
+    for keys in iter_key_chunks(queryset, chunk_size, after):
+        chunk = queryset.filter(pk__in=keys).order_by('pk')
+        if only is not None:
+            chunk = chunk.only(*only)
+        if fields is not None:
+            chunk = chunk.values_list(*fields, flat=flat)
+        yield list(chunk)
+
+
+def iter_chunked(queryset, chunk_size=1000, only=None, fields=None, flat=False,
+                 progress=None):
+    """
+    Generate the queryset's objects (or values) one at a time, reading them
+    a chunk at a time (see iter_chunks).  If given, progress (a Progress) is
+    told about each chunk once its objects have been handled.
+    """
+    for chunk in iter_chunks(queryset, chunk_size, only, fields, flat):
+        for item in chunk:
+            yield item
+        if progress is not None:
+            progress.add(len(chunk))
+
+
+class Progress (object):
+    """
+    Report how many items have been handled, and how fast, to a stream (e.g.,
+    a command's stdout) or else to the log, at most every interval seconds.
+    """
+    def __init__(self, label, stream=None, total=None, interval=10):
+        self.label = label
+        self.stream = stream
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.start = self.last_report = time.time()
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.count / elapsed if elapsed else 0
+
+    def add(self, count):
+        self.count += count
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.time()
+        if self.total is not None:
+            message = '%s: %d of %d (%.1f/s)' % (self.label, self.count, self.total, self.rate)
+        else:
+            message = '%s: %d (%.1f/s)' % (self.label, self.count, self.rate)
+
+        if self.stream is not None:
+            self.stream.write(message + '\n')
+        else:
+            log.info(message)
+
+    def done(self):
+        """
+        Report the final count, however recently progress was reported.
+        """
+        self.report()
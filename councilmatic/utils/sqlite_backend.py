@@ -0,0 +1,679 @@
+"""
+A haystack search backend that keeps the index in a SQLite database, using
+SQLite's FTS5 full-text search extension.
+
+It is meant for deployments that are too big for Whoosh but too small to be
+worth running Solr.  To use it, set your haystack connection's ENGINE to
+'utils.sqlite_backend.SQLiteEngine' and its PATH to the file to keep the index
+in.
+
+Each indexed document is split three ways:
+
+* Indexed text fields become columns of an FTS5 table.
+* Date, number and boolean fields become ordinary columns of a documents
+  table, so that they can be filtered by range and sorted on.
+* Facet fields (the ``*_exact`` fields that haystack makes for fields with
+  ``faceted=True``) become rows of a facets table, so that they can be
+  counted.
+
+Searches are translated into a SQL condition on the documents table, with
+full-text filters as sub-queries on the FTS5 table.  Results come back in
+the order asked for, or in the order they were indexed; there is no relevance
+scoring.  Highlighting, spelling suggestions, date and query facets, more-like-
+this and spatial searches aren't supported.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import warnings
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.loading import get_model
+from django.utils.encoding import force_unicode
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.constants import ID, DJANGO_CT, DJANGO_ID
+from haystack.exceptions import MissingDependency, SearchBackendError
+from haystack.fields import FacetField
+from haystack.inputs import Clean, PythonData
+from haystack.models import SearchResult
+from haystack.utils import get_identifier
+
+log = logging.getLogger(__name__)
+
+COLUMN_TYPES = {
+    'date': 'TEXT',
+    'datetime': 'TEXT',
+    'integer': 'INTEGER',
+    'float': 'REAL',
+    'boolean': 'INTEGER',
+}
+"""The kinds of fields that are stored in columns, and their column types"""
+
+EXACT_MATCH_RE = re.compile(r'"(.*?)"')
+WORD_RE = re.compile(r'\w', re.UNICODE)
+
+
+def sql_literal(value):
+    """
+    Quote a value for use in a SQL statement.  Queries are passed from the
+    query object to the backend as strings, so values can't be bound as
+    parameters.
+    """
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, bool):
+        return '1' if value else '0'
+    elif isinstance(value, (int, long, float)):
+        return repr(value)
+    else:
+        value = force_unicode(value).replace(u'\x00', u'')
+        return u"'%s'" % value.replace(u"'", u"''")
+
+
+def fts_phrase(text, prefix=False):
+    """
+    Quote text as an FTS5 phrase.  Everything inside the quotes is taken
+    literally, so user input can't be mistaken for query syntax.
+    """
+    phrase = u'"%s"' % force_unicode(text).replace(u'"', u'""')
+    return phrase + u' *' if prefix else phrase
+
+
+def parse_auto_query(query_string):
+    """
+    Split a user's query into the phrases that must and must not match.  Bits
+    in double quotes are phrases; words starting with a '-' are excluded.
+    Returns a pair of lists: (required phrases, excluded phrases).
+    """
+    required, excluded = [], []
+
+    # Splitting on the quoted bits alternates between unquoted and quoted.
+    for position, bit in enumerate(EXACT_MATCH_RE.split(query_string)):
+        if position % 2:
+            required.append(bit)
+            continue
+
+        for word in bit.split():
+            if word.startswith('-') and len(word) > 1:
+                excluded.append(word[1:])
+            else:
+                required.append(word)
+
+    # Bits without any word characters can't match anything.
+    return ([bit for bit in required if WORD_RE.search(bit)],
+            [bit for bit in excluded if WORD_RE.search(bit)])
+
+
+class SQLiteSearchBackend (BaseSearchBackend):
+    DOCUMENTS_TABLE = 'haystack_documents'
+    TEXT_TABLE = 'haystack_text'
+    FACETS_TABLE = 'haystack_facets'
+    SCHEMA_TABLE = 'haystack_schema'
+
+    def __init__(self, connection_alias, **connection_options):
+        super(SQLiteSearchBackend, self).__init__(connection_alias, **connection_options)
+        self.path = connection_options.get('PATH')
+        self.setup_complete = False
+
+        if not self.path:
+            raise ImproperlyConfigured("You must specify a 'PATH' in your settings for connection '%s'." % connection_alias)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def setup(self):
+        """
+        Create the index tables if they don't exist yet, and make sure they
+        match the fields of the search indexes.
+        """
+        from haystack import connections
+        fields = connections[self.connection_alias].get_unified_index().all_searchfields()
+        self.build_schema(fields)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self.connect()
+        try:
+            try:
+                conn.execute('CREATE VIRTUAL TABLE temp.fts5_check USING fts5(x)')
+            except sqlite3.OperationalError:
+                raise MissingDependency("The 'sqlite' search backend requires a SQLite library with the FTS5 extension.")
+
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(self.schema_sql())
+
+            signature = json.dumps([self.text_fields, self.column_fields, self.facet_fields])
+            row = conn.execute('SELECT signature FROM %s' % self.SCHEMA_TABLE).fetchone()
+            if row is None:
+                with conn:
+                    conn.execute('INSERT INTO %s (signature) VALUES (?)' % self.SCHEMA_TABLE, (signature,))
+            elif row[0] != signature:
+                raise SearchBackendError("The fields of the search indexes have changed since the index at '%s' was built; run rebuild_index." % self.path)
+        finally:
+            conn.close()
+
+        self.setup_complete = True
+
+    def build_schema(self, fields):
+        """
+        Sort the fields into full-text, column and facet fields.
+        """
+        self.fields = {}
+        self.text_fields = []
+        self.column_fields = []
+        self.facet_fields = []
+        self.content_field_name = None
+
+        for field_name, field_class in sorted(fields.items()):
+            name = field_class.index_fieldname
+            self.fields[name] = field_class
+
+            if isinstance(field_class, FacetField):
+                self.facet_fields.append(name)
+            elif field_class.field_type in COLUMN_TYPES and not field_class.is_multivalued:
+                self.column_fields.append(name)
+            elif field_class.indexed:
+                self.text_fields.append(name)
+
+            if field_class.document is True:
+                self.content_field_name = name
+
+        if not self.text_fields:
+            raise SearchBackendError("No fields were found in any search_indexes. Please correct this before attempting to search.")
+
+    def schema_sql(self):
+        columns = ''.join(', "f_%s" %s' % (name, COLUMN_TYPES[self.fields[name].field_type])
+                          for name in self.column_fields)
+        column_indexes = ''.join(
+            'CREATE INDEX IF NOT EXISTS "%s_%s" ON %s ("f_%s");\n' %
+            (self.DOCUMENTS_TABLE, name, self.DOCUMENTS_TABLE, name)
+            for name in self.column_fields if self.fields[name].indexed)
+
+        return '''
+            CREATE TABLE IF NOT EXISTS %(schema)s (signature TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS %(documents)s (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                django_ct TEXT NOT NULL,
+                django_id TEXT NOT NULL,
+                stored TEXT NOT NULL%(columns)s);
+            CREATE INDEX IF NOT EXISTS %(documents)s_django_ct ON %(documents)s (django_ct);
+            %(column_indexes)s
+            CREATE VIRTUAL TABLE IF NOT EXISTS %(text)s USING fts5(%(text_columns)s, tokenize='porter unicode61');
+            CREATE TABLE IF NOT EXISTS %(facets)s (
+                document INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS %(facets)s_field_value ON %(facets)s (field, value);
+            CREATE INDEX IF NOT EXISTS %(facets)s_document ON %(facets)s (document);
+        ''' % {
+            'schema': self.SCHEMA_TABLE,
+            'documents': self.DOCUMENTS_TABLE,
+            'text': self.TEXT_TABLE,
+            'facets': self.FACETS_TABLE,
+            'columns': columns,
+            'column_indexes': column_indexes,
+            'text_columns': ', '.join(self.text_fields),
+        }
+
+    # Indexing
+
+    def update(self, index, iterable, commit=True):
+        docs = []
+        for obj in iterable:
+            try:
+                docs.append(index.full_prepare(obj))
+            except Exception, e:
+                if not self.silently_fail:
+                    raise
+
+                log.error(u"%s while preparing object for update" % e.__class__.__name__, exc_info=True, extra={
+                    "data": {
+                        "index": index,
+                        "object": get_identifier(obj)
+                    }
+                })
+
+        self.add_documents(docs)
+
+    def add_documents(self, docs):
+        """
+        Add prepared documents to the index, replacing any documents with the
+        same identifiers, all in one transaction.
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        conn = self.connect()
+        try:
+            with conn:
+                for doc in docs:
+                    self.delete_documents(conn, [doc[ID]])
+                    self.insert_document(conn, doc)
+        finally:
+            conn.close()
+
+    def insert_document(self, conn, doc):
+        stored = {}
+        for name, value in doc.items():
+            field = self.fields.get(name)
+            if field is None or not field.stored:
+                continue
+            # The document field is usually the biggest one, and it can be
+            # read back from the text table.
+            if name == self.content_field_name and name in self.text_fields:
+                continue
+            stored[name] = self._from_python(value)
+
+        column_names = ''.join(', "f_%s"' % name for name in self.column_fields)
+        column_values = [self._from_python(doc.get(name)) for name in self.column_fields]
+        cursor = conn.execute(
+            'INSERT INTO %s (id, django_ct, django_id, stored%s) VALUES (?, ?, ?, ?%s)' %
+            (self.DOCUMENTS_TABLE, column_names, ', ?' * len(column_values)),
+            [doc[ID], doc[DJANGO_CT], doc[DJANGO_ID], json.dumps(stored)] + column_values)
+        rowid = cursor.lastrowid
+
+        conn.execute(
+            'INSERT INTO %s (rowid, %s) VALUES (?%s)' %
+            (self.TEXT_TABLE, ', '.join(self.text_fields), ', ?' * len(self.text_fields)),
+            [rowid] + [self._to_text(doc.get(name)) for name in self.text_fields])
+
+        facet_rows = []
+        for name in self.facet_fields:
+            values = doc.get(name)
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            facet_rows.extend((rowid, name, force_unicode(self._from_python(value)))
+                              for value in values)
+        conn.executemany('INSERT INTO %s (document, field, value) VALUES (?, ?, ?)' %
+                         self.FACETS_TABLE, facet_rows)
+
+    def delete_documents(self, conn, identifiers=None, where=None):
+        if identifiers is not None:
+            where = 'id IN (%s)' % ', '.join(sql_literal(i) for i in identifiers)
+
+        rowids = 'SELECT rowid FROM %s WHERE %s' % (self.DOCUMENTS_TABLE, where)
+        conn.execute('DELETE FROM %s WHERE rowid IN (%s)' % (self.TEXT_TABLE, rowids))
+        conn.execute('DELETE FROM %s WHERE document IN (%s)' % (self.FACETS_TABLE, rowids))
+        conn.execute('DELETE FROM %s WHERE %s' % (self.DOCUMENTS_TABLE, where))
+
+    def remove(self, obj_or_string, commit=True):
+        if not self.setup_complete:
+            self.setup()
+
+        conn = self.connect()
+        try:
+            with conn:
+                self.delete_documents(conn, [get_identifier(obj_or_string)])
+        except sqlite3.Error, e:
+            if not self.silently_fail:
+                raise
+
+            log.error("Failed to remove document '%s' from SQLite: %s", get_identifier(obj_or_string), e)
+        finally:
+            conn.close()
+
+    def clear(self, models=[], commit=True):
+        if not models:
+            self.delete_index()
+            return
+
+        if not self.setup_complete:
+            self.setup()
+
+        model_cts = ['%s.%s' % (model._meta.app_label, model._meta.module_name) for model in models]
+        conn = self.connect()
+        try:
+            with conn:
+                self.delete_documents(conn, where='django_ct IN (%s)' %
+                                      ', '.join(sql_literal(ct) for ct in model_cts))
+        finally:
+            conn.close()
+
+    def delete_index(self):
+        """
+        Drop the index tables and create them again.  This also picks up any
+        changes to the fields of the search indexes.
+        """
+        conn = self.connect()
+        try:
+            conn.executescript(''.join('DROP TABLE IF EXISTS %s;' % table for table in
+                                       [self.SCHEMA_TABLE, self.DOCUMENTS_TABLE,
+                                        self.TEXT_TABLE, self.FACETS_TABLE]))
+        finally:
+            conn.close()
+
+        self.setup()
+
+    # Searching
+
+    @log_query
+    def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
+               fields='', highlight=False, facets=None, date_facets=None, query_facets=None,
+               narrow_queries=None, spelling_query=None, within=None,
+               dwithin=None, distance_point=None, models=None,
+               limit_to_registered_models=None, result_class=None, **kwargs):
+        if not self.setup_complete:
+            self.setup()
+
+        if not query_string:
+            return {
+                'results': [],
+                'hits': 0,
+            }
+
+        if date_facets:
+            warnings.warn("The SQLite backend does not handle date faceting.", Warning, stacklevel=2)
+
+        if query_facets:
+            warnings.warn("The SQLite backend does not handle query faceting.", Warning, stacklevel=2)
+
+        if narrow_queries:
+            raise SearchBackendError("The SQLite backend does not handle narrow queries; use filter instead.")
+
+        conditions = [u'(%s)' % query_string]
+
+        if limit_to_registered_models is None:
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+
+        if models and len(models):
+            model_choices = sorted(['%s.%s' % (model._meta.app_label, model._meta.module_name) for model in models])
+        elif limit_to_registered_models:
+            model_choices = self.build_models_list()
+        else:
+            model_choices = []
+
+        if model_choices:
+            conditions.append(u'd.django_ct IN (%s)' % ', '.join(sql_literal(ct) for ct in model_choices))
+
+        where = u' AND '.join(conditions)
+
+        if start_offset is None:
+            start_offset = 0
+
+        limit = -1 if end_offset is None else max(end_offset - start_offset, 0)
+
+        conn = self.connect()
+        try:
+            try:
+                hits = conn.execute(u'SELECT COUNT(*) FROM %s d WHERE %s' %
+                                    (self.DOCUMENTS_TABLE, where)).fetchone()[0]
+
+                rows = conn.execute(u'SELECT d.rowid, d.django_ct, d.django_id, d.stored FROM %s d WHERE %s ORDER BY %s LIMIT %d OFFSET %d' %
+                                    (self.DOCUMENTS_TABLE, where, self.build_order_by(sort_by), limit, start_offset)).fetchall()
+
+                content = self.get_content(conn, [row[0] for row in rows])
+
+                facet_counts = {}
+                if facets:
+                    facet_counts['fields'] = self.get_facet_counts(conn, where, facets)
+            except sqlite3.OperationalError, e:
+                if not self.silently_fail:
+                    raise
+
+                log.error("Failed to query SQLite using '%s': %s", query_string, e)
+                return {
+                    'results': [],
+                    'hits': 0,
+                }
+        finally:
+            conn.close()
+
+        return self._process_results(rows, hits, content, facet_counts, result_class)
+
+    def build_order_by(self, sort_by):
+        order_by = []
+        for field_name in (sort_by or []):
+            direction = 'ASC'
+            if field_name.startswith('-'):
+                field_name = field_name[1:]
+                direction = 'DESC'
+
+            if field_name in self.column_fields:
+                column = 'd."f_%s"' % field_name
+            elif field_name in (ID, DJANGO_CT, DJANGO_ID):
+                column = 'd.%s' % field_name
+            else:
+                raise SearchBackendError("The SQLite backend can only order by date, number and boolean fields, not '%s'." % field_name)
+
+            order_by.append('%s %s' % (column, direction))
+
+        # Fall back on the order that documents were indexed in.
+        order_by.append('d.rowid')
+        return ', '.join(order_by)
+
+    def get_content(self, conn, rowids):
+        """
+        Read the document field of each of the given rows back from the text
+        table.
+        """
+        if (not rowids or self.content_field_name not in self.text_fields
+                or not self.fields[self.content_field_name].stored):
+            return {}
+
+        return dict(conn.execute('SELECT rowid, %s FROM %s WHERE rowid IN (%s)' %
+                                 (self.content_field_name, self.TEXT_TABLE,
+                                  ', '.join(str(rowid) for rowid in rowids))).fetchall())
+
+    def get_facet_counts(self, conn, where, facets):
+        counts = {}
+        for field_name in facets:
+            if field_name not in self.facet_fields:
+                raise SearchBackendError("'%s' is not a facet field." % field_name)
+
+            counts[field_name] = conn.execute(
+                u'SELECT value, COUNT(*) FROM %s WHERE field = ? AND document IN (SELECT d.rowid FROM %s d WHERE %s) GROUP BY value ORDER BY COUNT(*) DESC, value' %
+                (self.FACETS_TABLE, self.DOCUMENTS_TABLE, where), (field_name,)).fetchall()
+        return counts
+
+    def _process_results(self, rows, hits, content, facet_counts, result_class=None):
+        from haystack import connections
+        unified_index = connections[self.connection_alias].get_unified_index()
+        indexed_models = unified_index.get_indexed_models()
+
+        if result_class is None:
+            result_class = SearchResult
+
+        results = []
+        for rowid, django_ct, django_id, stored in rows:
+            app_label, model_name = django_ct.split('.')
+            model = get_model(app_label, model_name)
+
+            if model and model in indexed_models:
+                index = unified_index.get_index(model)
+                additional_fields = {}
+
+                values = json.loads(stored)
+                if rowid in content:
+                    values[self.content_field_name] = content[rowid]
+
+                for key, value in values.items():
+                    string_key = str(key)
+                    if string_key in index.fields:
+                        additional_fields[string_key] = index.fields[string_key].convert(value)
+                    else:
+                        additional_fields[string_key] = value
+
+                results.append(result_class(app_label, model_name, django_id, 0, **additional_fields))
+            else:
+                hits -= 1
+
+        return {
+            'results': results,
+            'hits': hits,
+            'facets': facet_counts,
+            'spelling_suggestion': None,
+        }
+
+    # Values
+
+    def _from_python(self, value):
+        """
+        Convert a prepared value into something that can be stored in SQLite
+        or JSON.  Dates are stored in ISO 8601 format, so that they sort and
+        compare correctly as text, and so that haystack's fields can convert
+        them back.
+        """
+        if hasattr(value, 'strftime'):
+            if hasattr(value, 'hour'):
+                return value.strftime('%Y-%m-%dT%H:%M:%S')
+            else:
+                return value.strftime('%Y-%m-%dT00:00:00')
+        elif isinstance(value, bool):
+            return 1 if value else 0
+        elif isinstance(value, (list, tuple, set)):
+            return [self._from_python(item) for item in value]
+        elif isinstance(value, (int, long, float)) or value is None:
+            return value
+        else:
+            return force_unicode(value)
+
+    def _to_text(self, value):
+        if value is None:
+            return u''
+        elif isinstance(value, (list, tuple, set)):
+            return u' '.join(force_unicode(self._from_python(item)) for item in value)
+        else:
+            return force_unicode(self._from_python(value))
+
+
+class SQLiteSearchQuery (BaseSearchQuery):
+    """
+    Builds searches as SQL conditions on the documents table (aliased 'd'),
+    for the SQLiteSearchBackend.
+    """
+
+    def matching_all_fragment(self):
+        return '1'
+
+    def raw_search(self, query_string, **kwargs):
+        """
+        Run a raw FTS5 query against the document field.
+        """
+        self.backend_setup()
+        super(SQLiteSearchQuery, self).raw_search(
+            self.build_match(u'%s : (%s)' % (self.backend.content_field_name, query_string)),
+            **kwargs)
+
+    def backend_setup(self):
+        if not self.backend.setup_complete:
+            self.backend.setup()
+
+    def build_query_fragment(self, field, filter_type, value):
+        from haystack import connections
+        self.backend_setup()
+
+        if not hasattr(value, 'input_type_name'):
+            # Handle when we've got a ``ValuesListQuerySet``...
+            if hasattr(value, 'values_list'):
+                value = list(value)
+
+            if isinstance(value, basestring):
+                # It's not an ``InputType``. Assume ``Clean``.
+                value = Clean(value)
+            else:
+                value = PythonData(value)
+
+        # 'content' is a special reserved word, much like 'pk' in
+        # Django's ORM layer. It indicates 'no special field'.
+        if field == 'content':
+            index_fieldname = self.backend.content_field_name
+        else:
+            index_fieldname = connections[self._using].get_unified_index().get_index_fieldname(field)
+
+        if index_fieldname in self.backend.text_fields:
+            return self.build_text_fragment(index_fieldname, filter_type, value)
+        elif index_fieldname in self.backend.column_fields:
+            return self.build_value_fragment('d."f_%s"' % index_fieldname, filter_type, value.query_string)
+        elif index_fieldname in (ID, DJANGO_CT, DJANGO_ID):
+            return self.build_value_fragment('d.%s' % index_fieldname, filter_type, value.query_string)
+        elif index_fieldname in self.backend.facet_fields:
+            return u'd.rowid IN (SELECT document FROM %s WHERE field = %s AND %s)' % (
+                self.backend.FACETS_TABLE, sql_literal(index_fieldname),
+                self.build_value_fragment('value', filter_type, value.query_string))
+        else:
+            raise SearchBackendError("The field '%s' can't be searched on; it isn't indexed." % field)
+
+    def build_text_fragment(self, column, filter_type, value):
+        query_string = value.query_string
+
+        if value.input_type_name == 'auto_query':
+            required, excluded = parse_auto_query(query_string)
+            conditions = []
+            if required:
+                conditions.append(self.build_match(u' AND '.join(
+                    self.column_phrase(column, phrase) for phrase in required)))
+            if excluded:
+                conditions.append(u'NOT ' + self.build_match(u' OR '.join(
+                    self.column_phrase(column, phrase) for phrase in excluded)))
+            return u' AND '.join(conditions) if conditions else u'0'
+
+        elif value.input_type_name == 'raw':
+            return self.build_match(u'%s : (%s)' % (column, query_string))
+
+        elif value.input_type_name == 'not':
+            return u'NOT ' + self.build_match(self.column_phrase(column, query_string))
+
+        if filter_type == 'in':
+            phrases = [self.column_phrase(column, item) for item in query_string
+                       if WORD_RE.search(force_unicode(item))]
+            return self.build_match(u' OR '.join(phrases)) if phrases else u'0'
+
+        elif filter_type in ('contains', 'startswith', 'exact'):
+            if value.input_type_name == 'exact' or filter_type == 'exact':
+                words = [force_unicode(query_string)]
+            else:
+                words = force_unicode(query_string).split()
+
+            words = [word for word in words if WORD_RE.search(word)]
+            if not words:
+                return u'0'
+
+            return self.build_match(u' AND '.join(
+                self.column_phrase(column, word, prefix=(filter_type == 'startswith'))
+                for word in words))
+
+        else:
+            raise SearchBackendError("The SQLite backend can't filter the text field '%s' with '%s'." % (column, filter_type))
+
+    def build_value_fragment(self, column, filter_type, value):
+        from_python = self.backend._from_python
+
+        if filter_type in ('contains', 'exact'):
+            return u'%s = %s' % (column, sql_literal(from_python(value)))
+        elif filter_type == 'startswith':
+            return u"%s LIKE %s ESCAPE '\\'" % (column, sql_literal(
+                re.sub(r'([\\%_])', r'\\\1', force_unicode(from_python(value))) + u'%'))
+        elif filter_type in ('gt', 'gte', 'lt', 'lte'):
+            operator = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}[filter_type]
+            return u'%s %s %s' % (column, operator, sql_literal(from_python(value)))
+        elif filter_type == 'in':
+            values = [sql_literal(from_python(item)) for item in value]
+            return u'%s IN (%s)' % (column, ', '.join(values)) if values else u'0'
+        elif filter_type == 'range':
+            start, end = value
+            return u'%s BETWEEN %s AND %s' % (column, sql_literal(from_python(start)),
+                                              sql_literal(from_python(end)))
+        else:
+            raise SearchBackendError("The SQLite backend can't filter '%s' with '%s'." % (column, filter_type))
+
+    def column_phrase(self, column, text, prefix=False):
+        return u'%s : %s' % (column, fts_phrase(text, prefix))
+
+    def build_match(self, expression):
+        return u'd.rowid IN (SELECT rowid FROM %s WHERE %s MATCH %s)' % (
+            self.backend.TEXT_TABLE, self.backend.TEXT_TABLE, sql_literal(expression))
+
+
+class SQLiteEngine (BaseEngine):
+    backend = SQLiteSearchBackend
+    query = SQLiteSearchQuery
@@ -1,23 +1,31 @@
 import json
 import logging as log
-from collections import defaultdict, namedtuple
+from collections import defaultdict
 from django.contrib.syndication.views import Feed as DjangoFeed
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.views import generic as views
 from django.core.cache import cache
 from django.core.urlresolvers import reverse_lazy
+from django.db.models import get_model
+from django.utils.feedgenerator import Rss201rev2Feed
 from django.utils.translation import ugettext as _
-from haystack.query import SearchQuerySet, RelatedSearchQuerySet
+from haystack.query import SearchQuerySet, RelatedSearchQuerySet, SQ
 import datetime
 from datetime import timedelta
 
 from . import feeds
 from . import forms
+from . import pagination
+from . import search_cache
+from phillyleg.cities import get_current_city
 from phillyleg.models import MetaData_Topic, LegFile, CouncilMember
+from phillyleg.search_indexes import StoredLegFile, city_search_queryset
 
 import haystack.views
 import bookmarks.views
 import opinions.views
+import phillyleg.analytics
 import phillyleg.models
 import subscriptions.forms
 import subscriptions.models
@@ -36,14 +44,51 @@ def get_or_cache(cache_key, getter_func):
     return val
 
 
-class NewLegislationFeed (DjangoFeed):
+class PagedRssFeed (Rss201rev2Feed):
+    """
+    An RSS feed that links to its next page, if it has one.
+    """
+    def add_root_elements(self, handler):
+        super(PagedRssFeed, self).add_root_elements(handler)
+        if self.feed.get('next_url'):
+            handler.addQuickElement(u'atom:link', None,
+                                    {u'rel': u'next', u'href': self.feed['next_url']})
+
+
+class PagedFeedMixin (object):
+    """
+    For feeds whose object is a KeysetPage (see councilmatic.pagination).
+    """
+    feed_type = PagedRssFeed
+
+    def items(self, page):
+        return page.object_list
+
+    def feed_extra_kwargs(self, page):
+        return {'next_url': page.next_url}
+
+    def set_page_urls(self, request, page):
+        page.next_url = request.build_absolute_uri(
+            pagination.page_url(request, page.next_cursor)) if page.has_next() else None
+
+
+class NewLegislationFeed (PagedFeedMixin, DjangoFeed):
     title = u'New Legislation'
     link = 'http://localhost:8000'
     description = u'Newly introduced legislation'
     max_items = 100
 
-    def items(self):
-        return phillyleg.models.LegFile.objects.all().exclude(title='')[:self.max_items]
+    def get_object(self, request):
+        paginator = pagination.KeysetPaginator(
+            phillyleg.models.LegFile.objects.filter(city=get_current_city()).exclude(title=''),
+            ['-intro_date', '-key'], self.max_items)
+        try:
+            page = paginator.page(request.GET.get(pagination.CURSOR_PARAM))
+        except ValueError, e:
+            raise Http404(e)
+
+        self.set_page_urls(request, page)
+        return page
 
     def item_title(self, legfile):
         return u'{0.type} {0.id}'.format(legfile)
@@ -115,13 +160,14 @@ class AppDashboardView (BaseDashboardMixin,
     template_name = 'councilmatic/dashboard.html'
 
     def get_recent_legislation(self):
-        return phillyleg.models.LegFile.objects.all() \
+        return phillyleg.models.LegFile.objects.filter(city=get_current_city()) \
             .exclude(title='') \
             .prefetch_related('metadata__topics')
 
     def get_recent_locations(self):
         return list(phillyleg.models.MetaData_Location.objects.\
-                       all().filter(valid=True).order_by('-pk')[:10].\
+                       filter(references_in_legislation__legfile__city=get_current_city()).\
+                       filter(valid=True).distinct().order_by('-pk')[:10].\
                        prefetch_related('references_in_legislation'))
 
     def get_recent_topics(self):
@@ -135,10 +181,11 @@ class AppDashboardView (BaseDashboardMixin,
         JOIN phillyleg_legfilemetadata ON phillyleg_legfilemetadata.id = phillyleg_legfilemetadata_topics.legfilemetadata_id
         JOIN phillyleg_legfile ON phillyleg_legfile.key = phillyleg_legfilemetadata.legfile_id
         WHERE phillyleg_legfile.intro_date > '{date_string}' AND phillyleg_metadata_topic.topic != 'Routine'
+          AND phillyleg_legfile.city = %s
         GROUP BY phillyleg_metadata_topic.topic, phillyleg_metadata_topic.id
         ORDER BY leg_count DESC""".format(date_string=date_string)
 
-        return list(phillyleg.models.MetaData_Topic.objects.raw(topic_count_query))
+        return list(phillyleg.models.MetaData_Topic.objects.raw(topic_count_query, [get_current_city()]))
 
 
     def get_context_data(self, **kwargs):
@@ -158,7 +205,7 @@ class CouncilMembersView(views.TemplateView):
     template_name = 'councilmatic/councilmembers.html'
 
     def get_councilmember_groups(self):
-        cms = phillyleg.models.CouncilMember.objects.all() \
+        cms = phillyleg.models.CouncilMember.objects.filter(city=get_current_city()) \
             .prefetch_related('tenures') \
             .order_by('real_name')
 
@@ -184,6 +231,10 @@ class CouncilMemberDetailView (BaseDashboardMixin,
     queryset = phillyleg.models.CouncilMember.objects.prefetch_related('tenures', 'tenures__district')
     template_name = 'councilmatic/councilmember_detail.html'
 
+    def get_queryset(self):
+        return super(CouncilMemberDetailView, self).get_queryset()\
+                   .filter(city=get_current_city())
+
     def get_content_feed(self):
         return feeds.SearchResultsFeed(search_filter={'sponsors': [self.object.real_name]})
 
@@ -207,17 +258,57 @@ class CouncilMemberDetailView (BaseDashboardMixin,
 
         return phillyleg.models.MetaData_Topic.objects.raw(topic_count_query)
 
+    def get_voting_record(self):
+        # The summary is only built by the updatevotematrix command.
+        summary = phillyleg.analytics.get_vote_summary()
+        if summary is None:
+            return None
+
+        record = summary['members'].get(self.object.pk)
+        if record is None:
+            return None
+
+        bloc = []
+        if record['bloc'] is not None:
+            bloc = [member_id for member_id in summary['blocs'][record['bloc']]
+                    if member_id != self.object.pk]
+
+        agreement = record['agreement']
+        most_agreeing, least_agreeing = agreement[:3], agreement[-3:][::-1]
+        members = phillyleg.models.CouncilMember.objects.in_bulk(
+            bloc + [item[0] for item in most_agreeing + least_agreeing])
+
+        def with_members(items):
+            return [(members[member_id], int(round(score * 100)))
+                    for member_id, score, _, _ in items if member_id in members]
+
+        return {
+            'votes': record['votes'],
+            'present': record['present'],
+            'most_agreeing': with_members(most_agreeing),
+            'least_agreeing': with_members(least_agreeing),
+            'bloc': [members[member_id] for member_id in bloc if member_id in members],
+        }
+
     def get_context_data(self, **kwargs):
         district = self.get_district()
         context_data = super(CouncilMemberDetailView, self).get_context_data(**kwargs)
         context_data['district'] = district
         context_data['recent_topics'] = self.get_topics()
+        context_data['voting_record'] = self.get_voting_record()
+        context_data['district_legislation'] = district and district.local_legislation()[:6]
         return context_data
 
 
 class SearcherMixin (object):
+    load_objects = False
+    """Whether to load each search result's object from the database, instead
+       of listing results from their stored fields"""
+
+    page_size = 20
+
     def get_search_queryset(self):
-        return SearchQuerySet()
+        return city_search_queryset()
 
     def get_search_form_class(self):
         return forms.FullSearchForm
@@ -236,62 +327,118 @@ class SearcherMixin (object):
 
         # TODO: Check is_valid
         self.form = self.get_search_form(request)
-        self.results = self.form.search().order_by('-order_date')
-
-    def _get_search_results(self, query_params):
-        class SQSProxy (object):
-            """
-            Make a SearchQuerySet look enough like a QuerySet for a ListView
-            not to notice the difference.
-            """
-            def __init__(self, sqs):
-                self.sqs = sqs
-            def __len__(self):
-                return self.sqs.count()
-            count = __len__
-            def __iter__(self):
-                return (result.object for result in self.sqs.load_all())
-            def __getitem__(self, key):
-                if isinstance(key, slice):
-                    # Collect all the results in the slice, storing the id
-                    # and the model of the object.
-                    ResultSummary = namedtuple('ResultSummary', 'model id')
-                    results = [ResultSummary(result.model, str(result.file_id)) for result in
-                               self.sqs[key] if result is not None]
-
-                    # For each model, do a query for the objects of that model
-                    # type and map them by key.
-                    models = set([result.model for result in results])
-                    objs_by_id = {}
-                    for model in models:
-                        ids = [result.id for result in results if result.model is model]
-                        objs = model.objects.filter(id__in=ids)\
-                            .select_related('metadata')\
-                            .prefetch_related('metadata__topics')\
-                            .prefetch_related('metadata__locations')
-                        objs_by_id.update(
-                            {str(obj.id): obj for obj in objs}
-                        )
-
-                    # To preserve search query order, pull the objects out of
-                    # the map according to the order of the results.
-                    return [objs_by_id[result.id] for result in results if result.id in objs_by_id]
-                else:
-                    return self.sqs[key].object
-
-        objs = SQSProxy(self.results)
-        return objs
-
-
-class LegFileListFeedView (SearcherMixin, DjangoFeed):
+
+        self.results = self.form.search().order_by(*self.get_search_ordering())
+        self.cached_results = search_cache.CachedSearch(self.results, request.GET)
+
+    def get_search_ordering(self):
+        """
+        Results are ordered by key within a date, so that each one has a
+        distinct position to page from.
+        """
+        # Haystack's Whoosh backend can only reverse a sort as a whole, so
+        # sorting by the date in reverse sorts by the key in reverse too.
+        backend = self.get_search_queryset().query.backend
+        if type(backend).__module__ == 'haystack.backends.whoosh_backend':
+            return ['-order_date', 'key']
+        return ['-order_date', '-key']
+
+    def get_search_page(self, cursor):
+        """
+        The page of search results after the position in the cursor (see
+        councilmatic.pagination), as a KeysetPage.  Pages are listed from the
+        cached results where possible, and otherwise by searching for the
+        results after the cursor's (order_date, key).
+        """
+        after = None
+        if cursor:
+            try:
+                after = pagination.parse_cursor(
+                    cursor, [LegFile._meta.get_field('intro_date'), LegFile._meta.pk])
+            except ValueError, e:
+                raise Http404(e)
+
+        # Get one more result than fits, to see whether there's a next page.
+        ids = self.cached_results.get_ids_after(after and after[1], self.page_size + 1)
+        if ids is not None:
+            has_next = len(ids) > self.page_size
+            ids = ids[:self.page_size]
+
+            # List the results from their cached stored fields, as
+            # result_objects does with fresh results.
+            objs = None
+            if not self.load_objects:
+                objs = self.cached_results.get_stored_objects(ids)
+            if objs is None:
+                objs = self.fetch_objects([(get_model(*label.split('.')), pk)
+                                           for label, pk in ids])
+        else:
+            sqs = self.results
+            if after:
+                # Dates and keys are both whole numbers of something, so rather
+                # than being before a value, they are at most the one before
+                # it; Whoosh doesn't keep ranges open at the end.  Dates are
+                # matched as a range because not every backend can match them
+                # exactly.
+                order_date, key = after
+                sqs = sqs.filter(
+                    SQ(order_date__lte=order_date - datetime.timedelta(days=1)) |
+                    SQ(order_date__gte=order_date, order_date__lte=order_date,
+                       key__lte=key - 1))
+            results = [result for result in sqs[:self.page_size + 1]
+                       if result is not None]
+            has_next = len(results) > self.page_size
+            objs = self.result_objects(results[:self.page_size])
+
+        next_cursor = None
+        if has_next and objs:
+            next_cursor = pagination.make_cursor([objs[-1].intro_date, objs[-1].key])
+        return pagination.KeysetPage(objs, next_cursor, self.cached_results)
+
+    def result_objects(self, results):
+        """
+        The objects for a list of search results.
+        """
+        # If every result has its fields stored, list the results straight
+        # from those.
+        if not self.load_objects and all(StoredLegFile.can_load(result)
+                                         for result in results):
+            return [StoredLegFile(result) for result in results]
+
+        return self.fetch_objects([(result.model, result.pk) for result in results])
+
+    def fetch_objects(self, results):
+        """
+        Load the objects for a list of (model, key) pairs, in order.
+        """
+        # For each model, do a query for the objects of that model type and
+        # map them by key.
+        models = set([model for model, _ in results])
+        objs_by_key = {}
+        for model in models:
+            keys = [pk for result_model, pk in results if result_model is model]
+            objs = model.objects.filter(pk__in=keys)\
+                .select_related('metadata')\
+                .prefetch_related('metadata__topics')\
+                .prefetch_related('metadata__locations')
+            objs_by_key.update(
+                {(model, str(obj.pk)): obj for obj in objs}
+            )
+
+        # To preserve search query order, pull the objects out of the map
+        # according to the order of the results.
+        results = [(model, str(pk)) for model, pk in results]
+        return [objs_by_key[result] for result in results if result in objs_by_key]
+
+
+class LegFileListFeedView (SearcherMixin, PagedFeedMixin, DjangoFeed):
+    page_size = 100
+
     def get_object(self, request, *args, **kwargs):
         self._init_haystack_search(request)
-        query_params = request.GET.copy()
-        search_queryset = self._get_search_results(query_params)
-        return search_queryset
-
-    def items(self, obj):
-        return obj[:100]
+        page = self.get_search_page(request.GET.get(pagination.CURSOR_PARAM))
+        self.set_page_urls(request, page)
+        return page
 
     def title(self, obj):
         'testing'
@@ -306,7 +453,6 @@ class SearchView (SearcherMixin,
                   bookmarks.views.BaseBookmarkMixin,
                   views.ListView):
     template_name = 'councilmatic/search.html'
-    paginate_by = 20
     feed_data = None
 
     def dispatch(self, request, *args, **kwargs):
@@ -318,41 +464,21 @@ class SearchView (SearcherMixin,
         return feeds.SearchResultsFeed(search_filter=search_params)
 
     def get_queryset(self):
-        query_params = self.request.GET.copy()
-        if 'page' in query_params:
-            del query_params['page']
-        search_queryset = self._get_search_results(query_params)
-        return search_queryset
+        self.page = self.get_search_page(
+            self.request.GET.get(pagination.CURSOR_PARAM))
+        return self.page.object_list
 
-    def get_pages_context_data(self, page_obj, query_params):
-        context = {}
-        if page_obj:
-            context['first_url'] = self.paginated_url(
-                1, query_params)
-
-            context['last_url'] = self.paginated_url(
-                page_obj.paginator.num_pages, query_params)
-
-            if page_obj.has_next():
-                context['next_url'] = self.paginated_url(
-                    page_obj.next_page_number(), query_params)
-
-            if page_obj.has_previous():
-                context['previous_url'] = self.paginated_url(
-                    page_obj.previous_page_number(), query_params)
-
-            page_urls = []
-            start_num = max(1, min(page_obj.number - 5,
-                                   page_obj.paginator.num_pages - 9))
-            end_num = min(start_num + 10, page_obj.paginator.num_pages + 1)
-
-            for page_num in range(start_num, end_num):
-                if page_num != page_obj.number:
-                    url = self.paginated_url(page_num, query_params)
-                else:
-                    url = None
-                page_urls.append((page_num, url))
-            context['page_urls'] = page_urls
+    def get_pages_context_data(self, page):
+        context = {
+            'page': page,
+            'result_count': self.cached_results.count(),
+        }
+
+        if self.request.GET.get(pagination.CURSOR_PARAM):
+            context['first_url'] = pagination.page_url(self.request, None)
+
+        if page.has_next():
+            context['next_url'] = pagination.page_url(self.request, page.next_cursor)
         return context
 
     def get_context_data(self, **kwargs):
@@ -362,40 +488,38 @@ class SearchView (SearcherMixin,
         context = super(SearchView, self).get_context_data(**kwargs)
         context['form'] = self.form
 
-        page_obj = context.get('page_obj', None)
-        query_params = self.request.GET.copy()
-        if 'page' in query_params:
-            del query_params['page']
-
-        context.update(self.get_pages_context_data(page_obj, query_params))
+        context.update(self.get_pages_context_data(self.page))
 
-        bookmark_data = self.get_bookmarks_data(page_obj.object_list)
+        bookmark_data = self.get_bookmarks_data(self.page.object_list)
         bookmark_cache_key = self.get_bookmarks_cache_key(bookmark_data)
 
         context['bookmark_cache_key'] = bookmark_cache_key
         context['bookmark_data'] = bookmark_data
 
-        context['topics'] = get_or_cache('search_topics',
-            lambda: [(topic.topic, topic.topic)
-                     for topic in MetaData_Topic.objects.all().order_by('topic')])
-        context['statuses'] = get_or_cache('search_statuses',
-            lambda: legfile_choices('status'))
-        context['controlling_bodies'] = get_or_cache('search_controlling_bodies',
-            lambda: legfile_choices('controlling_body'))
-        context['file_types'] = get_or_cache('search_file_types',
-            lambda: legfile_choices('type'))
-        context['sponsors'] = get_or_cache('search_sponsors',
-            lambda: [(member.real_name, member.real_name)
-                     for member in CouncilMember.objects.all().order_by('real_name')])
-        
+        context.update(self.get_facets_context_data())
+
         log.debug(context)
         return context
 
-    def paginated_url(self, page_num, query_params):
-        url = '{0}?page={1}'.format(self.request.path, page_num)
-        if query_params:
-            url += '&' + query_params.urlencode()
-        return url
+    def get_facets_context_data(self):
+        """
+        The choices for each facet field, labeled with the number of results
+        of the current search that have each value (if the search backend
+        can count them).
+        """
+        choices = forms.search_facet_choices()
+        counts = self.cached_results.facet_counts(forms.facet_counts)
+
+        context = {}
+        for form_field, _, _ in forms.SEARCH_FACETS:
+            if counts is None:
+                context[form_field] = choices[form_field]
+            else:
+                field_counts = dict(counts[form_field])
+                context[form_field] = [
+                    (value, u'%s (%s)' % (label, field_counts.get(value, 0)))
+                    for value, label in choices[form_field]]
+        return context
 
 
 class LegislationStatsMixin (object):
@@ -423,12 +547,13 @@ class LegislationDetailView (SearchBarMixin,
     def get_queryset(self):
         """Select all the data relevant to the legislation."""
         return self.model.objects\
-                   .all().select_related('metadata')\
+                   .filter(city=get_current_city()).select_related('metadata')\
                    .prefetch_related('actions', 'attachments', 'sponsors',
                                      'references_in_legislation',
                                      'metadata__locations',
                                      'metadata__mentioned_legfiles',
-                                     'metadata__topics')
+                                     'metadata__topics',
+                                     'related__related_legfile')
 
     def get_content_feed(self):
         legfile = self.object
@@ -446,10 +571,3 @@ class LegislationDetailView (SearchBarMixin,
 #        self.on_object_gotten(legfile)
 
 #        return legfile
-
-
-def legfile_choices(field):
-    value_objs = LegFile.objects.values(field).distinct().order_by(field)
-    values = [(value_obj[field], value_obj[field])
-          for value_obj in value_objs]
-    return values
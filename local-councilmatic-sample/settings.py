@@ -130,6 +130,10 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+
+    # Pick the city whose legislation to show by the request's host name (see
+    # phillyleg.cities).
+    'phillyleg.cities.CityMiddleware',
 )
 
 ###############################################################################
@@ -167,6 +171,27 @@ HAYSTACK_CONNECTIONS = {
 # error; i.e., http://stackoverflow.com/questions/7106016/too-many-sql-variables-error-in-django-witih-sqlite3
 HAYSTACK_ITERATOR_LOAD_PER_QUERY = 800
 
+# Queue changed legislation and minutes to be indexed in batches by the
+# processindexqueue command, instead of indexing each object as it's saved.
+HAYSTACK_SIGNAL_PROCESSOR = 'phillyleg.signals.QueuedSignalProcessor'
+
+# Read and write each city's documents in its own search connection, if it has
+# one (see phillyleg.cities).
+HAYSTACK_ROUTERS = ['phillyleg.cities.CityRouter']
+
+###############################################################################
+#
+# Vote analytics
+#
+
+# Where the matrix of council members' votes is saved between updates (see
+# phillyleg.analytics).
+VOTE_MATRIX_PATH = rel_path('vote_matrix.npz')
+
+# Where rendered map tiles are saved (see phillyleg.tiles).  Set this to None
+# to render every tile on request.
+TILE_CACHE_DIR = rel_path('tiles')
+
 ###############################################################################
 #
 # Applications
@@ -77,6 +77,14 @@ install_requires = [
 
 
 
+# ====================
+# Scraping
+# ====================
+
+# For parsing legislative file pages quickly
+'lxml',
+
+
 # ====================
 # External services
 # ====================